@@ -0,0 +1,34 @@
+"""add dirty_museum_objects
+
+Revision ID: 2b7c9e41d0f6
+Revises: 8e0d3c7f5a21
+Create Date: 2026-10-16 13:48:02.519377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b7c9e41d0f6'
+down_revision = '8e0d3c7f5a21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('dirty_museum_objects',
+    sa.Column('museum_object_id', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('museum_object_id', name=op.f('pk_dirty_museum_objects'))
+    )
+
+    # Mark every existing object so that the first 'sync-hashes' run
+    # after the upgrade processes all of them
+    op.execute(
+        "INSERT INTO dirty_museum_objects (museum_object_id) "
+        "SELECT id FROM museum_objects"
+    )
+
+
+def downgrade():
+    op.drop_table('dirty_museum_objects')
@@ -0,0 +1,25 @@
+"""add pgcrypto extension
+
+Revision ID: 8e0d3c7f5a21
+Revises: d31951fbbd60
+Create Date: 2026-10-16 11:02:15.704218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e0d3c7f5a21'
+down_revision = 'd31951fbbd60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Required by 'sync-hashes --in-database'
+    op.execute("CREATE EXTENSION IF NOT EXISTS pgcrypto")
+
+
+def downgrade():
+    pass
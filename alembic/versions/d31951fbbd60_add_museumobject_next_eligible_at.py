@@ -0,0 +1,69 @@
+"""add MuseumObject.next_eligible_at
+
+Revision ID: d31951fbbd60
+Revises: 156f33fadc35
+Create Date: 2026-10-16 09:12:40.183541
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from passari_workflow.config import PRESERVATION_DELAY, UPDATE_DELAY
+
+
+# revision identifiers, used by Alembic.
+revision = 'd31951fbbd60'
+down_revision = '156f33fadc35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('museum_objects', sa.Column('next_eligible_at', sa.DateTime(timezone=True), nullable=True))
+    op.create_index('ix_museum_objects_next_eligible_at', 'museum_objects', ['next_eligible_at'], unique=False, postgresql_where=sa.text('next_eligible_at IS NOT NULL'))
+
+    # Populate the field for existing objects
+    op.get_bind().execute(
+        sa.text("""
+            UPDATE museum_objects
+            SET next_eligible_at = eligible.next_eligible_at
+            FROM (
+                SELECT o.id AS id, CASE
+                    WHEN o.frozen IS NOT false
+                        OR o.metadata_hash IS NULL
+                        OR o.attachment_metadata_hash IS NULL
+                        THEN NULL
+                    WHEN o.latest_package_id IS NULL
+                        THEN coalesce(
+                            o.created_date + :preservation_delay,
+                            '1970-01-01 00:00:00+00'
+                        )
+                    WHEN p.cancelled = true
+                        THEN '1970-01-01 00:00:00+00'
+                    WHEN coalesce(p.object_modified_date, '0001-01-01')
+                            != coalesce(o.modified_date, '0001-01-01')
+                        AND (
+                            o.metadata_hash != p.metadata_hash
+                            OR o.attachment_metadata_hash
+                            != p.attachment_metadata_hash
+                        )
+                        THEN coalesce(
+                            p.object_modified_date + :update_delay,
+                            '1970-01-01 00:00:00+00'
+                        )
+                    ELSE NULL
+                END AS next_eligible_at
+                FROM museum_objects o
+                LEFT OUTER JOIN museum_packages p
+                    ON p.id = o.latest_package_id
+            ) AS eligible
+            WHERE museum_objects.id = eligible.id
+        """),
+        preservation_delay=PRESERVATION_DELAY,
+        update_delay=UPDATE_DELAY
+    )
+
+
+def downgrade():
+    op.drop_index('ix_museum_objects_next_eligible_at', table_name='museum_objects')
+    op.drop_column('museum_objects', 'next_eligible_at')
@@ -0,0 +1,137 @@
+"""
+Benchmark 'bulk_create_or_get' against the previous SELECT + INSERT + SELECT
+implementation.
+
+The benchmark is run against the database in the Passari Workflow
+configuration. All changes are rolled back afterwards, but using a separate
+database is still recommended.
+
+Usage:
+
+    $ python benchmarks/bulk_create_or_get.py --sizes 500,5000,50000
+"""
+import time
+
+import click
+
+from passari_workflow.db import DBSession
+from passari_workflow.db.connection import connect_db
+from passari_workflow.db.models import MuseumAttachment
+from passari_workflow.db.utils import bulk_create_or_get
+
+# Start from a high ID to avoid colliding with real entries
+FIRST_ID = 9000000000
+
+
+def legacy_bulk_create_or_get(session, mapper, ids):
+    """
+    Previous implementation of 'bulk_create_or_get' using three separate
+    queries
+    """
+    entries = list(
+        session.query(mapper)
+        .filter(mapper.id.in_(ids))
+    )
+    existing_ids = set([entry.id for entry in entries])
+    missing_ids = set(ids) - existing_ids
+
+    if missing_ids:
+        session.bulk_insert_mappings(
+            mapper,
+            [{"id": missing_id} for missing_id in missing_ids]
+        )
+        entries += list(
+            session.query(mapper)
+            .filter(mapper.id.in_(missing_ids))
+        )
+
+    return entries
+
+
+def run_benchmark(engine, func, size, existing_ratio):
+    """
+    Run a single benchmark inside a transaction that is rolled back
+    afterwards.
+
+    :returns: Elapsed time in seconds
+    """
+    ids = list(range(FIRST_ID, FIRST_ID + size))
+    existing_count = int(size * existing_ratio)
+
+    conn = engine.connect()
+    trans = conn.begin()
+    session = DBSession(bind=conn)
+
+    try:
+        if existing_count:
+            session.bulk_insert_mappings(
+                MuseumAttachment,
+                [{"id": id_} for id_ in ids[:existing_count]]
+            )
+            session.flush()
+
+        start = time.perf_counter()
+        entries = func(session, ids)
+        elapsed = time.perf_counter() - start
+
+        assert len(entries) == size
+    finally:
+        session.close()
+        trans.rollback()
+        conn.close()
+
+    return elapsed
+
+
+IMPLEMENTATIONS = [
+    (
+        "legacy",
+        lambda session, ids: legacy_bulk_create_or_get(
+            session, MuseumAttachment, ids
+        )
+    ),
+    (
+        "upsert",
+        lambda session, ids: bulk_create_or_get(
+            session, MuseumAttachment, ids
+        )
+    ),
+    (
+        "upsert (ids_only)",
+        lambda session, ids: bulk_create_or_get(
+            session, MuseumAttachment, ids, ids_only=True
+        )
+    )
+]
+
+
+@click.command()
+@click.option(
+    "--sizes", default="500,2000,10000,50000",
+    help="Comma-separated list of ID counts to benchmark"
+)
+@click.option(
+    "--existing-ratio", default=0.5, type=float,
+    help="Ratio of IDs that already exist in the database"
+)
+@click.option(
+    "--rounds", default=3, type=int,
+    help="How many times each benchmark is run. Best time is reported."
+)
+def cli(sizes, existing_ratio, rounds):
+    engine = connect_db()
+    sizes = [int(size) for size in sizes.split(",")]
+
+    print(f"{'size':>8} {'implementation':<20} {'best (s)':>10} {'ids/s':>12}")
+
+    for size in sizes:
+        for name, func in IMPLEMENTATIONS:
+            best = min(
+                run_benchmark(engine, func, size, existing_ratio)
+                for _ in range(0, rounds)
+            )
+            print(f"{size:>8} {name:<20} {best:>10.4f} {size / best:>12.0f}")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,134 @@
+"""
+Benchmark enqueuing objects using 'WorkflowQueue.enqueue_object_jobs'
+against enqueuing each object separately.
+
+The benchmark is run against the Redis server in the Passari Workflow
+configuration using a separate database, which is cleared of the
+benchmark's jobs afterwards. The workflow itself always uses the database 0,
+which cannot be used for the benchmark.
+
+Usage:
+
+    $ python benchmarks/enqueue.py --sizes 1000,10000,100000
+
+Use '--fake' to run the benchmark against an in-memory 'fakeredis'
+instance instead. This measures the client side only, as there are no
+network round trips.
+"""
+import time
+
+import click
+
+from passari_workflow.queue.queues import (OBJECT_INDEX_KEY, QueueType,
+                                           WorkflowQueue)
+from passari_workflow.redis.connection import get_redis_connection
+
+# Start from a high ID to avoid colliding with real objects
+FIRST_ID = 9000000000
+
+# The job function is not imported, as the jobs are never executed
+JOB_FUNC = "passari_workflow.jobs.download_object.download_object"
+
+
+def legacy_enqueue(queue, object_ids):
+    """
+    Previous implementation enqueuing each object separately
+    """
+    for object_id in object_ids:
+        queue.enqueue(
+            JOB_FUNC, kwargs={"object_id": object_id},
+            job_id=f"{queue.name}_{object_id}"
+        )
+
+
+def bulk_enqueue(queue, object_ids):
+    queue.enqueue_object_jobs(JOB_FUNC, object_ids)
+
+
+IMPLEMENTATIONS = [
+    ("legacy", legacy_enqueue),
+    ("pipelined", bulk_enqueue)
+]
+
+
+def clear_jobs(queue, object_ids):
+    """
+    Delete the jobs created by the benchmark
+    """
+    redis = queue.connection
+
+    with redis.pipeline(transaction=False) as pipe:
+        for object_id in object_ids:
+            pipe.delete(f"rq:job:{queue.name}_{object_id}")
+
+        pipe.delete(queue.key)
+        pipe.delete(OBJECT_INDEX_KEY)
+        pipe.execute()
+
+
+def run_benchmark(queue, func, size):
+    """
+    Run a single benchmark and delete the jobs afterwards
+
+    :returns: Elapsed time in seconds
+    """
+    object_ids = list(range(FIRST_ID, FIRST_ID + size))
+
+    try:
+        start = time.perf_counter()
+        func(queue, object_ids)
+        elapsed = time.perf_counter() - start
+
+        assert queue.count == size
+    finally:
+        clear_jobs(queue, object_ids)
+
+    return elapsed
+
+
+@click.command()
+@click.option(
+    "--sizes", default="1000,10000,100000",
+    help="Comma-separated list of object counts to benchmark"
+)
+@click.option(
+    "--redis-db", default=15, type=int,
+    help="Redis database used for the benchmark"
+)
+@click.option(
+    "--fake", is_flag=True, default=False,
+    help="Use an in-memory fakeredis instance instead of Redis"
+)
+@click.option(
+    "--rounds", default=1, type=int,
+    help="How many times each benchmark is run. Best time is reported."
+)
+def cli(sizes, redis_db, fake, rounds):
+    if fake:
+        import fakeredis
+        redis = fakeredis.FakeStrictRedis()
+    else:
+        if redis_db == 0:
+            raise click.BadParameter(
+                "Database 0 is used by the workflow", param_hint="--redis-db"
+            )
+        redis = get_redis_connection(db=redis_db)
+
+    queue = WorkflowQueue(QueueType.DOWNLOAD_OBJECT.value, connection=redis)
+    sizes = [int(size) for size in sizes.split(",")]
+
+    print(
+        f"{'size':>8} {'implementation':<15} {'best (s)':>10} "
+        f"{'jobs/s':>12}"
+    )
+
+    for size in sizes:
+        for name, func in IMPLEMENTATIONS:
+            best = min(
+                run_benchmark(queue, func, size) for _ in range(0, rounds)
+            )
+            print(f"{size:>8} {name:<15} {best:>10.4f} {size / best:>12.0f}")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,393 @@
+"""
+Local stand-in for the MuseumPlus REST API serving a synthetic catalogue.
+
+Only the parts of the API used for synchronization are implemented:
+creating a session and searching the 'Object' and 'Multimedia' modules
+with an offset, a limit and an optional '__lastModified' filter. The module
+items are modelled after 'tests/scripts/data/Object.xml'.
+
+The server is run in a separate thread with its own event loop, allowing
+it to be used from the same process as the synchronization scripts:
+
+    catalogue = Catalogue(objects=1000, attachments_per_object=2)
+    server = FakeMuseumPlusServer(catalogue, latency=0.05)
+    server.start()
+    ...
+    server.stop()
+"""
+import asyncio
+import datetime
+import hashlib
+import re
+import threading
+from xml.sax.saxutils import escape
+
+from aiohttp import web
+
+# Start from a high ID to avoid colliding with real entries
+FIRST_ID = 9000000000
+
+BASE_DATE = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+
+MODULE_NAMESPACE = "http://www.zetcom.com/ria/ws/module"
+SESSION_NAMESPACE = "http://www.zetcom.com/ria/ws/session"
+
+OBJECT_ITEM_TEMPLATE = """
+      <moduleItem hasAttachments="false" id="{id}" uuid="{uuid}">
+        <systemField dataType="Long" name="__id">
+          <value>{id}</value>
+        </systemField>
+        <systemField dataType="Timestamp" name="__lastModified">
+          <value>{modified_date}</value>
+        </systemField>
+        <systemField dataType="Timestamp" name="__created">
+          <value>{created_date}</value>
+        </systemField>
+        <systemField name="__uuid">
+          <value>{uuid}</value>
+        </systemField>
+        <dataField dataType="Varchar" name="ObjObjectTitleTxt">
+          <value>{title}</value>
+        </dataField>
+        <virtualField name="ObjObjectTitleVrt">
+          <value>{title}</value>
+        </virtualField>
+        <moduleReference name="ObjMultimediaRef" targetModule="Multimedia" multiplicity="M:N" size="{reference_count}">
+{references}
+        </moduleReference>
+      </moduleItem>"""[1:]
+
+MULTIMEDIA_ITEM_TEMPLATE = """
+      <moduleItem hasAttachments="true" id="{id}" uuid="{uuid}">
+        <systemField dataType="Long" name="__id">
+          <value>{id}</value>
+        </systemField>
+        <systemField dataType="Timestamp" name="__lastModified">
+          <value>{modified_date}</value>
+        </systemField>
+        <systemField dataType="Timestamp" name="__created">
+          <value>{created_date}</value>
+        </systemField>
+        <systemField name="__uuid">
+          <value>{uuid}</value>
+        </systemField>
+        <dataField dataType="Varchar" name="MulOriginalFileTxt">
+          <value>{filename}</value>
+        </dataField>
+        <moduleReference name="MulObjectRef" targetModule="Object" multiplicity="M:N" size="{reference_count}">
+{references}
+        </moduleReference>
+      </moduleItem>"""[1:]
+
+REFERENCE_ITEM_TEMPLATE = (
+    '          <moduleReferenceItem moduleItemId="{id}" seqNo="{seq_no}"/>'
+)
+
+
+def _format_date(date):
+    return date.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+
+
+def _parse_date(value):
+    """
+    Parse a '__lastModified' operand. Both the MuseumPlus timestamp format
+    and ISO 8601 are accepted.
+    """
+    value = value.strip().replace("T", " ")
+    value = re.sub(r"(Z|[+-]\d{2}:?\d{2})$", "", value)
+
+    for date_format in ("%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S",
+                        "%Y-%m-%d"):
+        try:
+            return datetime.datetime.strptime(value, date_format).replace(
+                tzinfo=datetime.timezone.utc
+            )
+        except ValueError:
+            pass
+
+    return None
+
+
+class Catalogue:
+    """
+    Synthetic MuseumPlus catalogue.
+
+    Object N (starting from zero) is linked to 'attachments_per_object'
+    attachments of its own, and is modified N minutes after 'BASE_DATE'.
+    Entries are returned in ascending ID order.
+    """
+    def __init__(self, objects, attachments_per_object, first_id=FIRST_ID):
+        self.objects = objects
+        self.attachments_per_object = attachments_per_object
+        self.first_id = first_id
+
+    @property
+    def attachments(self):
+        return self.objects * self.attachments_per_object
+
+    def _get_modified_date(self, index):
+        return BASE_DATE + datetime.timedelta(minutes=index)
+
+    def get_object(self, index):
+        """
+        Get the object as a dict in the same format returned by
+        'passari.museumplus.search.iterate_objects'
+        """
+        object_id = self.first_id + index
+        first_attachment_index = index * self.attachments_per_object
+        title = f"Object {object_id}"
+
+        return {
+            "id": object_id,
+            "title": title,
+            "modified_date": self._get_modified_date(index),
+            "created_date": BASE_DATE,
+            "multimedia_ids": [
+                self.first_id + first_attachment_index + i
+                for i in range(0, self.attachments_per_object)
+            ],
+            "xml_hash": hashlib.sha256(title.encode("utf-8")).hexdigest()
+        }
+
+    def get_attachment(self, index):
+        """
+        Get the attachment as a dict in the same format returned by
+        'passari.museumplus.search.iterate_multimedia'
+        """
+        attachment_id = self.first_id + index
+        filename = f"{attachment_id}.jpg"
+
+        return {
+            "id": attachment_id,
+            "filename": filename,
+            "modified_date": self._get_modified_date(index),
+            "created_date": BASE_DATE,
+            "object_ids": [
+                self.first_id + index // self.attachments_per_object
+            ],
+            "xml_hash": hashlib.sha256(filename.encode("utf-8")).hexdigest()
+        }
+
+    def search(self, module, offset=0, limit=100, modify_date_gte=None):
+        """
+        Search entries from the given module
+
+        :returns: (total_size, entries) tuple
+        """
+        if module == "Object":
+            count, get_entry = self.objects, self.get_object
+        elif module == "Multimedia":
+            count, get_entry = self.attachments, self.get_attachment
+        else:
+            raise KeyError(module)
+
+        # Entries are modified in ascending order, meaning the filter only
+        # moves the start of the range
+        start = 0
+        if modify_date_gte:
+            minutes = (modify_date_gte - BASE_DATE).total_seconds() / 60
+            start = min(max(int(-(-minutes // 1)), 0), count)
+
+        total_size = count - start
+        first = start + offset
+        last = min(first + limit, count)
+
+        return total_size, [get_entry(index) for index in range(first, last)]
+
+    def _iterate(self, module):
+        async def iterate(session, offset=0, modify_date_gte=None):
+            while True:
+                _, entries = self.search(
+                    module, offset=offset, limit=100,
+                    modify_date_gte=modify_date_gte
+                )
+                if not entries:
+                    break
+
+                for entry in entries:
+                    yield entry
+
+                offset += len(entries)
+
+        return iterate
+
+    @property
+    def iterate_objects(self):
+        """
+        Replacement for 'passari.museumplus.search.iterate_objects' that
+        iterates the catalogue without HTTP requests
+        """
+        return self._iterate("Object")
+
+    @property
+    def iterate_multimedia(self):
+        """
+        Replacement for 'passari.museumplus.search.iterate_multimedia' that
+        iterates the catalogue without HTTP requests
+        """
+        return self._iterate("Multimedia")
+
+
+def render_module_items(module, total_size, entries):
+    """
+    Render a MuseumPlus search response
+    """
+    items = []
+
+    for entry in entries:
+        if module == "Object":
+            template = OBJECT_ITEM_TEMPLATE
+            reference_ids = entry["multimedia_ids"]
+            fields = {"title": escape(entry["title"])}
+        else:
+            template = MULTIMEDIA_ITEM_TEMPLATE
+            reference_ids = entry["object_ids"]
+            fields = {"filename": escape(entry["filename"])}
+
+        items.append(template.format(
+            id=entry["id"],
+            uuid=f"00000000-0000-0000-0000-{entry['id']:012d}",
+            modified_date=_format_date(entry["modified_date"]),
+            created_date=_format_date(entry["created_date"]),
+            reference_count=len(reference_ids),
+            references="\n".join(
+                REFERENCE_ITEM_TEMPLATE.format(id=reference_id, seq_no=i)
+                for i, reference_id in enumerate(reference_ids)
+            ),
+            **fields
+        ))
+
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<application xmlns="{MODULE_NAMESPACE}">\n'
+        '  <modules>\n'
+        f'    <module name="{module}" totalSize="{total_size}">\n'
+        + "\n".join(items) + "\n"
+        '    </module>\n'
+        '  </modules>\n'
+        '</application>\n'
+    )
+
+
+class FakeMuseumPlusServer:
+    """
+    HTTP server serving a catalogue using a subset of the MuseumPlus REST API
+    """
+    def __init__(self, catalogue, latency=0.0, host="127.0.0.1", port=0):
+        """
+        :param catalogue: Catalogue instance to serve
+        :param float latency: Delay in seconds added to every response
+        :param str host: Host to listen on
+        :param int port: Port to listen on. Default is a random free port.
+        """
+        self.catalogue = catalogue
+        self.latency = latency
+        self.host = host
+        self.port = port
+
+        self.request_count = 0
+
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def _delay(self):
+        self.request_count += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def handle_session(self, request):
+        await self._delay()
+        return web.Response(
+            text=(
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                f'<application xmlns="{SESSION_NAMESPACE}">'
+                "<session><key>fakefakefakefakefakefakefakefake</key>"
+                "</session></application>"
+            ),
+            content_type="application/xml"
+        )
+
+    async def handle_search(self, request):
+        await self._delay()
+
+        module = request.match_info["module"]
+        body = await request.text()
+
+        search = re.search(r"<search\b([^>]*)>", body)
+        attrs = dict(re.findall(r'(\w+)="([^"]*)"', search.group(1))) \
+            if search else {}
+        offset = int(attrs.get("offset", 0))
+        limit = int(attrs.get("limit", 100))
+
+        modify_date_gte = None
+        date_filter = re.search(
+            r'fieldPath="__lastModified"[^>]*operand="([^"]*)"', body
+        ) or re.search(
+            r'operand="([^"]*)"[^>]*fieldPath="__lastModified"', body
+        )
+        if date_filter:
+            modify_date_gte = _parse_date(date_filter.group(1))
+
+        try:
+            total_size, entries = self.catalogue.search(
+                module, offset=offset, limit=limit,
+                modify_date_gte=modify_date_gte
+            )
+        except KeyError:
+            raise web.HTTPNotFound()
+
+        return web.Response(
+            text=render_module_items(module, total_size, entries),
+            content_type="application/xml"
+        )
+
+    def _create_app(self):
+        app = web.Application()
+        app.router.add_route(
+            "GET", "/ria-ws/application/session", self.handle_session
+        )
+        app.router.add_route(
+            "POST", "/ria-ws/application/module/{module}/search{slash:/?}",
+            self.handle_search
+        )
+        return app
+
+    def start(self):
+        """
+        Start the server in a background thread and wait until it's ready
+        """
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+
+            self._runner = web.AppRunner(self._create_app())
+            self._loop.run_until_complete(self._runner.setup())
+            site = web.TCPSite(self._runner, self.host, self.port)
+            self._loop.run_until_complete(site.start())
+
+            # Resolve the actual port if a random one was requested
+            self.port = site._server.sockets[0].getsockname()[1]
+            started.set()
+
+            self._loop.run_forever()
+
+            self._loop.run_until_complete(self._runner.cleanup())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+
+    def stop(self):
+        """
+        Stop the server and wait for the background thread to finish
+        """
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
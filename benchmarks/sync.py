@@ -0,0 +1,252 @@
+"""
+Benchmark the throughput of 'sync-objects', 'sync-attachments' and
+'sync-hashes' against a local stand-in for MuseumPlus serving a synthetic
+catalogue.
+
+Each script is run in a separate process, and the following are reported:
+
+- entries synchronized per second
+- database statements per transaction. Each chunk is written in its own
+  transaction.
+- peak resident set size of the process
+
+The benchmark is run against the given database on the PostgreSQL server
+in the Passari Workflow configuration, and the synthetic entries are deleted
+before and after the run. The name of the database must contain 'bench' or
+'test' to prevent the benchmark from being run against a production
+database by accident.
+
+Usage:
+
+    $ python benchmarks/sync.py --db-name passari_bench --objects 10000 \\
+        --attachments-per-object 2 --latency 0.05
+
+Use '--in-process' to iterate the catalogue directly instead of through
+HTTP. This measures the database side of the synchronization only.
+"""
+import asyncio
+import contextlib
+import io
+import multiprocessing
+import resource
+import sys
+import time
+from pathlib import Path
+
+import click
+from sqlalchemy import event
+
+from passari_workflow.config import CONFIG
+from passari_workflow.db import scoped_session
+from passari_workflow.db.connection import connect_db
+from passari_workflow.db.models import (MuseumAttachment, MuseumObject,
+                                        dirty_museum_object_table,
+                                        object_attachment_association_table)
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from fake_museumplus import (FIRST_ID, Catalogue,  # noqa: E402
+                             FakeMuseumPlusServer)
+
+SCRIPTS = ["sync-objects", "sync-attachments", "sync-hashes"]
+
+
+def _count_statements(engine):
+    """
+    Count the statements and committed transactions for the engine.
+
+    COPY statements are executed using the raw DBAPI cursor and are not
+    included.
+    """
+    counts = {"statements": 0, "transactions": 0}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(*args, **kwargs):
+        counts["statements"] += 1
+
+    @event.listens_for(engine, "commit")
+    def commit(*args, **kwargs):
+        counts["transactions"] += 1
+
+    return counts
+
+
+def run_script(script, catalogue, url, db_name, results):
+    """
+    Run a single synchronization script. This is run in a separate process
+    to measure the peak memory usage of each script separately.
+    """
+    from passari.config import CONFIG as PAS_CONFIG
+    from passari_workflow.scripts import (sync_attachments, sync_hashes,
+                                          sync_objects)
+
+    # The configuration is read again in the new process
+    CONFIG["db"]["name"] = db_name
+
+    if url:
+        PAS_CONFIG["museumplus"]["url"] = url
+    else:
+        sync_objects.iterate_objects = catalogue.iterate_objects
+        sync_attachments.iterate_multimedia = catalogue.iterate_multimedia
+
+    engine = connect_db()
+    counts = _count_statements(engine)
+
+    loop = asyncio.get_event_loop()
+    start = time.perf_counter()
+
+    # Discard the progress output of the scripts
+    with contextlib.redirect_stdout(io.StringIO()):
+        if script == "sync-objects":
+            loop.run_until_complete(sync_objects.sync_objects())
+            entries = catalogue.objects
+        elif script == "sync-attachments":
+            loop.run_until_complete(sync_attachments.sync_attachments())
+            entries = catalogue.attachments
+        elif script == "sync-hashes":
+            sync_hashes.sync_hashes()
+            entries = catalogue.objects
+
+    elapsed = time.perf_counter() - start
+
+    results.put({
+        "entries": entries,
+        "elapsed": elapsed,
+        "statements": counts["statements"],
+        "transactions": counts["transactions"],
+        # Kilobytes on Linux
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    })
+
+
+def delete_entries(catalogue):
+    """
+    Delete the synthetic entries created by the benchmark
+    """
+    with scoped_session() as db:
+        db.execute(
+            dirty_museum_object_table.delete().where(
+                dirty_museum_object_table.c.museum_object_id >= FIRST_ID
+            )
+        )
+        db.execute(
+            object_attachment_association_table.delete().where(
+                object_attachment_association_table.c.museum_object_id
+                >= FIRST_ID
+            )
+        )
+        db.query(MuseumObject).filter(MuseumObject.id >= FIRST_ID).delete(
+            synchronize_session=False
+        )
+        db.query(MuseumAttachment).filter(
+            MuseumAttachment.id >= FIRST_ID
+        ).delete(synchronize_session=False)
+
+
+def check_db_name(ctx, param, value):
+    """
+    Ensure the database is a benchmark or test database, as the benchmark
+    deletes entries
+    """
+    if not any(word in value.lower() for word in ("bench", "test")):
+        raise click.BadParameter(
+            "The database name must contain 'bench' or 'test'"
+        )
+
+    return value
+
+
+@click.command()
+@click.option(
+    "--db-name", required=True, callback=check_db_name,
+    help=(
+        "Name of the database to run the benchmark against. Synthetic "
+        "entries are created and deleted in this database."
+    )
+)
+@click.option(
+    "--objects", default=5000, type=int,
+    help="How many objects the catalogue contains"
+)
+@click.option(
+    "--attachments-per-object", default=2, type=int,
+    help="How many attachments each object is linked to"
+)
+@click.option(
+    "--latency", default=0.0, type=float,
+    help="Delay in seconds added to every MuseumPlus response"
+)
+@click.option(
+    "--scripts", default=",".join(SCRIPTS),
+    help="Comma-separated list of scripts to benchmark, run in this order"
+)
+@click.option(
+    "--in-process", is_flag=True, default=False,
+    help="Iterate the catalogue directly instead of through HTTP"
+)
+def cli(
+        db_name, objects, attachments_per_object, latency, scripts,
+        in_process):
+    scripts = scripts.split(",")
+    for script in scripts:
+        if script not in SCRIPTS:
+            raise click.BadParameter(f"Unknown script {script}")
+
+    catalogue = Catalogue(
+        objects=objects, attachments_per_object=attachments_per_object
+    )
+
+    server = None
+    url = None
+    if not in_process:
+        server = FakeMuseumPlusServer(catalogue, latency=latency)
+        server.start()
+        url = server.url
+
+    CONFIG["db"]["name"] = db_name
+    connect_db()
+    delete_entries(catalogue)
+
+    # Use a fresh process for each script. The server keeps running in this
+    # process.
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+
+    print(
+        f"{'script':<18} {'entries':>8} {'time (s)':>10} {'entries/s':>10} "
+        f"{'stmts/txn':>10} {'peak RSS (MB)':>14}"
+    )
+
+    try:
+        for script in scripts:
+            process = context.Process(
+                target=run_script,
+                args=(script, catalogue, url, db_name, results)
+            )
+            process.start()
+            process.join()
+
+            if process.exitcode != 0:
+                raise click.ClickException(f"{script} failed")
+
+            result = results.get()
+            statements_per_transaction = (
+                result["statements"] / max(result["transactions"], 1)
+            )
+
+            print(
+                f"{script:<18} {result['entries']:>8} "
+                f"{result['elapsed']:>10.2f} "
+                f"{result['entries'] / result['elapsed']:>10.0f} "
+                f"{statements_per_transaction:>10.1f} "
+                f"{result['peak_rss'] / 1024:>14.1f}"
+            )
+    finally:
+        delete_entries(catalogue)
+
+        if server:
+            server.stop()
+
+
+if __name__ == "__main__":
+    cli()
@@ -28,6 +28,8 @@ setup(
         # https://github.com/rq/rq/issues/1256
         # "rq>=1",
         "rq==1.4.0",
+        # 'hset(mapping=...)' and 'health_check_interval' require redis-py 3.5
+        "redis>=3.5",
         "python-redis-lock",
         "alembic",
         "requests"
@@ -47,6 +49,8 @@ setup(
             "passari_workflow.scripts.sync_attachments:cli",
             "sync-hashes = "
             "passari_workflow.scripts.sync_hashes:cli",
+            "sync-all = passari_workflow.scripts.sync_all:cli",
+            "sync-stats = passari_workflow.scripts.sync_stats:cli",
             "enqueue-objects = passari_workflow.scripts.enqueue_objects:cli",
             "deferred-enqueue-objects = "
             "passari_workflow.scripts.deferred_enqueue_objects:cli",
@@ -62,6 +66,8 @@ setup(
             "passari_workflow.scripts.pas_shell:cli",
             "reset-workflow = "
             "passari_workflow.scripts.reset_workflow:cli",
+            "repair-workflow-index = "
+            "passari_workflow.scripts.repair_workflow_index:cli",
             "dip-tool = "
             "passari_workflow.scripts.dip_tool:cli"
         ]
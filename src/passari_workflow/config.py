@@ -35,6 +35,26 @@ def get_config(app_name, config_name, default_config):
     return default_config
 
 
+def get_bool(value):
+    """
+    Parse a boolean configuration value. TOML booleans are returned as-is,
+    while strings such as 'true' and 'false' are parsed.
+
+    :raises ValueError: If the value can't be parsed
+    """
+    if isinstance(value, bool):
+        return value
+
+    normalized = str(value).strip().lower()
+
+    if normalized in ("true", "yes", "on", "1"):
+        return True
+    if normalized in ("false", "no", "off", "0"):
+        return False
+
+    raise ValueError(f"Invalid boolean value: {value!r}")
+
+
 DEFAULT_CONFIG = f"""
 [logging]
 # different logging levels:
@@ -53,12 +73,42 @@ host='127.0.0.1'
 port='5432'
 name='passari'
 
+# Connection pool settings. Each process keeps one connection pool.
+# 'pool_size' connections are kept open, and up to 'max_overflow'
+# additional connections can be opened under load.
+pool_size=5
+max_overflow=10
+# Recycle connections after this many seconds
+pool_recycle=3600
+# Test connections for liveness before using them
+pool_pre_ping=true
+
 [redis]
 # Redis server credentials
 host='127.0.0.1'
 port='6379'
 password=''
 
+# Connection pool settings. Each process keeps one connection pool for each
+# Redis database. Once 'max_connections' connections are in use, commands
+# wait up to 'pool_timeout' seconds for a free connection before failing.
+max_connections=50
+pool_timeout=20
+# Enable TCP keepalive for the connections
+socket_keepalive=true
+# Check that an idle connection is still alive before using it if it hasn't
+# been used for this many seconds. Set to 0 to disable.
+health_check_interval=30
+
+[sync]
+# Chunk sizes used by 'sync-objects', 'sync-attachments' and 'sync-hashes'
+# are adjusted after each chunk to keep the time spent writing a chunk
+# close to 'target_chunk_time' seconds, within the given bounds.
+# Set 'target_chunk_time' to 0 to use fixed chunk sizes instead.
+min_chunk_size=100
+max_chunk_size=5000
+target_chunk_time=5
+
 [package]
 # Directory used for packages under processing.
 # It is recommended to use a high performance and high capacity storage
@@ -82,6 +132,9 @@ preservation_delay=2592000
 # Delay before a preserved package will be updated if changed.
 # Default is 30 days (2592000 seconds)
 update_delay=2592000
+
+# NOTE: After changing either of the delays, run
+# 'sync-hashes --refresh-eligibility' to update the objects in the database.
 """[1:]
 
 USER_CONFIG_DIR = click.get_app_dir("passari-workflow")
@@ -1,10 +1,17 @@
+import os
+
 from passari_workflow.db import DBSession
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, exc
 
 from urllib.parse import quote_plus
 
-from passari_workflow.config import CONFIG
+from passari_workflow.config import CONFIG, get_bool
+
+
+# Engines created by 'connect_db', keyed by the connection URI and engine
+# options. Each process only needs one engine and one connection pool.
+_ENGINES = {}
 
 
 def get_connection_uri():
@@ -20,12 +27,65 @@ def get_connection_uri():
     return f"postgresql://{user}:{quote_plus(password)}@{host}:{port}/{name}"
 
 
+def get_engine_options():
+    """
+    Get the connection pool options used to create the database engine
+    """
+    return {
+        "pool_size": int(CONFIG["db"].get("pool_size", 5)),
+        "max_overflow": int(CONFIG["db"].get("max_overflow", 10)),
+        "pool_recycle": int(CONFIG["db"].get("pool_recycle", 3600)),
+        "pool_pre_ping": get_bool(CONFIG["db"].get("pool_pre_ping", True))
+    }
+
+
+def _add_fork_protection(engine):
+    """
+    Prevent connections created in a parent process from being used in
+    a forked child process.
+
+    RQ forks a work horse for every job, which means the child inherits the
+    parent's pooled connections. Sharing the same socket between two
+    processes corrupts the connection, so any inherited connection is
+    discarded without closing it and replaced with a new one instead.
+
+    See "Using Connection Pools with Multiprocessing" in SQLAlchemy
+    documentation.
+    """
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        connection_record.info["pid"] = os.getpid()
+
+    @event.listens_for(engine, "checkout")
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        pid = os.getpid()
+        if connection_record.info["pid"] != pid:
+            connection_record.connection = connection_proxy.connection = None
+            raise exc.DisconnectionError(
+                f"Connection record belongs to pid "
+                f"{connection_record.info['pid']}, attempting to check out "
+                f"in pid {pid}"
+            )
+
+
 def connect_db():
     """
     Connect to the database, ensuring that functions that return database
     connections work.
+
+    The engine is created once per process and reused on subsequent calls.
     """
-    engine = create_engine(get_connection_uri())
+    uri = get_connection_uri()
+    options = get_engine_options()
+    key = (uri, tuple(sorted(options.items())))
+
+    engine = _ENGINES.get(key)
+
+    if not engine:
+        engine = create_engine(uri, **options)
+        _add_fork_protection(engine)
+        _ENGINES[key] = engine
+
     DBSession.configure(bind=engine)
 
     return engine
@@ -6,10 +6,12 @@ from typing import List
 
 from sqlalchemy import (BigInteger, Boolean, Column, DateTime, Enum,
                         ForeignKey, Index, MetaData, String, Table, Text,
-                        UniqueConstraint, and_, exists, func, not_, or_)
+                        UniqueConstraint, and_, bindparam, case, event,
+                        exists, func, literal, not_, or_, select, text)
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import Session, relationship
+from sqlalchemy.orm.attributes import PASSIVE_NO_INITIALIZE, get_history
 from sqlalchemy.sql.functions import coalesce
 
 from passari.dpres.package import get_archive_path_parts
@@ -70,6 +72,13 @@ package_attachment_association_table = Table(
     UniqueConstraint("museum_package_id", "museum_attachment_id")
 )
 
+# Objects that need to have their attachment metadata hash recalculated
+# by 'sync-hashes'
+dirty_museum_object_table = Table(
+    "dirty_museum_objects", Base.metadata,
+    Column("museum_object_id", BigInteger, primary_key=True)
+)
+
 
 class MuseumAttachment(Base):
     """
@@ -253,6 +262,11 @@ class MuseumObject(Base):
             "ix_museum_objects_freeze_reason_trgm_gin", "freeze_reason",
             postgresql_ops={"freeze_reason": "gin_trgm_ops"},
             postgresql_using="gin"
+        ),
+        # Only objects that can become eligible for preservation are indexed
+        Index(
+            "ix_museum_objects_next_eligible_at", "next_eligible_at",
+            postgresql_where=text("next_eligible_at IS NOT NULL")
         )
     )
 
@@ -294,6 +308,14 @@ class MuseumObject(Base):
     # or an empty string if this object has no attachments.
     attachment_metadata_hash = Column(String(64))
 
+    # The earliest time the object becomes eligible for preservation,
+    # or None if the object can't become eligible without changes
+    # (eg. it's frozen or it hasn't changed since the last package).
+    # This is updated by 'update_next_eligible_at' whenever a relevant
+    # field is changed, and is used to find objects pending preservation
+    # without having to check every object.
+    next_eligible_at = Column(DateTime(timezone=True))
+
     packages = relationship(
         "MuseumPackage", back_populates="museum_object",
         order_by="MuseumPackage.created_date",
@@ -372,139 +394,295 @@ class MuseumObject(Base):
         )
 
 
-def filter_preservation_pending(q):
+# Placeholder date for objects that are eligible for preservation immediately
+ELIGIBLE_IMMEDIATELY = datetime.datetime(
+    1970, 1, 1, tzinfo=datetime.timezone.utc
+)
+
+
+def next_eligible_at_expression(objects, packages):
     """
-    Transform query to only include MuseumObject entries which are
-    pending preservation
+    Return a SQL expression that calculates the 'next_eligible_at' value for
+    a MuseumObject.
+
+    The conditions are the same as in 'MuseumObject.preservation_pending',
+    but the preservation and update delays are added to the relevant dates
+    instead of comparing them against the current time.
+
+    :param objects: 'museum_objects' table or an alias of it
+    :param packages: 'museum_packages' table or an alias of it, joined
+                     using the object's 'latest_package_id'
     """
-    now = datetime.datetime.now(datetime.timezone.utc)
-    preservation_boundary = now - PRESERVATION_DELAY
-    update_boundary = now - UPDATE_DELAY
+    eligible_immediately = literal(
+        ELIGIBLE_IMMEDIATELY, DateTime(timezone=True)
+    )
 
-    return (
-        q.outerjoin(
-            MuseumPackage,
-            MuseumPackage.id == MuseumObject.latest_package_id
-        )
-        .filter(MuseumObject.frozen == False)
-        .filter(
-            and_(
-                # Metadata hashes can't be incomplete before we start
-                # preservation
-                MuseumObject.attachment_metadata_hash != None,
-                MuseumObject.metadata_hash != None
-            )
-        )
-        .filter(
-            or_(
-                # Object has never been preserved and has passed the
-                # preservation delay (by default one month)...
-                and_(
-                    MuseumObject.latest_package_id == None,
-                    or_(
-                        MuseumObject.created_date == None,
-                        MuseumObject.created_date < preservation_boundary
-                    )
+    return case(
+        [
+            # Frozen objects and objects with incomplete metadata
+            # information can't be preserved
+            (
+                or_(
+                    objects.c.frozen.isnot(False),
+                    objects.c.metadata_hash == None,
+                    objects.c.attachment_metadata_hash == None
                 ),
-                # ...OR the object has been preserved at least once,
-                # but the preservation delay (by default one month) has
-                # already passed since last preservation and the object has
-                # changed (object or attachment metadata hash changed since
-                # last preservation)
+                None
+            ),
+            # Object has never been preserved; it will become eligible
+            # once the preservation delay has passed since its creation
+            (
+                objects.c.latest_package_id == None,
+                coalesce(
+                    objects.c.created_date + PRESERVATION_DELAY,
+                    eligible_immediately
+                )
+            ),
+            # The last package was cancelled, meaning that the preservation
+            # can be restarted immediately
+            (packages.c.cancelled == True, eligible_immediately),
+            # The object has changed since the last package was created;
+            # it will become eligible once the update delay has passed since
+            # the last package
+            (
                 and_(
-                    MuseumObject.latest_package_id != None,
-                    # Compare modification dates and check for equality,
-                    # including NULL != NULL which evaluates to False here
-                    coalesce(MuseumPackage.object_modified_date, datetime.datetime.min)
-                    != coalesce(MuseumObject.modified_date, datetime.datetime.min),
-                    or_(
-                        MuseumPackage.object_modified_date == None,
-                        MuseumPackage.object_modified_date < update_boundary
+                    coalesce(
+                        packages.c.object_modified_date,
+                        datetime.datetime.min
+                    ) != coalesce(
+                        objects.c.modified_date, datetime.datetime.min
                     ),
                     or_(
-                        MuseumObject.metadata_hash
-                        != MuseumPackage.metadata_hash,
-                        MuseumObject.attachment_metadata_hash
-                        != MuseumPackage.attachment_metadata_hash
+                        objects.c.metadata_hash
+                        != packages.c.metadata_hash,
+                        objects.c.attachment_metadata_hash
+                        != packages.c.attachment_metadata_hash
                     )
                 ),
-                # ...OR the last package was cancelled, meaning that the
-                # preservation can be restarted immediately if it's not frozen
-                and_(
-                    MuseumObject.latest_package_id != None,
-                    MuseumPackage.cancelled == True
+                coalesce(
+                    packages.c.object_modified_date + UPDATE_DELAY,
+                    eligible_immediately
                 )
             )
+        ],
+        else_=None
+    )
+
+
+def update_next_eligible_at(session, object_ids=None):
+    """
+    Update 'MuseumObject.next_eligible_at' for the given objects.
+
+    This needs to be called after any field affecting preservation
+    eligibility has been changed without using the ORM, eg. with bulk
+    updates. Changes made using the ORM are handled automatically when the
+    session is flushed.
+
+    :param session: SQLAlchemy session
+    :param object_ids: Object IDs to update. If None, every object is updated,
+                       which is necessary if the preservation or update delay
+                       has been changed.
+    """
+    if object_ids is not None:
+        object_ids = list(object_ids)
+        if not object_ids:
+            return
+
+    objects = MuseumObject.__table__
+    packages = MuseumPackage.__table__
+
+    # Use aliases inside the subquery to prevent them from being correlated
+    # with the table being updated
+    object_alias = objects.alias("o")
+    package_alias = packages.alias("p")
+
+    eligible = (
+        select([
+            object_alias.c.id.label("id"),
+            next_eligible_at_expression(
+                object_alias, package_alias
+            ).label("next_eligible_at")
+        ])
+        .select_from(
+            object_alias.outerjoin(
+                package_alias,
+                package_alias.c.id == object_alias.c.latest_package_id
+            )
+        )
+    )
+
+    if object_ids is not None:
+        eligible = eligible.where(object_alias.c.id.in_(object_ids))
+
+    eligible = eligible.alias("eligible")
+
+    session.execute(
+        objects.update()
+        .values(next_eligible_at=eligible.c.next_eligible_at)
+        .where(objects.c.id == eligible.c.id)
+        .where(
+            objects.c.next_eligible_at.is_distinct_from(
+                eligible.c.next_eligible_at
+            )
         )
     )
 
 
+def filter_preservation_pending(q):
+    """
+    Transform query to only include MuseumObject entries which are
+    pending preservation
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+
+    return q.filter(
+        MuseumObject.next_eligible_at != None,
+        MuseumObject.next_eligible_at <= now
+    )
+
+
 def exclude_preservation_pending(q):
     """
     Transform query to exclude MuseumObject entries which are pending
     preservation
     """
     now = datetime.datetime.now(datetime.timezone.utc)
-    preservation_boundary = now - PRESERVATION_DELAY
-    update_boundary = now - UPDATE_DELAY
 
-    return (
-        q.outerjoin(
-            MuseumPackage,
-            MuseumPackage.id == MuseumObject.latest_package_id
+    return q.filter(
+        or_(
+            MuseumObject.next_eligible_at == None,
+            MuseumObject.next_eligible_at > now
         )
-        .filter(
-            # If any of the four conditions is true, the object will not
-            # be preserved and are thus included in this query:
-            or_(
-                # 1. Is metadata information still incomplete?
-                MuseumObject.metadata_hash == None,
-                MuseumObject.attachment_metadata_hash == None,
-                # 2. Is the object frozen?
-                MuseumObject.frozen,
-                # 3. The object hasn't been preserved, but it has been less
-                #    than a month passed since the creation of the object?
-                and_(
-                    MuseumObject.latest_package_id == None,
-                    coalesce(
-                        MuseumObject.created_date, datetime.datetime.min
-                    ) > preservation_boundary
-                ),
-                # 4. Has the object entered preservation before, but...
-                and_(
-                    MuseumObject.latest_package_id != None,
-                    # ...the package wasn't cancelled, and either...
-                    MuseumPackage.cancelled == False,
-                    or_(
-                        # ...modification date hasn't changed?
-                        coalesce(
-                            MuseumPackage.object_modified_date,
-                            datetime.datetime.min
-                        ) == coalesce(
-                            MuseumObject.modified_date,
-                            datetime.datetime.min
-                        ),
-                        # ...modification date has changed, but it's been
-                        # less than a month?
-                        coalesce(
-                            MuseumPackage.object_modified_date,
-                            datetime.datetime.min
-                        ) > update_boundary,
-                        # ...metadata hashes haven't changed, indicating no
-                        # change has happened?
-                        and_(
-                            MuseumPackage.metadata_hash
-                            == MuseumObject.metadata_hash,
-                            MuseumPackage.attachment_metadata_hash
-                            == MuseumObject.attachment_metadata_hash
-                        )
+    )
+
+
+@event.listens_for(Session, "after_flush")
+def _update_next_eligible_at_after_flush(session, flush_context):
+    """
+    Update 'next_eligible_at' for any MuseumObject that was changed using the
+    ORM, either directly or through one of its packages
+    """
+    object_ids = set()
+
+    for instance in session.new | session.dirty | session.deleted:
+        if isinstance(instance, MuseumObject):
+            if instance not in session.deleted:
+                object_ids.add(instance.id)
+        elif isinstance(instance, MuseumPackage):
+            if instance.museum_object_id is not None:
+                object_ids.add(instance.museum_object_id)
+
+    if object_ids:
+        update_next_eligible_at(session, object_ids)
+
+
+def mark_objects_dirty(session, object_ids):
+    """
+    Mark objects as requiring their attachment metadata hash to be
+    recalculated on the next 'sync-hashes' run.
+
+    This needs to be called after an object's attachments have been changed
+    without using the ORM. Changes made using the ORM are handled
+    automatically when the session is flushed.
+
+    :param session: SQLAlchemy session
+    :param object_ids: Object IDs to mark
+    """
+    object_ids = sorted(set(object_ids))
+    if not object_ids:
+        return
+
+    session.execute(
+        postgresql.insert(dirty_museum_object_table)
+        .from_select(
+            ["museum_object_id"],
+            select([
+                func.unnest(
+                    bindparam(
+                        "object_ids", value=object_ids,
+                        type_=postgresql.ARRAY(BigInteger)
                     )
                 )
-            )
+            ])
         )
+        .on_conflict_do_nothing()
     )
 
 
+def mark_attachment_objects_dirty(session, attachment_ids):
+    """
+    Mark objects linked to the given attachments as requiring their
+    attachment metadata hash to be recalculated on the next 'sync-hashes'
+    run.
+
+    This needs to be called after attachments' metadata hashes have been
+    changed without using the ORM.
+
+    The objects are inserted in order of their IDs. Concurrent shards
+    marking the same objects would otherwise wait on each other's rows in
+    different orders and could deadlock.
+
+    :param session: SQLAlchemy session
+    :param attachment_ids: Attachment IDs whose objects are marked
+    """
+    attachment_ids = sorted(set(attachment_ids))
+    if not attachment_ids:
+        return
+
+    assoc = object_attachment_association_table
+
+    session.execute(
+        postgresql.insert(dirty_museum_object_table)
+        .from_select(
+            ["museum_object_id"],
+            select([assoc.c.museum_object_id])
+            .where(assoc.c.museum_attachment_id.in_(attachment_ids))
+            .group_by(assoc.c.museum_object_id)
+            .order_by(assoc.c.museum_object_id)
+        )
+        .on_conflict_do_nothing()
+    )
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_objects_dirty_after_flush(session, flush_context):
+    """
+    Mark any MuseumObject whose attachments were changed using the ORM,
+    either directly or through the attachments themselves
+    """
+    def has_changes(instance, key):
+        # Don't load attributes that haven't been loaded, as they can't
+        # have changed either
+        return get_history(
+            instance, key, passive=PASSIVE_NO_INITIALIZE
+        ).has_changes()
+
+    object_ids = set()
+    attachment_ids = set()
+
+    for instance in session.new | session.dirty:
+        if isinstance(instance, MuseumObject):
+            if instance in session.new or has_changes(instance, "attachments"):
+                object_ids.add(instance.id)
+        elif isinstance(instance, MuseumAttachment):
+            if instance in session.new \
+                    or has_changes(instance, "metadata_hash"):
+                attachment_ids.add(instance.id)
+
+            history = get_history(
+                instance, "museum_objects", passive=PASSIVE_NO_INITIALIZE
+            )
+            object_ids.update(
+                museum_object.id for museum_object
+                in list(history.added or ()) + list(history.deleted or ())
+            )
+
+    if object_ids:
+        mark_objects_dirty(session, object_ids)
+    if attachment_ids:
+        mark_attachment_objects_dirty(session, attachment_ids)
+
+
 MuseumObject.filter_preservation_pending = filter_preservation_pending
 MuseumObject.exclude_preservation_pending = exclude_preservation_pending
 
@@ -1,24 +1,313 @@
-def bulk_create_or_get(session, mapper, ids):
+import io
+
+from sqlalchemy import (BigInteger, Column, MetaData, Table, and_, exists,
+                        func, literal_column, or_, select, union_all)
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql.expression import any_, bindparam
+
+
+def _get_or_create_statement(table, ids, columns):
     """
-    For given model, return a list of entries with given primary keys.
+    Build a statement that inserts any missing entries with given primary keys
+    and returns the requested columns for both the created and existing
+    entries.
 
-    Any entries that don't exist will be created.
+    The created entries are not visible to the rest of the statement,
+    meaning the two sets don't overlap.
     """
-    entries = list(
-        session.query(mapper)
-        .filter(mapper.id.in_(ids))
+    ids_param = bindparam("ids", value=ids, type_=ARRAY(BigInteger))
+
+    inserted = (
+        insert(table)
+        .from_select(["id"], select([func.unnest(ids_param)]))
+        .on_conflict_do_nothing(index_elements=["id"])
+        .returning(*columns)
+        .cte("inserted")
     )
-    existing_ids = set([entry.id for entry in entries])
-    missing_ids = set(ids) - existing_ids
+
+    return union_all(
+        select([inserted.c[column.name] for column in columns]),
+        select(columns).where(table.c.id == any_(ids_param))
+    )
+
+
+def bulk_create_or_get(session, mapper, ids, ids_only=False):
+    """
+    For given model, return a list of entries with given primary keys.
+
+    Any entries that don't exist will be created. This is done using a single
+    INSERT ... ON CONFLICT DO NOTHING statement, which also makes it safe
+    to call concurrently for overlapping primary keys.
+
+    :param session: SQLAlchemy session
+    :param mapper: Model with an 'id' primary key
+    :param ids: Primary keys of the entries to retrieve or create
+    :param bool ids_only: Return a list of primary keys instead of model
+                          instances. This is faster if the entries themselves
+                          are not needed.
+    """
+    # Sort the IDs to ensure concurrent callers lock rows in the same order
+    ids = sorted(set(int(id_) for id_ in ids))
+
+    if not ids:
+        return []
+
+    table = mapper.__table__
+
+    if ids_only:
+        session.flush()
+
+        stmt = _get_or_create_statement(table, ids, [table.c.id])
+        entries = [result.id for result in session.execute(stmt)]
+        found_ids = set(entries)
+    else:
+        stmt = _get_or_create_statement(table, ids, list(table.c))
+        entries = list(
+            session.query(aliased(mapper, stmt.alias("entries")))
+        )
+        found_ids = set(entry.id for entry in entries)
+
+    missing_ids = set(ids) - found_ids
 
     if missing_ids:
-        session.bulk_insert_mappings(
-            mapper,
-            [{"id": missing_id} for missing_id in missing_ids]
+        # Entries created by a concurrent transaction after this statement
+        # started are neither inserted nor visible in the same statement.
+        # Retrieve them separately.
+        if ids_only:
+            entries += [
+                result.id for result in
+                session.execute(
+                    select([table.c.id]).where(table.c.id.in_(missing_ids))
+                )
+            ]
+        else:
+            entries += list(
+                session.query(mapper).filter(mapper.id.in_(missing_ids))
+            )
+
+    return entries
+
+
+def _format_csv_value(value):
+    """
+    Format a value for PostgreSQL's CSV format. Unquoted empty values are
+    read as NULL, so every other value is quoted.
+    """
+    if value is None:
+        return ""
+
+    value = str(value).replace('"', '""')
+    return f'"{value}"'
+
+
+def copy_rows(session, table, columns, rows):
+    """
+    Copy rows into a table using COPY FROM STDIN
+
+    :param session: SQLAlchemy session
+    :param table: Table to copy the rows into
+    :param columns: Column names in the same order as the values in each row
+    :param rows: Iterable of row tuples
+    """
+    data = io.StringIO()
+    for row in rows:
+        data.write(",".join(_format_csv_value(value) for value in row))
+        data.write("\n")
+    data.seek(0)
+
+    connection = session.connection()
+    preparer = connection.dialect.identifier_preparer
+    column_names = ", ".join(preparer.quote(column) for column in columns)
+
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {preparer.format_table(table)} ({column_names}) "
+            "FROM STDIN WITH (FORMAT csv)",
+            data
+        )
+    finally:
+        cursor.close()
+
+
+def bulk_upsert(
+        session, table, columns, rows, update_columns=(),
+        advance_columns=()):
+    """
+    Insert rows or update the existing rows with the same primary keys.
+
+    The rows are copied into a temporary staging table using COPY and merged
+    into the table using a single INSERT ... ON CONFLICT DO UPDATE statement,
+    which is considerably faster than inserting or updating the rows
+    separately.
+
+    Existing rows are only updated if at least one of the values would
+    change, which avoids writing new row versions for unchanged rows.
+
+    :param session: SQLAlchemy session
+    :param table: Table with an 'id' primary key
+    :param columns: Column names in the same order as the values in each row
+    :param rows: List of row tuples. Each primary key may only appear once.
+    :param update_columns: Columns to update for existing rows
+    :param advance_columns: Columns to update for existing rows only if the
+                            new value is greater than the current one.
+                            NULL values never replace existing values.
+
+    :returns: List of (id, inserted) tuples for the inserted and updated
+              rows, where 'inserted' is True if the row was created.
+              Unchanged rows are not included.
+    """
+    if not rows:
+        return []
+
+    preparer = session.connection().dialect.identifier_preparer
+    staging_table = Table(
+        f"staging_{table.name}", MetaData(),
+        *[Column(column, table.c[column].type) for column in columns]
+    )
+    staging_table_name = preparer.format_table(staging_table)
+
+    # The table is dropped at the end of the transaction in case the
+    # statement fails
+    session.execute(
+        f"CREATE TEMPORARY TABLE {staging_table_name} "
+        f"(LIKE {preparer.format_table(table)}) ON COMMIT DROP"
+    )
+    copy_rows(session, staging_table, columns, rows)
+
+    stmt = insert(table).from_select(
+        columns, select([staging_table.c[column] for column in columns])
+    )
+
+    values = {
+        column: stmt.excluded[column] for column in update_columns
+    }
+    # GREATEST() ignores NULL values
+    values.update({
+        column: func.greatest(table.c[column], stmt.excluded[column])
+        for column in advance_columns
+    })
+
+    changed = [
+        table.c[column].is_distinct_from(stmt.excluded[column])
+        for column in update_columns
+    ] + [
+        func.greatest(table.c[column], stmt.excluded[column])
+        .is_distinct_from(table.c[column])
+        for column in advance_columns
+    ]
+
+    if values:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["id"], set_=values, where=or_(*changed)
         )
-        entries += list(
-            session.query(mapper)
-            .filter(mapper.id.in_(missing_ids))
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=["id"])
+
+    # 'xmax' is zero for rows that were inserted instead of updated
+    stmt = stmt.returning(
+        table.c.id, literal_column("xmax = 0").label("inserted")
+    )
+    results = [
+        (result.id, result.inserted) for result in session.execute(stmt)
+    ]
+
+    session.execute(f"DROP TABLE {staging_table_name}")
+
+    return results
+
+
+def bulk_replace_associations(
+        session, table, key_column, value_column, key2values):
+    """
+    Replace the associations for the given keys in an association table.
+
+    The current associations are compared against the given associations
+    in the database, after which the removed associations are deleted and
+    the new associations are inserted using a single statement each.
+
+    This needs to be used instead of assigning the relationship collections
+    using the ORM, which requires loading the current collection for every
+    entry separately.
+
+    :param session: SQLAlchemy session
+    :param table: Association table
+    :param str key_column: Name of the column containing the keys,
+                           eg. 'museum_object_id'
+    :param str value_column: Name of the column containing the associated
+                             values, eg. 'museum_attachment_id'
+    :param dict key2values: Associated values for each key. Keys that are
+                            not included are not changed; keys with no values
+                            have all their associations removed.
+
+    :returns: (added, removed) tuple containing lists of added and removed
+              (key, value) pairs
+    """
+    if not key2values:
+        return [], []
+
+    # Sort the pairs to ensure concurrent callers lock rows in the same order
+    pairs = sorted(
+        (int(key), int(value))
+        for key, values in key2values.items()
+        for value in set(values)
+    )
+    keys = sorted(set(int(key) for key in key2values.keys()))
+
+    key_column = table.c[key_column]
+    value_column = table.c[value_column]
+
+    # Unnesting two arrays of the same length in the same SELECT list
+    # returns the elements pairwise
+    new_pairs = select([
+        func.unnest(
+            bindparam(
+                "pair_keys", value=[key for key, _ in pairs],
+                type_=ARRAY(BigInteger)
+            )
+        ).label("key"),
+        func.unnest(
+            bindparam(
+                "pair_values", value=[value for _, value in pairs],
+                type_=ARRAY(BigInteger)
+            )
+        ).label("value")
+    ]).alias("new_pairs")
+
+    delete_stmt = (
+        table.delete()
+        .where(
+            key_column == any_(
+                bindparam("keys", value=keys, type_=ARRAY(BigInteger))
+            )
+        )
+        .where(
+            ~exists(
+                select([new_pairs.c.key])
+                .where(
+                    and_(
+                        new_pairs.c.key == key_column,
+                        new_pairs.c.value == value_column
+                    )
+                )
+            )
         )
+        .returning(key_column, value_column)
+    )
+    removed = [tuple(result) for result in session.execute(delete_stmt)]
 
-    return entries
+    added = []
+    if pairs:
+        insert_stmt = (
+            insert(table)
+            .from_select(
+                [key_column.name, value_column.name],
+                select([new_pairs.c.key, new_pairs.c.value])
+            )
+            .on_conflict_do_nothing()
+            .returning(key_column, value_column)
+        )
+        added = [tuple(result) for result in session.execute(insert_stmt)]
+
+    return added, removed
@@ -2,3 +2,9 @@ class WorkflowJobRunningError(ValueError):
     """
     Operation was prevented by a job running in the job queue
     """
+
+
+class SyncFetchError(ValueError):
+    """
+    The given MuseumPlus entries couldn't be retrieved
+    """
@@ -6,6 +6,7 @@ from passari_workflow.config import ARCHIVE_DIR, PACKAGE_DIR
 from passari_workflow.db import scoped_session
 from passari_workflow.db.connection import connect_db
 from passari_workflow.db.models import MuseumObject, MuseumPackage
+from passari_workflow.jobs.utils import remove_finished_object_from_index
 
 
 def confirm_sip(object_id, sip_id):
@@ -52,3 +53,6 @@ def confirm_sip(object_id, sip_id):
             })
 
     print(f"SIP {museum_package.sip_filename} confirmed")
+
+    # This is the last step, meaning the object leaves the workflow
+    remove_finished_object_from_index(object_id)
@@ -5,7 +5,8 @@ from passari.scripts.create_sip import main
 from passari_workflow.config import PACKAGE_DIR
 from passari_workflow.db import scoped_session
 from passari_workflow.db.connection import connect_db
-from passari_workflow.db.models import MuseumObject, MuseumPackage
+from passari_workflow.db.models import (MuseumObject, MuseumPackage,
+                                        update_next_eligible_at)
 from passari_workflow.jobs.submit_sip import submit_sip
 from passari_workflow.jobs.utils import (freeze_running_object,
                                          job_locked_by_object_id)
@@ -94,6 +95,7 @@ def create_sip(object_id, sip_id):
         db.query(MuseumObject).filter(
             MuseumObject.id == object_id
         ).update({MuseumObject.latest_package_id: db_package.id})
+        update_next_eligible_at(db, [object_id])
 
         queue = get_queue(QueueType.SUBMIT_SIP)
         queue.enqueue(
@@ -7,8 +7,10 @@ from passari_workflow.config import PACKAGE_DIR
 from passari_workflow.db import scoped_session
 from passari_workflow.db.connection import connect_db
 from passari_workflow.db.models import (MuseumAttachment, MuseumObject,
-                                        MuseumPackage)
-from passari_workflow.db.utils import bulk_create_or_get
+                                        MuseumPackage,
+                                        package_attachment_association_table)
+from passari_workflow.db.utils import (bulk_create_or_get,
+                                       bulk_replace_associations)
 from passari_workflow.jobs.create_sip import create_sip
 from passari_workflow.jobs.utils import (freeze_running_object,
                                          job_locked_by_object_id)
@@ -70,9 +72,9 @@ def download_object(object_id):
 
         # Get the attachments that currently exist for this object
         # and add them to the new MuseumPackage
-        attachment_ids = museum_package.museum_object.attachment_ids
-        db_attachments = bulk_create_or_get(
-            db, MuseumAttachment, attachment_ids
+        attachment_ids = bulk_create_or_get(
+            db, MuseumAttachment,
+            museum_package.museum_object.attachment_ids, ids_only=True
         )
 
         if not db_package:
@@ -86,10 +88,18 @@ def download_object(object_id):
                 metadata_hash=db_museum_object.metadata_hash,
                 attachment_metadata_hash=(
                     db_museum_object.attachment_metadata_hash
-                ),
-                attachments=db_attachments
+                )
             )
             db_package.museum_object = db_museum_object
+            db.add(db_package)
+            db.flush()
+
+            bulk_replace_associations(
+                db, package_attachment_association_table,
+                key_column="museum_package_id",
+                value_column="museum_attachment_id",
+                key2values={db_package.id: attachment_ids}
+            )
         else:
             raise EnvironmentError(
                 f"Package with filename {filename} already exists"
@@ -3,11 +3,14 @@ from functools import wraps
 from pathlib import Path
 
 import redis_lock
+from rq import get_current_job
+
 from passari.dpres.package import MuseumObjectPackage
 from passari_workflow.config import ARCHIVE_DIR, PACKAGE_DIR
 from passari_workflow.db import scoped_session
 from passari_workflow.db.models import (FreezeSource, MuseumObject,
                                         MuseumPackage)
+from passari_workflow.queue.queues import remove_object_from_index
 from passari_workflow.redis.connection import get_redis_connection
 
 
@@ -19,6 +22,9 @@ def job_locked_by_object_id(func):
     This ensures that no race conditions with one RQ job starting just before
     the previous one finishes executing (eg. 'download_object' hasn't finished
     persisting DB update when 'create_sip' starts execution)
+
+    Once the job finishes successfully, the object is removed from the
+    object index unless the job enqueued the object into the next queue.
     """
     @wraps(func)
     def wrapper(*args, **kwargs):
@@ -34,11 +40,27 @@ def job_locked_by_object_id(func):
         lock = redis_lock.Lock(redis, f"lock-object-{object_id}")
 
         with lock:
-            return func(*args, **kwargs)
+            result = func(*args, **kwargs)
+            remove_finished_object_from_index(object_id)
+
+            return result
 
     return wrapper
 
 
+def remove_finished_object_from_index(object_id):
+    """
+    Remove the object from the object index once the current RQ job has
+    finished successfully, unless the job enqueued the object into the next
+    queue.
+
+    Does nothing if called outside a RQ job.
+    """
+    job = get_current_job()
+    if job:
+        remove_object_from_index(object_id, job.origin)
+
+
 def freeze_running_object(object_id, sip_id, freeze_reason):
     """
     Cancel and freeze a MuseumObject that is currently in the workflow,
@@ -1,12 +1,11 @@
-from collections import defaultdict
-from contextlib import contextmanager
+from contextlib import ExitStack, contextmanager
 from enum import Enum
 
 import redis_lock
 from passari_workflow.redis.connection import get_redis_connection
 from rq import Queue
 from rq.exceptions import NoSuchJobError
-from rq.job import Job
+from rq.job import Job, JobStatus
 from rq.registry import FailedJobRegistry, StartedJobRegistry
 
 
@@ -21,10 +20,107 @@ class QueueType(Enum):
     ENQUEUE_OBJECTS = "enqueue_objects"
 
 
+# Redis hash of {object_id: queue_name} for every object in the workflow.
+# An object is added when a job is enqueued for it, and removed when its last
+# job finishes successfully or is deleted. Failed jobs are kept.
+OBJECT_INDEX_KEY = "workflow-object-index"
+
+# Set once the index has been built from the queues and registries
+OBJECT_INDEX_BUILT_KEY = "workflow-object-index-built"
+
+# Remove the object from the index only if it's still in the given queue.
+# If the job already enqueued the object into the next queue, the object
+# is kept.
+REMOVE_OBJECT_SCRIPT = """
+if redis.call("HGET", KEYS[1], ARGV[1]) == ARGV[2] then
+    return redis.call("HDEL", KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+# How many lock stripes the object IDs are divided into. Operations on
+# objects in different stripes can be performed at the same time.
+OBJECT_LOCK_STRIPE_COUNT = 64
+
+# Seconds until a workflow lock expires if it's not released
+WORKFLOW_LOCK_EXPIRE = 900
+
+# How many jobs 'WorkflowQueue.enqueue_object_jobs' writes in a single
+# transaction
+ENQUEUE_BATCH_SIZE = 1000
+
+
 class WorkflowQueue(Queue):
     # Workflow tasks have a default timeout of 4 hours
     DEFAULT_TIMEOUT = 14400
 
+    def enqueue_job(self, job, pipeline=None, at_front=False):
+        """
+        Enqueue the job and add its object to the object index in the same
+        transaction
+        """
+        if pipeline is not None:
+            self._add_to_object_index(job, pipeline)
+            return super().enqueue_job(
+                job, pipeline=pipeline, at_front=at_front
+            )
+
+        with self.connection.pipeline() as pipe:
+            self._add_to_object_index(job, pipe)
+
+            if self._is_async:
+                job = super().enqueue_job(
+                    job, pipeline=pipe, at_front=at_front
+                )
+                pipe.execute()
+                return job
+
+            # Synchronous queues run the job before returning, so the
+            # object has to be in the index before the job is saved
+            pipe.execute()
+
+        return super().enqueue_job(job, at_front=at_front)
+
+    def _add_to_object_index(self, job, pipeline):
+        """
+        Add the job's object to the object index if this is an object queue
+        """
+        if self.name in OBJECT_QUEUE_NAMES:
+            object_id = job_id_to_object_id(job.id)
+            if object_id is not None:
+                pipeline.hset(OBJECT_INDEX_KEY, object_id, self.name)
+
+    def enqueue_object_jobs(
+            self, func, object_ids, batch_size=ENQUEUE_BATCH_SIZE):
+        """
+        Enqueue a job for each object ID.
+
+        The jobs are created with the job ID '{queue_name}_{object_id}'
+        and are written in batches, each batch in a single transaction
+        instead of a separate round trip for each job.
+
+        :param func: Function called with the 'object_id' keyword argument
+        :param object_ids: Object IDs to enqueue
+        :param int batch_size: How many jobs to write in a single transaction
+
+        :returns: List of enqueued jobs
+        """
+        object_ids = [int(object_id) for object_id in object_ids]
+        jobs = []
+
+        for i in range(0, len(object_ids), batch_size):
+            with self.connection.pipeline() as pipe:
+                for object_id in object_ids[i:i+batch_size]:
+                    job = self.create_job(
+                        func, kwargs={"object_id": object_id},
+                        job_id=f"{self.name}_{object_id}"
+                    )
+                    jobs.append(self.enqueue_job(job, pipeline=pipe))
+
+                pipe.execute()
+
+        return jobs
+
 
 OBJECT_QUEUE_TYPES = [
     QueueType.DOWNLOAD_OBJECT,
@@ -33,6 +129,8 @@ OBJECT_QUEUE_TYPES = [
     QueueType.CONFIRM_SIP
 ]
 
+OBJECT_QUEUE_NAMES = [queue_type.value for queue_type in OBJECT_QUEUE_TYPES]
+
 
 def job_id_to_object_id(job_id):
     """
@@ -76,41 +174,142 @@ def delete_jobs_for_object_id(object_id):
         except NoSuchJobError:
             pass
 
+    redis.hdel(OBJECT_INDEX_KEY, object_id)
+
     return cancelled_count
 
 
-def get_enqueued_object_ids():
+def remove_object_from_index(object_id, queue_name):
     """
-    Get object IDs from every object-related queue including every pending,
-    executing and failed job.
+    Remove the object from the object index if it's still in the given queue.
 
-    This can be used to determine which jobs can be enqueued without
-    risk of duplicates
+    This is called when a job finishes successfully. The check and the
+    removal are done atomically, meaning an object that was already
+    enqueued into the next queue is kept.
+
+    :returns: True if the object was removed
     """
-    object_ids = set()
+    redis = get_redis_connection()
+    remove_object = redis.register_script(REMOVE_OBJECT_SCRIPT)
+
+    return bool(
+        remove_object(
+            keys=[OBJECT_INDEX_KEY], args=[int(object_id), queue_name]
+        )
+    )
+
+
+def scan_object_id2queue_name():
+    """
+    Get a {object_id: queue_name} dictionary by iterating every pending,
+    executing and failed job in every object-related queue.
+
+    If an object has jobs in multiple queues, the last queue in the workflow
+    is used.
+    """
+    object_id2queue_name = {}
 
     registry_types = (StartedJobRegistry, FailedJobRegistry)
 
     for queue_type in OBJECT_QUEUE_TYPES:
         queue = get_queue(queue_type)
 
-        # Retrieve started and failed jobs
+        # Retrieve started and failed jobs, followed by scheduled jobs
+        job_ids = queue.get_job_ids()
         for registry_type in registry_types:
             job_registry = registry_type(queue=queue)
-            job_ids = job_registry.get_job_ids()
+            job_ids += job_registry.get_job_ids()
 
-            for job_id in job_ids:
-                object_id = job_id_to_object_id(job_id)
-                if object_id is not None:
-                    object_ids.add(object_id)
-
-        # Retrieve scheduled jobs
-        for job_id in queue.get_job_ids():
+        for job_id in job_ids:
             object_id = job_id_to_object_id(job_id)
             if object_id is not None:
-                object_ids.add(object_id)
+                object_id2queue_name[object_id] = queue_type.value
 
-    return object_ids
+    return object_id2queue_name
+
+
+def rebuild_object_index():
+    """
+    Rebuild the object index from the queues and registries.
+
+    The index can become outdated if jobs are deleted or finished outside the
+    workflow, for example using a RQ dashboard. The workflow should be
+    locked while the index is rebuilt.
+
+    :returns: Amount of objects in the rebuilt index
+    """
+    redis = get_redis_connection()
+    object_id2queue_name = scan_object_id2queue_name()
+
+    with redis.pipeline() as pipe:
+        pipe.delete(OBJECT_INDEX_KEY)
+        if object_id2queue_name:
+            pipe.hset(OBJECT_INDEX_KEY, mapping=object_id2queue_name)
+        pipe.set(OBJECT_INDEX_BUILT_KEY, 1)
+        pipe.execute()
+
+    return len(object_id2queue_name)
+
+
+def _ensure_object_index(redis):
+    """
+    Build the object index if it hasn't been built yet. This is done
+    automatically on first use after upgrading.
+    """
+    if not redis.exists(OBJECT_INDEX_BUILT_KEY):
+        rebuild_object_index()
+
+
+def get_enqueued_object_ids(object_ids=None):
+    """
+    Get object IDs from every object-related queue including every pending,
+    executing and failed job.
+
+    This can be used to determine which jobs can be enqueued without
+    risk of duplicates
+
+    :param object_ids: If provided, only check the given object IDs
+    """
+    redis = get_redis_connection()
+    _ensure_object_index(redis)
+
+    if object_ids is None:
+        return set(
+            int(object_id) for object_id in redis.hkeys(OBJECT_INDEX_KEY)
+        )
+
+    object_ids = [int(object_id) for object_id in object_ids]
+    if not object_ids:
+        return set()
+
+    queue_names = redis.hmget(OBJECT_INDEX_KEY, object_ids)
+
+    return set(
+        object_id for object_id, queue_name in zip(object_ids, queue_names)
+        if queue_name is not None
+    )
+
+
+def is_object_enqueued(object_id):
+    """
+    Check whether the object has a pending, executing or failed job in any
+    object-related queue
+    """
+    redis = get_redis_connection()
+    _ensure_object_index(redis)
+
+    return bool(redis.hexists(OBJECT_INDEX_KEY, int(object_id)))
+
+
+def get_enqueued_object_count():
+    """
+    Get the amount of objects with a pending, executing or failed job in any
+    object-related queue
+    """
+    redis = get_redis_connection()
+    _ensure_object_index(redis)
+
+    return redis.hlen(OBJECT_INDEX_KEY)
 
 
 def get_running_object_ids():
@@ -136,60 +335,121 @@ def get_running_object_ids():
 def get_object_id2queue_map(object_ids):
     """
     Get a {object_id: queue_names} dictionary of object IDs and the queues they
-    currently belong to
+    currently belong to.
+
+    The status of each candidate job '{queue_name}_{object_id}' is retrieved
+    using a single pipeline, meaning the cost depends on the amount of
+    object IDs instead of the amount of jobs in the queues.
     """
-    queue_object_ids = defaultdict(set)
+    redis = get_redis_connection()
+    object_ids = list(object_ids)
+
+    with redis.pipeline(transaction=False) as pipe:
+        for object_id in object_ids:
+            for queue_name in OBJECT_QUEUE_NAMES:
+                pipe.hget(
+                    Job.key_for(f"{queue_name}_{object_id}"), "status"
+                )
+
+        statuses = iter(pipe.execute())
+
     queue_map = {}
 
-    for queue_type in OBJECT_QUEUE_TYPES:
-        queue = get_queue(queue_type)
-        started_registry = StartedJobRegistry(queue=queue)
-        job_ids = started_registry.get_job_ids() + queue.get_job_ids()
+    for object_id in object_ids:
+        queue_names = []
+        failed = False
 
-        # Check pending or executing jobs
-        for job_id in job_ids:
-            object_id = job_id_to_object_id(job_id)
-            if object_id is not None:
-                queue_object_ids[queue_type.value].add(object_id)
+        for queue_name in OBJECT_QUEUE_NAMES:
+            status = next(statuses)
+            if status is None:
+                continue
 
-        failed_registry = FailedJobRegistry(queue=get_queue(queue_type))
-        job_ids = failed_registry.get_job_ids()
+            status = status.decode("utf-8")
 
-        # Check failed jobs
-        for job_id in job_ids:
-            object_id = job_id_to_object_id(job_id)
-            if object_id is not None:
-                queue_object_ids[queue_type.value].add(object_id)
-                queue_object_ids["failed"].add(object_id)
+            if status == JobStatus.FAILED:
+                failed = True
+            elif status == JobStatus.FINISHED:
+                continue
 
-    # Check for all queues plus the catch-all failed queue
-    queue_names = [
-        queue_type.value for queue_type in OBJECT_QUEUE_TYPES
-    ] + ["failed"]
+            queue_names.append(queue_name)
 
-    for object_id in object_ids:
-        queue_map[object_id] = []
-        for queue_name in queue_names:
-            if object_id in queue_object_ids[queue_name]:
-                queue_map[object_id].append(queue_name)
+        # Failed jobs are also included in the catch-all failed queue
+        if failed:
+            queue_names.append("failed")
+
+        queue_map[object_id] = queue_names
 
     return queue_map
 
 
+def get_object_lock_stripes(object_ids):
+    """
+    Get the sorted list of lock stripes covering the given object IDs
+    """
+    return sorted(
+        set(int(object_id) % OBJECT_LOCK_STRIPE_COUNT
+            for object_id in object_ids)
+    )
+
+
 @contextmanager
-def lock_queues():
+def _acquire_locks(lock_names):
     """
-    Context manager to lock all queues.
+    Acquire the given locks in order and release them once the block is
+    exited
 
-    This lock should be acquired when the workflow is affected directly
-    (eg. enqueueing new jobs) or indirectly (eg. updating database
-    so that changes an object's qualification to be enqueued or not)
+    :returns: List of the acquired locks
     """
     redis = get_redis_connection()
+    locks = []
 
-    lock = redis_lock.Lock(redis, "workflow-lock", expire=900)
-    lock.acquire(blocking=True)
-    try:
-        yield lock
-    finally:
-        lock.release()
+    with ExitStack() as stack:
+        for lock_name in lock_names:
+            lock = redis_lock.Lock(
+                redis, lock_name, expire=WORKFLOW_LOCK_EXPIRE
+            )
+            lock.acquire(blocking=True)
+            stack.callback(lock.release)
+            locks.append(lock)
+
+        yield locks
+
+
+@contextmanager
+def lock_objects(object_ids):
+    """
+    Context manager to lock the workflow for the given objects.
+
+    This lock should be acquired when the workflow is affected for specific
+    objects (eg. enqueueing or freezing objects). Only the lock stripes
+    covering the objects are acquired, meaning operations on other objects
+    can be performed at the same time.
+
+    :returns: List of the acquired stripe locks
+    """
+    stripes = get_object_lock_stripes(object_ids)
+    lock_names = [f"workflow-lock-{stripe}" for stripe in stripes]
+
+    with _acquire_locks(lock_names) as locks:
+        yield locks
+
+
+@contextmanager
+def lock_queues():
+    """
+    Context manager to lock all queues.
+
+    This lock should be acquired when the entire workflow is affected
+    (eg. resetting the workflow or rebuilding the object index). Use
+    'lock_objects' when only specific objects are affected.
+    """
+    # The stripes are always acquired in ascending order, meaning this can't
+    # deadlock with 'lock_objects'
+    lock_names = ["workflow-lock"] + [
+        f"workflow-lock-{stripe}"
+        for stripe in range(0, OBJECT_LOCK_STRIPE_COUNT)
+    ]
+
+    with _acquire_locks(lock_names) as locks:
+        # The global 'workflow-lock' is returned as before
+        yield locks[0]
@@ -1,19 +1,68 @@
-from passari_workflow.config import CONFIG
+import os
 
-from redis import Redis
+from passari_workflow.config import CONFIG, get_bool
+
+from redis import BlockingConnectionPool, Redis
+
+
+# Connection pools created by 'get_redis_connection', keyed by the process ID,
+# the database and the connection options. Each process only needs one
+# connection pool for each database.
+_CONNECTION_POOLS = {}
+
+
+def get_connection_options():
+    """
+    Get the options used to create the Redis connection pool
+    """
+    password = CONFIG["redis"].get("password", None)
+
+    return {
+        "host": CONFIG["redis"]["host"],
+        "port": int(CONFIG["redis"]["port"]),
+        "password": password if password else None,
+        "max_connections": int(CONFIG["redis"].get("max_connections", 50)),
+        "timeout": float(CONFIG["redis"].get("pool_timeout", 20)),
+        "socket_keepalive": get_bool(
+            CONFIG["redis"].get("socket_keepalive", True)
+        ),
+        "health_check_interval": int(
+            CONFIG["redis"].get("health_check_interval", 30)
+        )
+    }
+
+
+def get_connection_pool(db=0):
+    """
+    Get the connection pool for the given Redis database.
+
+    Once the pool has 'max_connections' connections in use, further
+    commands wait up to 'pool_timeout' seconds for a connection to be
+    released instead of failing immediately.
+
+    The pool is created once per process. RQ forks a work horse for every
+    job, and the pool is keyed by the process ID to ensure the work horse
+    opens its own connections instead of reusing the parent's sockets.
+    The parent's pool is left as-is in the work horse, as closing its
+    connections would also affect the parent process.
+    """
+    options = get_connection_options()
+    key = (os.getpid(), db, tuple(sorted(options.items())))
+
+    pool = _CONNECTION_POOLS.get(key)
+
+    if not pool:
+        pool = BlockingConnectionPool(db=db, **options)
+        _CONNECTION_POOLS[key] = pool
+
+    return pool
 
 
 def get_redis_connection(db=0):
     """
     Get Redis connection used for the workflow, distributed locks and other
-    miscellaneous tasks
+    miscellaneous tasks.
+
+    The returned clients share a connection pool for each database.
     """
-    password = CONFIG["redis"].get("password", None)
-    redis = Redis(
-        host=CONFIG["redis"]["host"],
-        port=CONFIG["redis"]["port"],
-        db=db,
-        password=password if password else None
-    )
-
-    return redis
+    return Redis(connection_pool=get_connection_pool(db=db))
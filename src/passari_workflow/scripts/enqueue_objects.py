@@ -2,14 +2,17 @@
 Enqueue objects to be downloaded
 """
 import click
-from sqlalchemy.sql.expression import func
+from sqlalchemy import BigInteger
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.sql.expression import all_, bindparam, func
 
 from passari_workflow.db import scoped_session
 from passari_workflow.db.connection import connect_db
 from passari_workflow.db.models import MuseumObject
 from passari_workflow.jobs.download_object import download_object
-from passari_workflow.queue.queues import (QueueType, get_enqueued_object_ids,
-                                           get_queue, lock_queues)
+from passari_workflow.queue.queues import (ENQUEUE_BATCH_SIZE, QueueType,
+                                           get_enqueued_object_ids, get_queue,
+                                           lock_objects)
 
 
 def enqueue_object(object_id):
@@ -17,7 +20,7 @@ def enqueue_object(object_id):
     Enqueue a single object.
 
     This can be called separately outside of 'enqueue_objects'. In this case,
-    the caller needs to ensure the workflow is locked.
+    the caller needs to ensure the object is locked using 'lock_objects'.
     """
     object_id = int(object_id)
     queue = get_queue(QueueType.DOWNLOAD_OBJECT)
@@ -30,10 +33,49 @@ def enqueue_object(object_id):
     )
 
 
+def get_pending_object_ids(
+        db, object_count, enqueued_object_ids, random=False, object_ids=None):
+    """
+    Get IDs of objects pending preservation that are not in the workflow
+
+    :param int object_count: How many object IDs to return at most
+    :param enqueued_object_ids: Object IDs already in the workflow
+    :param bool random: Whether to return objects in random order
+    :param list object_ids: If provided, only these objects are included
+    """
+    # Exclude the objects already in the workflow in the database,
+    # meaning only the objects to enqueue are retrieved
+    object_query = (
+        db.query(MuseumObject.id)
+        .with_transformation(MuseumObject.filter_preservation_pending)
+        .filter(
+            MuseumObject.id != all_(
+                bindparam(
+                    "enqueued_object_ids",
+                    value=list(enqueued_object_ids),
+                    type_=ARRAY(BigInteger)
+                )
+            )
+        )
+    )
+
+    if object_ids:
+        object_query = object_query.filter(MuseumObject.id.in_(object_ids))
+
+    if random:
+        object_query = object_query.order_by(func.random())
+
+    return [result.id for result in object_query.limit(object_count)]
+
+
 def enqueue_objects(object_count, random=False, object_ids=None):
     """
     Enqueue given number of objects to the preservation workflow.
 
+    The objects are selected without locking the workflow. Each batch of
+    objects is then checked again and enqueued while only those objects are
+    locked, meaning other objects can be frozen during a large run.
+
     :param int object_count: How many objects to enqueue at most
     :param bool random: Whether to enqueue objects at random instead
                         of in-order.
@@ -43,35 +85,48 @@ def enqueue_objects(object_count, random=False, object_ids=None):
     if object_ids:
         object_count = len(object_ids)
 
-    with lock_queues():
-        connect_db()
-        enqueued_object_ids = get_enqueued_object_ids()
-
-        new_job_count = 0
-
-        with scoped_session() as db:
-            object_query = (
-                db.query(MuseumObject)
-                .with_transformation(MuseumObject.filter_preservation_pending)
-                .yield_per(500)
-            )
+    connect_db()
+    queue = get_queue(QueueType.DOWNLOAD_OBJECT)
 
-            if object_ids:
-                object_query = object_query.filter(
-                    MuseumObject.id.in_(object_ids)
+    with scoped_session() as db:
+        candidate_object_ids = get_pending_object_ids(
+            db, object_count=object_count,
+            enqueued_object_ids=get_enqueued_object_ids(),
+            random=random, object_ids=object_ids
+        )
+
+    new_job_count = 0
+
+    for i in range(0, len(candidate_object_ids), ENQUEUE_BATCH_SIZE):
+        batch_object_ids = candidate_object_ids[i:i+ENQUEUE_BATCH_SIZE]
+
+        with lock_objects(batch_object_ids):
+            # The objects may have been enqueued or frozen before the lock
+            # was acquired
+            with scoped_session() as db:
+                pending_object_ids = set(
+                    get_pending_object_ids(
+                        db, object_count=len(batch_object_ids),
+                        enqueued_object_ids=get_enqueued_object_ids(
+                            batch_object_ids
+                        ),
+                        object_ids=batch_object_ids
+                    )
                 )
 
-            if random:
-                object_query = object_query.order_by(func.random())
+            # Write the jobs in bulk instead of one object at a time
+            jobs = queue.enqueue_object_jobs(
+                download_object,
+                [
+                    object_id for object_id in batch_object_ids
+                    if object_id in pending_object_ids
+                ]
+            )
 
-            for museum_object in object_query:
-                if museum_object.id not in enqueued_object_ids:
-                    enqueue_object(museum_object.id)
-                    new_job_count += 1
-                    print(f"Enqueued download_object_{museum_object.id}")
+        for job in jobs:
+            print(f"Enqueued {job.id}")
 
-                if new_job_count >= object_count:
-                    break
+        new_job_count += len(jobs)
 
     print(f"{new_job_count} object(s) enqueued for download")
 
@@ -11,11 +11,12 @@ from passari_workflow.config import ARCHIVE_DIR, PACKAGE_DIR
 from passari_workflow.db import scoped_session
 from passari_workflow.db.connection import connect_db
 from passari_workflow.db.models import (FreezeSource, MuseumObject,
-                                               MuseumPackage)
+                                               MuseumPackage,
+                                               update_next_eligible_at)
 from passari_workflow.exceptions import WorkflowJobRunningError
 from passari_workflow.queue.queues import (delete_jobs_for_object_id,
                                                   get_running_object_ids,
-                                                  lock_queues)
+                                                  lock_objects)
 
 
 def freeze_objects(object_ids, reason, source, delete_jobs=True):
@@ -29,7 +30,7 @@ def freeze_objects(object_ids, reason, source, delete_jobs=True):
     object_ids = [int(object_id) for object_id in object_ids]
     source = FreezeSource(source)
 
-    with lock_queues():
+    with lock_objects(object_ids):
         # Are there object IDs that we're about to freeze but that are
         # still running?
         running_object_ids = get_running_object_ids()
@@ -52,6 +53,7 @@ def freeze_objects(object_ids, reason, source, delete_jobs=True):
                     MuseumObject.freeze_source: source
                 }, synchronize_session=False)
             )
+            update_next_eligible_at(db, object_ids)
 
             packages_to_cancel = list(
                 db.query(MuseumPackage)
@@ -85,7 +87,9 @@ def freeze_objects(object_ids, reason, source, delete_jobs=True):
                 for object_id in object_ids:
                     delete_jobs_for_object_id(object_id)
 
-                    # Delete the museum package directory
+                    # Delete the museum package directory. This is done
+                    # while the object is locked to ensure a new job
+                    # doesn't start using the directory.
                     try:
                         shutil.rmtree(Path(PACKAGE_DIR) / str(object_id))
                     except OSError:
@@ -0,0 +1,33 @@
+"""
+Rebuild the index of objects in the workflow from the RQ queues and
+registries.
+
+This is only needed if jobs have been deleted or finished outside the
+workflow, for example using a RQ dashboard.
+"""
+import click
+
+from passari_workflow.queue.queues import lock_queues, rebuild_object_index
+
+
+def repair_workflow_index():
+    """
+    Rebuild the object index while the workflow is locked
+
+    :returns: Amount of objects in the workflow
+    """
+    with lock_queues():
+        object_count = rebuild_object_index()
+
+    print(f"{object_count} object(s) in the workflow")
+
+    return object_count
+
+
+@click.command()
+def cli():
+    repair_workflow_index()
+
+
+if __name__ == "__main__":
+    cli()
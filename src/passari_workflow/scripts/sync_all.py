@@ -0,0 +1,112 @@
+"""
+Run 'sync-objects', 'sync-attachments' and 'sync-hashes' in order in
+a single process.
+
+The MuseumPlus session and the database connection pool are shared by
+every phase, and the hash phase only processes the objects changed by the
+first two phases.
+"""
+import asyncio
+import time
+
+import click
+
+from passari.museumplus.connection import get_museum_session
+from passari_workflow.db.connection import connect_db
+from passari_workflow.scripts.sync_attachments import sync_attachments
+from passari_workflow.scripts.sync_hashes import sync_hashes
+from passari_workflow.scripts.sync_objects import sync_objects
+from passari_workflow.sync.metrics import configure_logging
+
+
+async def sync_all(save_progress=False, in_database=False):
+    """
+    Synchronize objects and attachments from MuseumPlus and update the
+    metadata hashes for the changed objects
+
+    :param bool save_progress: Whether to save synchronization progress
+                               and continue from the last run
+    :param bool in_database: Whether to calculate the hashes in the database
+    """
+    museum_session = await get_museum_session()
+
+    try:
+        print("Synchronizing objects")
+        await sync_objects(
+            save_progress=save_progress, museum_session=museum_session
+        )
+
+        print("Synchronizing attachments")
+        await sync_attachments(
+            save_progress=save_progress, museum_session=museum_session
+        )
+    finally:
+        await museum_session.close()
+
+    # Objects changed by the previous phases have been marked dirty, meaning
+    # only those are processed
+    print("Synchronizing hashes")
+    sync_hashes(in_database=in_database)
+
+
+def run_sync_all(save_progress=False, in_database=False, interval=None):
+    """
+    Run the synchronization once, or repeatedly if an interval is provided
+
+    :param int interval: Seconds between the start of each run. If not
+                         provided, the synchronization is only run once.
+    """
+    loop = asyncio.get_event_loop()
+
+    while True:
+        start = time.monotonic()
+        loop.run_until_complete(
+            sync_all(save_progress=save_progress, in_database=in_database)
+        )
+
+        if interval is None:
+            break
+
+        delay = max(interval - (time.monotonic() - start), 0)
+        print(f"Synchronization finished, next run in {delay:.0f} seconds")
+        time.sleep(delay)
+
+
+@click.command()
+@click.option(
+    "--save-progress/--no-save-progress", is_flag=True, default=False,
+    help=(
+        "If enabled, synchronization progress of objects and attachments "
+        "will be saved to allow the run to be continued from an incomplete "
+        "state and enable more efficient updates on subsequent runs."
+    )
+)
+@click.option(
+    "--in-database", is_flag=True, default=False,
+    help=(
+        "Calculate the hashes in the database instead of retrieving "
+        "every object and attachment"
+    )
+)
+@click.option(
+    "--loop", is_flag=True, default=False,
+    help="Keep running the synchronization until stopped"
+)
+@click.option(
+    "--interval", type=int, default=3600,
+    help=(
+        "Seconds between the start of each synchronization run when "
+        "--loop is enabled"
+    )
+)
+def cli(save_progress, in_database, loop, interval):
+    configure_logging()
+    connect_db()
+    run_sync_all(
+        save_progress=save_progress, in_database=in_database,
+        interval=interval if loop else None
+    )
+
+
+if __name__ == "__main__":
+    cli()
@@ -8,30 +8,191 @@ yet.
 """
 import asyncio
 import datetime
-from collections import defaultdict
 from pathlib import Path
 
 import click
-from sqlalchemy.orm import load_only
-from sqlalchemy.sql.expression import bindparam
+from sqlalchemy import func, or_, select
 
-from passari.museumplus.connection import get_museum_session
 from passari.museumplus.search import iterate_multimedia
 from passari_workflow.config import USER_CONFIG_DIR
 from passari_workflow.db import scoped_session
 from passari_workflow.db.connection import connect_db
-from passari_workflow.db.models import MuseumAttachment, MuseumObject
-from passari_workflow.db.utils import bulk_create_or_get
-from passari_workflow.heartbeat import HeartbeatSource, submit_heartbeat
-from passari_workflow.scripts.utils import (finish_sync_progress,
-                                                   get_sync_status,
-                                                   update_offset)
+from passari_workflow.db.models import (MuseumAttachment, MuseumObject,
+                                        mark_attachment_objects_dirty,
+                                        mark_objects_dirty,
+                                        object_attachment_association_table,
+                                        update_next_eligible_at)
+from passari_workflow.exceptions import SyncFetchError
+from passari_workflow.heartbeat import HeartbeatSource
+from passari_workflow.scripts.sync_hashes import sync_dirty_hashes
+from passari_workflow.scripts.utils import read_entry_ids
+from passari_workflow.sync.engine import (CHUNK_SIZE, SHARD_WINDOW_SIZE,
+                                          SyncAdapter, run_resync, run_sync)
+from passari_workflow.sync.metrics import configure_logging
+
+
+def update_object_modified_dates(db, attachment_ids):
+    """
+    Set the modification date of each MuseumObject linked to the given
+    attachments to the newest attachment modification date, if it's
+    newer than the object's own.
+
+    This is because we want to know if the museum object OR one of its
+    attachments has been changed.
+
+    The linked objects are locked in order of their IDs before they are
+    updated. Shards are written in concurrent transactions and attachments
+    of the same object can be in different shards, meaning locking the rows
+    in the order the join produces could cause a deadlock.
+
+    :param db: SQLAlchemy session
+    :param attachment_ids: Attachment IDs whose objects are updated
+
+    :returns: List of updated object IDs
+    """
+    if not attachment_ids:
+        return []
+
+    objects = MuseumObject.__table__
+    attachments = MuseumAttachment.__table__
+    assoc = object_attachment_association_table
+
+    # Lock the linked objects in a fixed order
+    db.execute(
+        select([objects.c.id])
+        .where(
+            objects.c.id.in_(
+                select([assoc.c.museum_object_id])
+                .where(assoc.c.museum_attachment_id.in_(attachment_ids))
+            )
+        )
+        .order_by(objects.c.id)
+        .with_for_update()
+    )
+
+    latest_dates = (
+        select([
+            assoc.c.museum_object_id.label("id"),
+            func.max(attachments.c.modified_date).label("modified_date")
+        ])
+        .select_from(
+            assoc.join(
+                attachments, attachments.c.id == assoc.c.museum_attachment_id
+            )
+        )
+        .where(assoc.c.museum_attachment_id.in_(attachment_ids))
+        .group_by(assoc.c.museum_object_id)
+        .alias("latest_dates")
+    )
 
-# How many attachments to retrieve at a time before updating the database
-CHUNK_SIZE = 500
+    updated_ids = [
+        result.id for result in db.execute(
+            objects.update()
+            .values(
+                modified_date=func.greatest(
+                    objects.c.modified_date, latest_dates.c.modified_date
+                )
+            )
+            .where(objects.c.id == latest_dates.c.id)
+            .where(
+                or_(
+                    objects.c.modified_date == None,
+                    objects.c.modified_date < latest_dates.c.modified_date
+                )
+            )
+            .where(latest_dates.c.modified_date != None)
+            .returning(objects.c.id)
+        )
+    ]
+    update_next_eligible_at(db, updated_ids)
+
+    return updated_ids
 
 
-async def sync_attachments(offset=0, limit=None, save_progress=False):
+class AttachmentSyncAdapter(SyncAdapter):
+    """
+    Synchronize MuseumPlus multimedia into MuseumAttachment entries and link
+    them to their objects.
+
+    This is the inverse of 'ObjectSyncAdapter': the links are replaced from
+    the attachment's side instead.
+    """
+    name = "sync_attachments"
+    heartbeat_source = HeartbeatSource.SYNC_ATTACHMENTS
+
+    model = MuseumAttachment
+    columns = [
+        "id", "filename", "modified_date", "created_date", "metadata_hash"
+    ]
+    update_columns = [
+        "filename", "modified_date", "created_date", "metadata_hash"
+    ]
+
+    association_table = object_attachment_association_table
+    association_key_column = "museum_attachment_id"
+    association_value_column = "museum_object_id"
+    associated_model = MuseumObject
+
+    def iterate(self, museum_session, offset, modify_date_gte):
+        return iterate_multimedia(
+            session=museum_session, offset=offset,
+            modify_date_gte=modify_date_gte
+        )
+
+    def get_row(self, result):
+        return (
+            int(result["id"]), result["filename"], result["modified_date"],
+            result["created_date"], result["xml_hash"]
+        )
+
+    def get_associated_ids(self, result):
+        return result["object_ids"]
+
+    def after_update(self, db, upserted, added, removed):
+        attachment_ids = [attachment_id for attachment_id, _ in upserted]
+
+        # Metadata hashes may have changed, meaning the linked objects need to
+        # be updated by 'sync_hashes'
+        mark_attachment_objects_dirty(db, attachment_ids)
+        mark_objects_dirty(
+            db, [object_id for _, object_id in added + removed]
+        )
+
+        # Unchanged attachments only need to be considered for newly linked
+        # objects
+        update_object_modified_dates(
+            db,
+            attachment_ids=list(
+                set(attachment_ids)
+                | set(attachment_id for attachment_id, _ in added)
+            )
+        )
+
+
+def get_linked_object_ids(attachment_ids):
+    """
+    Get the IDs of the objects linked to the given attachments
+
+    :param attachment_ids: List of attachment IDs
+
+    :returns: Set of object IDs
+    """
+    assoc = object_attachment_association_table
+
+    with scoped_session() as db:
+        return set(
+            result.museum_object_id for result in db.execute(
+                select([assoc.c.museum_object_id])
+                .where(assoc.c.museum_attachment_id.in_(attachment_ids))
+                .distinct()
+            )
+        )
+
+
+async def sync_attachments(
+        offset=0, limit=None, save_progress=False, shards=None,
+        shard_window_size=SHARD_WINDOW_SIZE, concurrency=None,
+        museum_session=None):
     """
     Synchronize attachment metadata from MuseumPlus to determine which
     objects have changed and need to be updated in the DPRES service. This
@@ -44,168 +205,60 @@ async def sync_attachments(offset=0, limit=None, save_progress=False):
     :param bool save_progress: Whether to save synchronization progress
                                and continue from the last run. Offset and limit
                                are ignored if enabled.
+    :param int shards: Split the attachments into this many shards and iterate
+                       them concurrently. Progress of each shard is always
+                       saved. Offset, limit and save_progress are ignored if
+                       enabled.
+    :param int shard_window_size: How many attachments each shard iterates
+                                  before moving to its next window
+    :param int concurrency: How many shards to iterate concurrently at most.
+                            Default is the amount of shards.
+    :param museum_session: MuseumPlus session to use. Default is to create
+                           a new session.
     """
-    modify_date_gte = None
-
-    if save_progress:
-        limit = None
-
-        sync_status = get_sync_status("sync_attachments")
-        offset = sync_status.offset
-        # Start synchronization from attachments that changed since the last
-        # sync
-        modify_date_gte = sync_status.prev_start_sync_date
-        print(f"Continuing synchronization from {offset}")
-
-    # TODO: This is pretty much an inverse version of 'sync_objects'.
-    # This process should be made more generic if possible.
-    museum_session = await get_museum_session()
-    multimedia_iter = iterate_multimedia(
-        session=museum_session, offset=offset,
-        modify_date_gte=modify_date_gte
+    await run_sync(
+        AttachmentSyncAdapter(), offset=offset, limit=limit,
+        save_progress=save_progress, chunk_size=CHUNK_SIZE, shards=shards,
+        shard_window_size=shard_window_size, concurrency=concurrency,
+        museum_session=museum_session
     )
-    all_iterated = False
-    index = offset
-    processed = 0
-
-    while True:
-        results = []
 
-        all_iterated = True
-        async for result in multimedia_iter:
-            all_iterated = False
-            results.append(result)
-            index += 1
 
-            if len(results) >= CHUNK_SIZE:
-                break
-
-        attachments = {result["id"]: result for result in results}
-        attachment_ids = list(attachments.keys())
-
-        inserts, updates = 0, 0
-
-        with scoped_session() as db:
-            existing_attachment_ids = set([
-                result.id for result in
-                db.query(MuseumAttachment).options(load_only("id"))
-                  .filter(MuseumAttachment.id.in_(attachment_ids))
-            ])
-
-            attachment_id2object_id = defaultdict(set)
-            object_ids = set()
+async def resync_attachments(
+        attachment_ids, update_hashes=False, museum_session=None):
+    """
+    Synchronize the given attachments from MuseumPlus immediately, regardless
+    of the synchronization progress
 
-            update_params = []
+    :param attachment_ids: IDs of the attachments to synchronize
+    :param bool update_hashes: Whether to update the attachment metadata
+                               hashes of the objects linked to the given
+                               attachments afterwards if they have changed
+    :param museum_session: MuseumPlus session to use. Default is to create
+                           a new session.
 
-            # Create existing objects, update the rest
-            for result in attachments.values():
-                attachment_id = int(result["id"])
-                filename = result["filename"]
-                modified_date = result["modified_date"]
-                created_date = result["created_date"]
-                xml_hash = result["xml_hash"]
+    :raises SyncFetchError: If the attachments can't be retrieved from
+                            MuseumPlus
 
-                attachment_id2object_id[attachment_id].update(
-                    result["object_ids"]
-                )
-                object_ids.update(result["object_ids"])
-
-                if attachment_id in existing_attachment_ids:
-                    # Update
-                    update_params.append({
-                        "_id": attachment_id,
-                        "_filename": filename,
-                        "_modified_date": modified_date,
-                        "_created_date": created_date,
-                        "_metadata_hash": xml_hash
-                    })
-                    updates += 1
-                else:
-                    # Create
-                    mus_attachment = MuseumAttachment(
-                        id=attachment_id,
-                        filename=filename,
-                        modified_date=modified_date,
-                        created_date=created_date,
-                        metadata_hash=xml_hash
-                    )
-                    db.add(mus_attachment)
-                    inserts += 1
-
-                processed += 1
-
-                if limit is not None and processed == limit:
-                    all_iterated = True
-                    break
-
-            if update_params:
-                # Perform updates in bulk
-                stmt = (
-                    MuseumAttachment.__table__.update()
-                    .where(MuseumAttachment.id == bindparam("_id"))
-                    .values({
-                        "filename": bindparam("_filename"),
-                        "created_date": bindparam("_created_date"),
-                        "modified_date": bindparam("_modified_date"),
-                        "metadata_hash": bindparam("_metadata_hash")
-                    })
-                )
-                db.execute(stmt, update_params)
-
-            # Create/update MuseumObjects with references
-            # to the newly updated MuseumAttachments.
-            # For performance reasons update references for a batch
-            # of objects at once
-            attachments = (
-                db.query(MuseumAttachment)
-                .filter(MuseumAttachment.id.in_(attachment_ids))
-            )
-            objects = bulk_create_or_get(db, MuseumObject, object_ids)
-            objects_by_id = {
-                mus_object.id: mus_object for mus_object in objects
-            }
-
-            for attachment in attachments:
-                attachment.museum_objects = [
-                    objects_by_id[object_id] for object_id
-                    in attachment_id2object_id[attachment.id]
-                ]
-
-                for museum_object in attachment.museum_objects:
-                    # Set the modification date of MuseumObject to the same
-                    # as the attachment's if it's newer.
-                    # This is because we want to know if the museum object OR
-                    # one of its attachments has been changed.
-                    object_date_needs_update = (
-                        not museum_object.modified_date
-                        or museum_object.modified_date < attachment.modified_date
-                    )
-
-                    if object_date_needs_update:
-                        museum_object.modified_date = attachment.modified_date
-
-        results = []
-
-        print(
-            f"Updated, {inserts} inserts, {updates} "
-            f"updates. Updating from offset: {index}"
-        )
-
-        # Submit heartbeat after each successful iteration instead of once
-        # at the end. This is because this script is designed to be stopped
-        # before it has finished iterating everything.
-        submit_heartbeat(HeartbeatSource.SYNC_ATTACHMENTS)
+    :returns: Sorted list of IDs that weren't found in MuseumPlus
+    """
+    attachment_ids = list(attachment_ids)
 
-        if save_progress:
-            update_offset("sync_attachments", offset=index)
+    # Objects that are unlinked during the synchronization are affected
+    # as well
+    if update_hashes:
+        object_ids = get_linked_object_ids(attachment_ids)
 
-        if all_iterated:
-            if save_progress:
-                finish_sync_progress("sync_attachments")
+    _, missing_ids = await run_resync(
+        AttachmentSyncAdapter(), attachment_ids, chunk_size=CHUNK_SIZE,
+        museum_session=museum_session
+    )
 
-            break
+    if update_hashes:
+        object_ids |= get_linked_object_ids(attachment_ids)
+        sync_dirty_hashes(object_ids=sorted(object_ids))
 
-    await museum_session.close()
+    return missing_ids
 
 
 @click.command()
@@ -220,13 +273,83 @@ async def sync_attachments(offset=0, limit=None, save_progress=False):
         "--limit are ignored."
     )
 )
-def cli(offset, limit, save_progress):
+@click.option(
+    "--shards", type=int, default=None,
+    help=(
+        "Split the attachments into this many shards and iterate them "
+        "concurrently. Progress of each shard is saved separately. "
+        "If enabled, --offset, --limit and --save-progress are ignored."
+    )
+)
+@click.option(
+    "--shard-window-size", type=int, default=SHARD_WINDOW_SIZE,
+    help="How many attachments each shard iterates at a time"
+)
+@click.option(
+    "--concurrency", type=int, default=None,
+    help=(
+        "How many shards to iterate concurrently at most. "
+        "Default is the amount of shards."
+    )
+)
+@click.option(
+    "--attachment-ids", type=str, default=None,
+    help=(
+        "Comma-separated list of attachment IDs. If provided, only these "
+        "attachments are synchronized and the other options are ignored."
+    )
+)
+@click.option(
+    "--attachment-ids-file", type=click.File("r"), default=None,
+    help=(
+        "File containing attachment IDs separated by commas or whitespace. "
+        "Use '-' to read the IDs from standard input."
+    )
+)
+@click.option(
+    "--update-hashes", is_flag=True, default=False,
+    help=(
+        "Update the attachment metadata hashes of the changed objects after "
+        "synchronizing the attachments given using --attachment-ids or "
+        "--attachment-ids-file"
+    )
+)
+def cli(
+        offset, limit, save_progress, shards, shard_window_size,
+        concurrency, attachment_ids, attachment_ids_file, update_hashes):
+    configure_logging()
     connect_db()
 
     loop = asyncio.get_event_loop()
+
+    if attachment_ids or attachment_ids_file:
+        try:
+            attachment_ids = read_entry_ids(
+                attachment_ids, attachment_ids_file
+            )
+        except ValueError:
+            raise click.BadParameter("Attachment IDs must be integers")
+
+        try:
+            missing_ids = loop.run_until_complete(
+                resync_attachments(
+                    attachment_ids, update_hashes=update_hashes
+                )
+            )
+        except SyncFetchError as exc:
+            raise click.ClickException(str(exc))
+
+        if missing_ids:
+            raise click.ClickException(
+                f"{len(missing_ids)} attachments were not found in MuseumPlus"
+            )
+        return
+
     loop.run_until_complete(
         sync_attachments(
-            offset=offset, limit=limit, save_progress=save_progress
+            offset=offset, limit=limit, save_progress=save_progress,
+            shards=shards, shard_window_size=shard_window_size,
+            concurrency=concurrency
         )
     )
 
@@ -3,23 +3,31 @@ Synchronize the metadata hashes for Objects. Metadata hashes are used
 to determine which objects need to be preserved again.
 """
 import hashlib
+import time
 from collections import defaultdict
 
 import click
+from sqlalchemy import func, literal_column, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 from sqlalchemy.orm import Load, load_only, subqueryload
-from sqlalchemy.sql.expression import bindparam
+from sqlalchemy.sql.expression import bindparam, case
 
 from passari_workflow.db import scoped_session
 from passari_workflow.db.connection import connect_db
 from passari_workflow.db.models import (MuseumAttachment, MuseumObject,
-                                               object_attachment_association_table)
+                                               dirty_museum_object_table,
+                                               object_attachment_association_table,
+                                               update_next_eligible_at)
 from passari_workflow.heartbeat import HeartbeatSource, submit_heartbeat
+from passari_workflow.scripts.utils import ChunkSizeController
 
-# Process 2000 objects at a time
+# Process 2000 objects at a time. When only changed objects are updated,
+# the chunk size is adjusted during the run within the configured bounds.
 CHUNK_SIZE = 2000
 
 
-def get_museum_objects_and_attachments(db, from_id=0, limit=500):
+def get_museum_objects_and_attachments(
+        db, from_id=0, limit=500, object_ids=None):
     """
     Get a list of MuseumObject and MuseumAttachment instances and an
     association map between the two.
@@ -30,17 +38,21 @@ def get_museum_objects_and_attachments(db, from_id=0, limit=500):
     :param db: SQLAlchemy instance
     :param int from_id: Retrieve objects with higher IDs than this
     :param int limit: How many objects to retrieve at most
+    :param object_ids: Optional list of object IDs to retrieve
 
     :returns: List of (museum_object, museum_attachments) tuples
     """
     # Retrieve objects
-    objects = list(
+    query = (
         db.query(MuseumObject)
         .options(load_only("id", "metadata_hash", "attachment_metadata_hash"))
         .filter(MuseumObject.id > from_id)
-        .order_by(MuseumObject.id)
-        .limit(limit)
     )
+
+    if object_ids is not None:
+        query = query.filter(MuseumObject.id.in_(object_ids))
+
+    objects = list(query.order_by(MuseumObject.id).limit(limit))
     object_ids = [obj.id for obj in objects]
 
     # Retrieve object -> attachment associations
@@ -114,92 +126,371 @@ def get_metadata_hash_for_attachments(attachments):
     return hashlib.sha256(data).hexdigest()
 
 
-def sync_hashes():
+def get_attachment_metadata_hash_query(object_ids=None):
     """
-    Update object entries with latest metadata hashes to determine which
-    objects have been changed. This is done after 'sync_objects' and
-    'sync_attachments'.
+    Get a query that calculates the attachment metadata hash for objects
+    in the database. The hash is identical to the one calculated by
+    'get_metadata_hash_for_attachments'.
+
+    Objects with incomplete attachments are not included in the results.
+
+    :param object_ids: Object IDs to include. If not provided, all objects
+                       are included.
+
+    :returns: SELECT query with 'id' and 'attachment_metadata_hash' columns
+    """
+    objects = MuseumObject.__table__
+    attachments = MuseumAttachment.__table__
+    assoc = object_attachment_association_table
+
+    # Concatenate the hashes in code point order, which is the same order
+    # Python uses when sorting strings
+    concatenated_hashes = func.string_agg(
+        attachments.c.metadata_hash,
+        aggregate_order_by(
+            literal_column("''"), attachments.c.metadata_hash.collate("C")
+        )
+    )
+    attachment_metadata_hash = case(
+        [(func.count(attachments.c.id) == 0, "")],
+        else_=func.encode(
+            func.digest(
+                func.convert_to(concatenated_hashes, "UTF8"), "sha256"
+            ),
+            "hex"
+        )
+    )
+
+    query = (
+        select([
+            objects.c.id.label("id"),
+            attachment_metadata_hash.label("attachment_metadata_hash")
+        ])
+        .select_from(
+            objects
+            .outerjoin(assoc, assoc.c.museum_object_id == objects.c.id)
+            .outerjoin(
+                attachments, attachments.c.id == assoc.c.museum_attachment_id
+            )
+        )
+        .group_by(objects.c.id)
+        # Skip objects that have attachments without a metadata hash
+        .having(
+            func.count(attachments.c.id)
+            == func.count(attachments.c.metadata_hash)
+        )
+    )
+
+    if object_ids is not None:
+        query = query.where(objects.c.id.in_(object_ids))
+
+    return query
+
+
+def sync_hashes_in_database(db, object_ids=None):
+    """
+    Update the attachment metadata hashes for objects using a single
+    UPDATE statement. The hashes are calculated in the database, meaning
+    the objects and attachments don't have to be retrieved.
+
+    :param db: SQLAlchemy session
+    :param object_ids: Object IDs to update. If not provided, all objects
+                       are updated.
+
+    :returns: List of updated object IDs
+    """
+    objects = MuseumObject.__table__
+    hashes = get_attachment_metadata_hash_query(
+        object_ids=object_ids
+    ).alias("hashes")
+
+    update_stmt = (
+        objects.update()
+        .where(objects.c.id == hashes.c.id)
+        .where(
+            objects.c.attachment_metadata_hash.is_distinct_from(
+                hashes.c.attachment_metadata_hash
+            )
+        )
+        .values(attachment_metadata_hash=hashes.c.attachment_metadata_hash)
+        .returning(objects.c.id)
+    )
+    updated_ids = [result.id for result in db.execute(update_stmt)]
+
+    if updated_ids:
+        update_next_eligible_at(db, updated_ids)
+
+    return updated_ids
+
+
+def update_attachment_metadata_hashes(db, results):
+    """
+    Calculate the attachment metadata hashes in Python and update the objects
+    that have changed
+
+    :param db: SQLAlchemy session
+    :param results: List of (museum_object, museum_attachments) tuples
+
+    :returns: (updated, skipped) tuple with the amount of updated objects
+              and objects skipped due to incomplete attachments
     """
     updated = 0
     skipped = 0
+
+    update_params = []
+
+    for museum_object, museum_attachments in results:
+        # Calculate the attachment metadata hash
+        if museum_attachments:
+            # Don't calculate the hash if some attachments are
+            # incomplete
+            metadata_incomplete = any(
+                attach.metadata_hash is None
+                for attach in museum_attachments
+            )
+
+            if metadata_incomplete:
+                skipped += 1
+                continue
+
+            attachment_metadata_hash = get_metadata_hash_for_attachments(
+                museum_attachments
+            )
+        else:
+            attachment_metadata_hash = ""
+
+        if museum_object.attachment_metadata_hash \
+                == attachment_metadata_hash:
+            # Attachment hash hasn't changed, no need to update
+            continue
+
+        updated += 1
+
+        update_params.append({
+            "_id": museum_object.id,
+            "_attachment_metadata_hash": attachment_metadata_hash
+        })
+
+    if update_params:
+        update_stmt = (
+            MuseumObject.__table__.update()
+            .where(MuseumObject.id == bindparam("_id"))
+            .values({
+                "attachment_metadata_hash":
+                    bindparam("_attachment_metadata_hash")
+            })
+        )
+        db.execute(update_stmt, update_params)
+
+        update_next_eligible_at(
+            db, [params["_id"] for params in update_params]
+        )
+
+    return updated, skipped
+
+
+def pop_dirty_object_ids(db, limit, object_ids=None):
+    """
+    Remove object IDs from the queue of objects that need their attachment
+    metadata hash to be recalculated.
+
+    The IDs are returned to the queue if the transaction is rolled back.
+
+    :param db: SQLAlchemy session
+    :param int limit: How many object IDs to retrieve at most
+    :param object_ids: Optional list of object IDs. If provided, only these
+                       objects are removed from the queue.
+
+    :returns: List of object IDs
+    """
+    dirty_objects = dirty_museum_object_table
+
+    selected_ids = select([dirty_objects.c.museum_object_id])
+
+    if object_ids is not None:
+        selected_ids = selected_ids.where(
+            dirty_objects.c.museum_object_id.in_(object_ids)
+        )
+
+    selected_ids = (
+        selected_ids
+        .order_by(dirty_objects.c.museum_object_id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+
+    return [
+        result.museum_object_id for result in db.execute(
+            dirty_objects.delete()
+            .where(dirty_objects.c.museum_object_id.in_(selected_ids))
+            .returning(dirty_objects.c.museum_object_id)
+        )
+    ]
+
+
+def sync_all_hashes(db, in_database=False):
+    """
+    Update the attachment metadata hashes for every object
+
+    :param db: SQLAlchemy session
+    :param bool in_database: Whether to calculate the hashes in the database
+    """
+    # Every object is recalculated, so the queue can be cleared
+    db.execute(dirty_museum_object_table.delete())
+
+    if in_database:
+        updated = len(sync_hashes_in_database(db))
+        print(f"{updated} updated")
+        return
+
+    updated = 0
+    skipped = 0
     total = 0
 
-    with scoped_session() as db:
-        query = iterate_museum_objects_and_attachments(db)
-
-        all_iterated = False
-
-        while True:
-            results = []
-            for i in range(0, CHUNK_SIZE):
-                try:
-                    results.append(next(query))
-                except StopIteration:
-                    all_iterated = True
-                    break
-
-            update_params = []
-
-            for museum_object, museum_attachments in results:
-                total += 1
-
-                # Calculate the attachment metadata hash
-                if museum_attachments:
-                    # Don't calculate the hash if some attachments are
-                    # incomplete
-                    metadata_incomplete = any(
-                        attach.metadata_hash is None
-                        for attach in museum_attachments
-                    )
-
-                    if metadata_incomplete:
-                        skipped += 1
-                        continue
-
-                    attachment_metadata_hash = get_metadata_hash_for_attachments(
-                        museum_attachments
-                    )
-                else:
-                    attachment_metadata_hash = ""
-
-                if museum_object.attachment_metadata_hash \
-                        == attachment_metadata_hash:
-                    # Attachment hash hasn't changed, no need to update
-                    continue
-
-                updated += 1
-
-                update_params.append({
-                    "_id": museum_object.id,
-                    "_attachment_metadata_hash": attachment_metadata_hash
-                })
-
-            if update_params:
-                update_stmt = (
-                    MuseumObject.__table__.update()
-                    .where(MuseumObject.id == bindparam("_id"))
-                    .values({
-                        "attachment_metadata_hash":
-                            bindparam("_attachment_metadata_hash")
-                    })
-                )
-                db.execute(update_stmt, update_params)
+    query = iterate_museum_objects_and_attachments(db)
+
+    all_iterated = False
+
+    while True:
+        results = []
+        for i in range(0, CHUNK_SIZE):
+            try:
+                results.append(next(query))
+            except StopIteration:
+                all_iterated = True
+                break
+
+        chunk_updated, chunk_skipped = update_attachment_metadata_hashes(
+            db, results
+        )
+        total += len(results)
+        updated += chunk_updated
+        skipped += chunk_skipped
+
+        print(
+            f"{total} iterated, {updated} updated and {skipped} skipped "
+            "so far"
+        )
+
+        if all_iterated:
+            break
+
+
+def sync_dirty_hashes(in_database=False, object_ids=None):
+    """
+    Update the attachment metadata hashes for objects that have been
+    changed since the last run.
+
+    Each chunk is committed separately, meaning the progress is kept even
+    if the run is interrupted. The chunk size is adjusted to keep the time
+    spent on each chunk close to the configured target.
 
-            print(
-                f"{total} iterated, {updated} updated and {skipped} skipped "
-                "so far"
+    :param bool in_database: Whether to calculate the hashes in the database
+    :param object_ids: Optional list of object IDs. If provided, only these
+                       objects are updated if they have been changed, and
+                       other changed objects are left for the next run.
+    """
+    updated = 0
+    skipped = 0
+    total = 0
+
+    chunk_size = ChunkSizeController(CHUNK_SIZE)
+
+    while True:
+        start = time.perf_counter()
+
+        with scoped_session() as db:
+            dirty_ids = pop_dirty_object_ids(
+                db, limit=chunk_size.size, object_ids=object_ids
             )
 
-            if all_iterated:
+            if not dirty_ids:
                 break
 
+            total += len(dirty_ids)
+
+            if in_database:
+                updated += len(sync_hashes_in_database(db, dirty_ids))
+            else:
+                results = get_museum_objects_and_attachments(
+                    db, limit=len(dirty_ids), object_ids=dirty_ids
+                )
+                chunk_updated, chunk_skipped = \
+                    update_attachment_metadata_hashes(db, results)
+                updated += chunk_updated
+                skipped += chunk_skipped
+
+        chunk_size.update(len(dirty_ids), time.perf_counter() - start)
+
+        print(
+            f"{total} iterated, {updated} updated and {skipped} skipped "
+            f"so far, next chunk size {chunk_size.size}"
+        )
+
+    print(f"{total} changed objects processed, {updated} updated")
+
+
+def sync_hashes(refresh_eligibility=False, in_database=False, full=False):
+    """
+    Update object entries with latest metadata hashes to determine which
+    objects have been changed. This is done after 'sync_objects' and
+    'sync_attachments'.
+
+    Only objects marked as changed by 'sync_objects' and 'sync_attachments'
+    are updated by default.
+
+    :param bool refresh_eligibility: Whether to recalculate the preservation
+                                     eligibility for every object. This is
+                                     required after changing the preservation
+                                     or update delay.
+    :param bool in_database: Whether to calculate the hashes in the database
+                             instead of retrieving every object and
+                             attachment
+    :param bool full: Whether to update every object instead of only the
+                      changed objects
+    """
+    if full:
+        with scoped_session() as db:
+            sync_all_hashes(db, in_database=in_database)
+    else:
+        sync_dirty_hashes(in_database=in_database)
+
+    if refresh_eligibility:
+        print("Refreshing preservation eligibility for all objects")
+        with scoped_session() as db:
+            update_next_eligible_at(db)
+
     submit_heartbeat(HeartbeatSource.SYNC_HASHES)
 
 
 @click.command()
-def cli():
+@click.option(
+    "--refresh-eligibility", is_flag=True, default=False,
+    help=(
+        "Recalculate the preservation eligibility for every object. This "
+        "needs to be done after changing the preservation or update delay."
+    )
+)
+@click.option(
+    "--in-database", is_flag=True, default=False,
+    help=(
+        "Calculate the hashes in the database instead of retrieving "
+        "every object and attachment"
+    )
+)
+@click.option(
+    "--full", is_flag=True, default=False,
+    help=(
+        "Update every object instead of only the objects that have changed "
+        "since the last run"
+    )
+)
+def cli(refresh_eligibility, in_database, full):
     connect_db()
-    sync_hashes()
+    sync_hashes(
+        refresh_eligibility=refresh_eligibility, in_database=in_database,
+        full=full
+    )
 
 
 if __name__ == "__main__":
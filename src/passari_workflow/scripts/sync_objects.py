@@ -4,31 +4,78 @@ Synchronize the museum objects using the MuseumPlus database.
 Missing objects are added and existing objects' metadata hashes are updated
 """
 import asyncio
-from collections import defaultdict
 from pathlib import Path
 
 import click
-from sqlalchemy import and_, or_
-from sqlalchemy.orm import load_only
-from sqlalchemy.sql.expression import bindparam
-
-from passari.museumplus.connection import get_museum_session
 from passari.museumplus.search import iterate_objects
 from passari_workflow.config import USER_CONFIG_DIR
-from passari_workflow.db import scoped_session
 from passari_workflow.db.connection import connect_db
-from passari_workflow.db.models import MuseumAttachment, MuseumObject
-from passari_workflow.db.utils import bulk_create_or_get
-from passari_workflow.heartbeat import HeartbeatSource, submit_heartbeat
-from passari_workflow.scripts.utils import (finish_sync_progress,
-                                                   get_sync_status,
-                                                   update_offset)
+from passari_workflow.db.models import (MuseumAttachment, MuseumObject,
+                                        mark_objects_dirty,
+                                        object_attachment_association_table,
+                                        update_next_eligible_at)
+from passari_workflow.exceptions import SyncFetchError
+from passari_workflow.heartbeat import HeartbeatSource
+from passari_workflow.scripts.sync_hashes import sync_dirty_hashes
+from passari_workflow.scripts.utils import read_entry_ids
+from passari_workflow.sync.engine import (CHUNK_SIZE, SHARD_WINDOW_SIZE,
+                                          SyncAdapter, run_resync, run_sync)
+from passari_workflow.sync.metrics import configure_logging
+
+
+class ObjectSyncAdapter(SyncAdapter):
+    """
+    Synchronize MuseumPlus objects into MuseumObject entries and link them
+    to their attachments
+    """
+    name = "sync_objects"
+    heartbeat_source = HeartbeatSource.SYNC_OBJECTS
+
+    model = MuseumObject
+    columns = [
+        "id", "title", "modified_date", "created_date", "metadata_hash"
+    ]
+    update_columns = ["title", "metadata_hash"]
+    # Modification date is only updated if it's newer, as it might have
+    # been updated by 'sync_attachments' already
+    advance_columns = ["modified_date"]
+
+    association_table = object_attachment_association_table
+    association_key_column = "museum_object_id"
+    association_value_column = "museum_attachment_id"
+    associated_model = MuseumAttachment
+
+    def iterate(self, museum_session, offset, modify_date_gte):
+        return iterate_objects(
+            session=museum_session, offset=offset,
+            modify_date_gte=modify_date_gte
+        )
+
+    def get_row(self, result):
+        return (
+            int(result["id"]), result["title"], result["modified_date"],
+            result["created_date"], result["xml_hash"]
+        )
 
-# How many objects to retrieve at a time before updating the database
-CHUNK_SIZE = 500
+    def get_associated_ids(self, result):
+        return result["multimedia_ids"]
 
+    def after_update(self, db, upserted, added, removed):
+        update_next_eligible_at(db, [object_id for object_id, _ in upserted])
 
-async def sync_objects(offset=0, limit=None, save_progress=False):
+        # New objects and objects with changed attachments need to be
+        # updated by 'sync_hashes'
+        mark_objects_dirty(
+            db,
+            [object_id for object_id, inserted in upserted if inserted]
+            + [object_id for object_id, _ in added + removed]
+        )
+
+
+async def sync_objects(
+        offset=0, limit=None, save_progress=False, shards=None,
+        shard_window_size=SHARD_WINDOW_SIZE, concurrency=None,
+        museum_session=None):
     """
     Synchronize object metadata from MuseumPlus to determine which
     objects have changed and need to be updated in the DPRES service. This
@@ -40,170 +87,51 @@ async def sync_objects(offset=0, limit=None, save_progress=False):
     :param bool save_progress: Whether to save synchronization progress
                                and continue from the last run. Offset and limit
                                are ignored if enabled.
+    :param int shards: Split the objects into this many shards and iterate
+                       them concurrently. Progress of each shard is always
+                       saved. Offset, limit and save_progress are ignored if
+                       enabled.
+    :param int shard_window_size: How many objects each shard iterates
+                                  before moving to its next window
+    :param int concurrency: How many shards to iterate concurrently at most.
+                            Default is the amount of shards.
+    :param museum_session: MuseumPlus session to use. Default is to create
+                           a new session.
     """
-    modify_date_gte = None
-
-    if save_progress:
-        limit = None
-
-        sync_status = get_sync_status("sync_objects")
-        offset = sync_status.offset
-        # Start synchronization from objects that changed since the last
-        # sync
-        modify_date_gte = sync_status.prev_start_sync_date
-        print(f"Continuing synchronization from {offset}")
-
-    museum_session = await get_museum_session()
-    object_iter = iterate_objects(
-        session=museum_session, offset=offset,
-        modify_date_gte=modify_date_gte
+    await run_sync(
+        ObjectSyncAdapter(), offset=offset, limit=limit,
+        save_progress=save_progress, chunk_size=CHUNK_SIZE, shards=shards,
+        shard_window_size=shard_window_size, concurrency=concurrency,
+        museum_session=museum_session
     )
-    all_iterated = False
-    index = offset
-    processed = 0
-
-    while True:
-        results = []
-
-        all_iterated = True
-        async for result in object_iter:
-            all_iterated = False
-            results.append(result)
-            index += 1
-
-            if len(results) >= CHUNK_SIZE:
-                break
-
-        objects = {result["id"]: result for result in results}
-        object_ids = list(objects.keys())
-
-        inserts, updates = 0, 0
-
-        with scoped_session() as db:
-            existing_object_ids = set([
-                result.id for result in
-                db.query(MuseumObject).options(load_only("id"))
-                  .filter(MuseumObject.id.in_(object_ids))
-            ])
-
-            object_id2attachment_id = defaultdict(set)
-            attachment_ids = set()
-
-            update_params = []
-
-            # Create existing objects, update the rest
-            for result in objects.values():
-                object_id = int(result["id"])
-                title = result["title"]
-                modified_date = result["modified_date"]
-                created_date = result["created_date"]
-                multimedia_ids = result["multimedia_ids"]
-                xml_hash = result["xml_hash"]
-
-                object_id2attachment_id[object_id].update(multimedia_ids)
-                attachment_ids.update(multimedia_ids)
-
-                if object_id in existing_object_ids:
-                    # Don't run the update query instantly; instead,
-                    # set the parameters and run them all together later
-                    # in bulk
-                    update_params.append({
-                        "_id": object_id,
-                        "_title": title,
-                        "_modified_date": modified_date,
-                        "_metadata_hash": xml_hash
-                    })
-                    updates += 1
-                else:
-                    # Create
-                    mus_object = MuseumObject(
-                        id=object_id,
-                        title=title,
-                        modified_date=modified_date,
-                        created_date=created_date,
-                        metadata_hash=xml_hash
-                    )
-                    db.add(mus_object)
-                    inserts += 1
-
-                processed += 1
-
-                if limit is not None and processed == limit:
-                    all_iterated = True
-                    break
-
-            if update_params:
-                # Perform updates in bulk
-                stmt_a = (
-                    MuseumObject.__table__.update()
-                    .where(MuseumObject.id == bindparam("_id"))
-                    .values({
-                        "title": bindparam("_title"),
-                        "metadata_hash": bindparam("_metadata_hash")
-                    })
-                )
-                stmt_b = (
-                    MuseumObject.__table__.update()
-                    .where(
-                        and_(
-                            MuseumObject.id == bindparam("_id"),
-                            or_(
-                                MuseumObject.modified_date == None,
-                                MuseumObject.modified_date
-                                < bindparam("_modified_date")
-                            )
-                        )
-                    )
-                    .values({
-                        "modified_date": bindparam("_modified_date")
-                    })
-                )
-                db.execute(stmt_a, update_params)
-                db.execute(stmt_b, update_params)
-
-            # Create/update MuseumAttachments with references
-            # to the newly updated MuseumObjects.
-            # For performance reasons update references for a batch
-            # of objects at once
-            objects = (
-                db.query(MuseumObject)
-                .filter(MuseumObject.id.in_(object_ids))
-            )
-            attachments = bulk_create_or_get(
-                db, MuseumAttachment, attachment_ids
-            )
-            attachments_by_id = {
-                attachment.id: attachment for attachment in attachments
-            }
 
-            for museum_object in objects:
-                museum_object.attachments = [
-                    attachments_by_id[attachment_id] for attachment_id
-                    in object_id2attachment_id[museum_object.id]
-                ]
 
-        results = []
-
-        print(
-            f"Updated, {inserts} inserts, {updates} "
-            f"updates. Updating from offset: {index}"
-        )
+async def resync_objects(
+        object_ids, update_hashes=False, museum_session=None):
+    """
+    Synchronize the given objects from MuseumPlus immediately, regardless
+    of the synchronization progress
 
-        # Submit heartbeat after each successful iteration instead of once
-        # at the end. This is because this script is designed to be stopped
-        # before it has finished iterating everything.
-        submit_heartbeat(HeartbeatSource.SYNC_OBJECTS)
+    :param object_ids: IDs of the objects to synchronize
+    :param bool update_hashes: Whether to update the attachment metadata
+                               hashes of the given objects afterwards if
+                               they have changed
+    :param museum_session: MuseumPlus session to use. Default is to create
+                           a new session.
 
-        if save_progress:
-            update_offset("sync_objects", offset=index)
+    :raises SyncFetchError: If the objects can't be retrieved from MuseumPlus
 
-        if all_iterated:
-            if save_progress:
-                finish_sync_progress("sync_objects")
+    :returns: Sorted list of IDs that weren't found in MuseumPlus
+    """
+    _, missing_ids = await run_resync(
+        ObjectSyncAdapter(), object_ids, chunk_size=CHUNK_SIZE,
+        museum_session=museum_session
+    )
 
-            break
+    if update_hashes:
+        sync_dirty_hashes(object_ids=list(object_ids))
 
-    await museum_session.close()
+    return missing_ids
 
 
 @click.command()
@@ -218,13 +146,79 @@ async def sync_objects(offset=0, limit=None, save_progress=False):
         "--limit are ignored."
     )
 )
-def cli(offset, limit, save_progress):
+@click.option(
+    "--shards", type=int, default=None,
+    help=(
+        "Split the objects into this many shards and iterate them "
+        "concurrently. Progress of each shard is saved separately. "
+        "If enabled, --offset, --limit and --save-progress are ignored."
+    )
+)
+@click.option(
+    "--shard-window-size", type=int, default=SHARD_WINDOW_SIZE,
+    help="How many objects each shard iterates at a time"
+)
+@click.option(
+    "--concurrency", type=int, default=None,
+    help=(
+        "How many shards to iterate concurrently at most. "
+        "Default is the amount of shards."
+    )
+)
+@click.option(
+    "--object-ids", type=str, default=None,
+    help=(
+        "Comma-separated list of object IDs. If provided, only these "
+        "objects are synchronized and the other options are ignored."
+    )
+)
+@click.option(
+    "--object-ids-file", type=click.File("r"), default=None,
+    help=(
+        "File containing object IDs separated by commas or whitespace. "
+        "Use '-' to read the IDs from standard input."
+    )
+)
+@click.option(
+    "--update-hashes", is_flag=True, default=False,
+    help=(
+        "Update the attachment metadata hashes of the changed objects after "
+        "synchronizing the objects given using --object-ids or "
+        "--object-ids-file"
+    )
+)
+def cli(
+        offset, limit, save_progress, shards, shard_window_size,
+        concurrency, object_ids, object_ids_file, update_hashes):
+    configure_logging()
     connect_db()
 
     loop = asyncio.get_event_loop()
+
+    if object_ids or object_ids_file:
+        try:
+            object_ids = read_entry_ids(object_ids, object_ids_file)
+        except ValueError:
+            raise click.BadParameter("Object IDs must be integers")
+
+        try:
+            missing_ids = loop.run_until_complete(
+                resync_objects(object_ids, update_hashes=update_hashes)
+            )
+        except SyncFetchError as exc:
+            raise click.ClickException(str(exc))
+
+        if missing_ids:
+            raise click.ClickException(
+                f"{len(missing_ids)} objects were not found in MuseumPlus"
+            )
+        return
+
     loop.run_until_complete(
         sync_objects(
-            offset=offset, limit=limit, save_progress=save_progress
+            offset=offset, limit=limit, save_progress=save_progress,
+            shards=shards, shard_window_size=shard_window_size,
+            concurrency=concurrency
         )
     )
 
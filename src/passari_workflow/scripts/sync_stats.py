@@ -0,0 +1,57 @@
+"""
+Print the time spent in each phase of the latest 'sync-objects' and
+'sync-attachments' runs
+"""
+import click
+
+from passari_workflow.sync.metrics import PHASES, get_sync_runs
+
+
+def format_sync_runs(summaries):
+    """
+    Format the run summaries as a table
+    """
+    lines = [
+        f"{'started':<20} {'name':<17} {'status':<9} {'entries':>8} "
+        f"{'time (s)':>9} {'rows/s':>8} {'stmts':>7} "
+        + " ".join(f"{phase:>12}" for phase in PHASES)
+    ]
+
+    for summary in summaries:
+        phases = summary["phases"]
+        lines.append(
+            f"{summary['start_date'][:19]:<20} {summary['name']:<17} "
+            f"{summary['status']:<9} {summary['entries']:>8} "
+            f"{summary['elapsed']:>9.2f} {summary['rows_per_second']:>8.1f} "
+            f"{summary['statements']:>7} "
+            + " ".join(
+                f"{phases.get(phase, 0.0):>12.2f}" for phase in PHASES
+            )
+        )
+
+    return "\n".join(lines)
+
+
+@click.command()
+@click.option(
+    "--count", type=int, default=10, help="How many runs to print"
+)
+@click.option(
+    "--name", type=str, default=None,
+    help=(
+        "Only print runs of this synchronization process, eg. "
+        "'sync_objects' or 'sync_attachments'"
+    )
+)
+def cli(count, name):
+    summaries = get_sync_runs(count=count, name=name)
+
+    if not summaries:
+        print("No synchronization runs found")
+        return
+
+    print(format_sync_runs(summaries))
+
+
+if __name__ == "__main__":
+    cli()
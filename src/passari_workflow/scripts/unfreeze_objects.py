@@ -6,7 +6,7 @@ import click
 from passari_workflow.db import scoped_session
 from passari_workflow.db.connection import connect_db
 from passari_workflow.db.models import MuseumObject, MuseumPackage
-from passari_workflow.queue.queues import lock_queues
+from passari_workflow.queue.queues import lock_objects
 from passari_workflow.scripts.enqueue_objects import enqueue_object
 
 
@@ -26,7 +26,19 @@ def unfreeze_objects(reason=None, object_ids=None, enqueue=False):
     if not reason and not object_ids:
         raise ValueError("Either 'reason' or 'object_ids' has to be provided")
 
-    with lock_queues():
+    with scoped_session() as db:
+        query = db.query(MuseumObject.id).filter(MuseumObject.frozen == True)
+
+        if reason:
+            query = query.filter(MuseumObject.freeze_reason == reason)
+        if object_ids:
+            object_ids = [int(object_id) for object_id in object_ids]
+            query = query.filter(MuseumObject.id.in_(object_ids))
+
+        object_ids = [result.id for result in query]
+
+    # Only lock the objects that are unfrozen
+    with lock_objects(object_ids):
         with scoped_session() as db:
             query = (
                 db.query(MuseumObject)
@@ -34,14 +46,16 @@ def unfreeze_objects(reason=None, object_ids=None, enqueue=False):
                     MuseumPackage,
                     MuseumPackage.id == MuseumObject.latest_package_id
                 )
-                .filter(MuseumObject.frozen == True)
+                .filter(
+                    MuseumObject.frozen == True,
+                    MuseumObject.id.in_(object_ids)
+                )
             )
 
+            # The objects may have been frozen again with a different reason
+            # before the lock was acquired
             if reason:
                 query = query.filter(MuseumObject.freeze_reason == reason)
-            if object_ids:
-                object_ids = [int(object_id) for object_id in object_ids]
-                query = query.filter(MuseumObject.id.in_(object_ids))
 
             museum_objects = list(query)
             for museum_object in museum_objects:
@@ -1,14 +1,21 @@
+import asyncio
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 from collections import namedtuple
 
 from sqlalchemy.orm import load_only
 
+from passari_workflow.config import CONFIG
 from passari_workflow.db import scoped_session
 from passari_workflow.db.models import SyncStatus
 
 
+# Offset saved for a shard that has finished in the current synchronization
+# run
+SHARD_FINISHED = -1
+
 SyncStatusReadOnly = namedtuple(
     "SyncStatusReadOnly",
     ["name", "start_sync_date", "prev_start_sync_date", "offset"]
@@ -68,6 +75,14 @@ def update_offset(name, offset):
         sync_status.offset = offset
 
 
+def delete_sync_status(name):
+    """
+    Delete the SyncStatus entry if it exists
+    """
+    with scoped_session() as db:
+        db.query(SyncStatus).filter_by(name=name).delete()
+
+
 def finish_sync_progress(name):
     """
     Finish the current synchronization run.
@@ -82,3 +97,315 @@ def finish_sync_progress(name):
         sync_status.offset = 0
         sync_status.prev_start_sync_date = sync_status.start_sync_date
         sync_status.start_sync_date = None
+
+
+def get_chunk_size_options():
+    """
+    Get the adaptive chunk size options from the configuration
+
+    :returns: (min_chunk_size, max_chunk_size, target_chunk_time) tuple
+    """
+    sync_config = CONFIG.get("sync", {})
+    return (
+        int(sync_config.get("min_chunk_size", 100)),
+        int(sync_config.get("max_chunk_size", 5000)),
+        float(sync_config.get("target_chunk_time", 5))
+    )
+
+
+class ChunkSizeController:
+    """
+    Adjust the chunk size after each chunk to keep the time spent writing
+    each chunk close to a target time.
+
+    The size is scaled by the throughput measured for the previous chunk, but
+    it is changed by at most a factor of two at a time to avoid reacting too
+    strongly to a single slow or fast chunk.
+    """
+    def __init__(
+            self, initial_size, min_size=None, max_size=None,
+            target_time=None):
+        """
+        :param int initial_size: Chunk size to start with
+        :param int min_size: Smallest allowed chunk size
+        :param int max_size: Largest allowed chunk size
+        :param float target_time: Target time for writing a chunk in seconds.
+                                  Zero disables the adjustment, meaning
+                                  'initial_size' is always used.
+
+        Options that are not provided are read from the configuration.
+        """
+        config_min_size, config_max_size, config_target_time = \
+            get_chunk_size_options()
+
+        self.min_size = min_size if min_size is not None else config_min_size
+        self.max_size = max_size if max_size is not None else config_max_size
+        self.target_time = (
+            target_time if target_time is not None else config_target_time
+        )
+
+        if self.target_time > 0:
+            self.size = min(max(initial_size, self.min_size), self.max_size)
+        else:
+            self.size = initial_size
+
+    def update(self, count, elapsed):
+        """
+        Update the chunk size after a chunk has been written
+
+        :param int count: How many entries the chunk contained
+        :param float elapsed: How long writing the chunk took in seconds
+
+        :returns: New chunk size
+        """
+        if self.target_time <= 0 or count == 0:
+            return self.size
+
+        if count < self.size and elapsed < self.target_time:
+            # The chunk was incomplete, meaning its size says nothing about
+            # how large the chunks could be
+            return self.size
+
+        new_size = count * self.target_time / max(elapsed, 0.001)
+        new_size = min(max(new_size, self.size / 2), self.size * 2)
+
+        self.size = int(min(max(new_size, self.min_size), self.max_size))
+
+        return self.size
+
+
+async def run_sync_pipeline(
+        iterator, write_chunk, chunk_size, limit=None, queue_size=2):
+    """
+    Retrieve results from an asynchronous iterator in chunks and write each
+    chunk using 'write_chunk' in a separate thread.
+
+    The next chunks are retrieved while the previous chunk is being written,
+    up to 'queue_size' chunks ahead. Chunks are written one at a time in the
+    same order they were retrieved.
+
+    If the iteration fails, the chunks retrieved before the failure are
+    written before the exception is raised. This ensures the progress saved
+    after each chunk corresponds to the entries that were actually written.
+
+    :param iterator: Asynchronous iterator
+    :param write_chunk: Function called with (results, iterated) for each
+                        chunk, where 'iterated' is the total amount of results
+                        iterated including this chunk. The last chunk is
+                        always empty.
+    :param chunk_size: How many results to include in each chunk at most.
+                       This can also be a ChunkSizeController, in which case
+                       its current size is used for each chunk.
+    :param int limit: How many results to retrieve before stopping.
+                      Default is None, meaning all results are retrieved.
+    :param int queue_size: How many chunks to retrieve ahead at most
+    """
+    queue = asyncio.Queue(maxsize=queue_size)
+
+    if isinstance(chunk_size, int):
+        chunk_size = ChunkSizeController(chunk_size, target_time=0)
+
+    async def produce():
+        iterated = 0
+        try:
+            while True:
+                results = []
+
+                if limit is None or iterated < limit:
+                    async for result in iterator:
+                        results.append(result)
+                        iterated += 1
+
+                        if len(results) >= chunk_size.size:
+                            break
+                        if limit is not None and iterated >= limit:
+                            break
+
+                await queue.put((results, iterated))
+
+                if not results:
+                    break
+        except asyncio.CancelledError:
+            raise
+        except BaseException as exc:
+            # Pass the exception to the consumer, which will raise it once the
+            # earlier chunks have been written. This includes
+            # KeyboardInterrupt, which would otherwise stop the event loop
+            # immediately.
+            await queue.put(exc)
+
+    loop = asyncio.get_event_loop()
+    executor = ThreadPoolExecutor(max_workers=1)
+    producer = asyncio.ensure_future(produce())
+
+    try:
+        while True:
+            item = await queue.get()
+
+            if isinstance(item, BaseException):
+                raise item
+
+            results, iterated = item
+            await loop.run_in_executor(
+                executor, write_chunk, results, iterated
+            )
+
+            if not results:
+                break
+    finally:
+        producer.cancel()
+        try:
+            await producer
+        except asyncio.CancelledError:
+            pass
+        executor.shutdown(wait=True)
+
+
+def get_shard_name(name, shard, shards):
+    """
+    Get the name of the SyncStatus entry used for a single shard
+    """
+    return f"{name}_shard_{shard + 1}_of_{shards}"
+
+
+async def run_sharded_sync(
+        name, get_iterator, write_chunk, chunk_size, shards, window_size,
+        concurrency):
+    """
+    Synchronize entries by iterating multiple shards concurrently.
+
+    The entries are split into windows of 'window_size' entries by their
+    offset. Shard N iterates the windows N, N + shards, N + 2 * shards and so
+    on until it finds an incomplete window.
+
+    The progress of each shard is saved separately, and an interrupted run
+    continues each shard from where it stopped. The synchronization run is
+    finished once every shard has finished.
+
+    :param str name: Name of the synchronization process
+    :param get_iterator: Function called with (offset, modify_date_gte) that
+                         returns an asynchronous iterator starting from the
+                         given offset
+    :param write_chunk: Function called with (results, offset) in a worker
+                        thread for each chunk, where 'offset' is the offset
+                        after the chunk
+    :param chunk_size: How many results to include in each chunk at most, or
+                       a ChunkSizeController
+    :param int shards: How many shards to split the entries into
+    :param int window_size: How many entries to include in each window
+    :param int concurrency: How many windows to iterate concurrently at most
+    """
+    sync_status = get_sync_status(name)
+    # Every shard has to use the same filter, otherwise the windows would
+    # not line up
+    modify_date_gte = sync_status.prev_start_sync_date
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_shard(shard):
+        shard_name = get_shard_name(name, shard, shards)
+        offset = get_sync_status(shard_name).offset
+
+        if offset == SHARD_FINISHED:
+            return
+
+        # Offset is zero if the shard hasn't been started yet
+        offset = max(offset, shard * window_size)
+
+        while True:
+            window_start = offset
+            window_end = (window_start // window_size + 1) * window_size
+            last_iterated = 0
+
+            def write_shard_chunk(results, iterated):
+                nonlocal last_iterated
+
+                write_chunk(results, window_start + iterated)
+                update_offset(shard_name, offset=window_start + iterated)
+                last_iterated = iterated
+
+            async with semaphore:
+                print(
+                    f"Shard {shard + 1}/{shards}: synchronizing from offset "
+                    f"{window_start} to {window_end}"
+                )
+                await run_sync_pipeline(
+                    get_iterator(window_start, modify_date_gte),
+                    write_shard_chunk, chunk_size=chunk_size,
+                    limit=window_end - window_start
+                )
+
+            if window_start + last_iterated < window_end:
+                # Window is incomplete, meaning there are no more entries
+                break
+
+            offset = window_end + (shards - 1) * window_size
+            update_offset(shard_name, offset=offset)
+
+        update_offset(shard_name, offset=SHARD_FINISHED)
+
+    async def run_shard_safely(shard):
+        # Exceptions such as KeyboardInterrupt would stop the event loop
+        # immediately if raised inside a task, leaving the other shards
+        # running. Return the exception instead so that the other shards can
+        # be stopped first.
+        try:
+            await run_shard(shard)
+        except asyncio.CancelledError:
+            raise
+        except BaseException as exc:
+            return exc
+
+        return None
+
+    pending = set(
+        asyncio.ensure_future(run_shard_safely(shard))
+        for shard in range(0, shards)
+    )
+    error = None
+
+    try:
+        while pending and not error:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            errors = [task.result() for task in done if task.result()]
+            if errors:
+                error = errors[0]
+    finally:
+        for task in pending:
+            task.cancel()
+
+        if pending:
+            await asyncio.wait(pending)
+
+    if error:
+        raise error
+
+    for shard in range(0, shards):
+        delete_sync_status(get_shard_name(name, shard, shards))
+
+    finish_sync_progress(name)
+
+
+def read_entry_ids(entry_ids=None, ids_file=None):
+    """
+    Read entry IDs from a comma-separated string and a file containing IDs
+    separated by commas or whitespace
+
+    :param str entry_ids: Comma-separated list of IDs
+    :param ids_file: File object to read IDs from
+
+    :raises ValueError: If any of the IDs is not an integer
+
+    :returns: Sorted list of unique entry IDs
+    """
+    values = []
+
+    if entry_ids:
+        values += entry_ids.split(",")
+
+    if ids_file:
+        values += ids_file.read().replace(",", " ").split()
+
+    return sorted(set(int(value) for value in values if value.strip()))
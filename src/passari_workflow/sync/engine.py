@@ -0,0 +1,572 @@
+"""
+Generic engine for synchronizing entries from MuseumPlus into the database.
+
+The entity-specific parts of the synchronization are defined using
+subclasses of 'SyncAdapter', while the engine handles retrieving the entries
+in chunks, writing them in bulk, saving the synchronization progress and
+reporting the progress.
+"""
+import asyncio
+import time
+from collections import defaultdict
+
+from sqlalchemy import or_
+
+from passari.museumplus.connection import get_museum_session
+from passari_workflow.db import scoped_session
+from passari_workflow.db.utils import (bulk_create_or_get,
+                                       bulk_replace_associations, bulk_upsert)
+from passari_workflow.exceptions import SyncFetchError
+from passari_workflow.heartbeat import submit_heartbeat
+from passari_workflow.scripts.utils import (ChunkSizeController,
+                                            finish_sync_progress,
+                                            get_sync_status,
+                                            run_sharded_sync,
+                                            run_sync_pipeline, update_offset)
+from passari_workflow.sync.metrics import (SyncMetrics, count_statements,
+                                           log_chunk, measure_phase,
+                                           save_sync_run)
+
+# How many entries to retrieve at a time before updating the database.
+# The chunk size is adjusted during the run within the configured bounds.
+CHUNK_SIZE = 500
+
+# How many entries each shard iterates at a time when using sharding
+SHARD_WINDOW_SIZE = 10000
+
+# How many entries the default 'SyncAdapter.fetch' implementation iterates
+# at most when looking for the given entries
+FETCH_SCAN_LIMIT = 10000
+
+
+class SyncAdapter:
+    """
+    Adapter that defines how entries of a single MuseumPlus entity type are
+    retrieved and stored in the database.
+
+    Each entry is upserted into the table of 'model', after which its
+    associations in 'association_table' are replaced, if one is defined.
+    """
+    #: Name of the synchronization process, used for the SyncStatus entry
+    name = None
+
+    #: HeartbeatSource submitted after each chunk
+    heartbeat_source = None
+
+    #: Model the entries are stored as
+    model = None
+
+    #: Columns in the same order as the values returned by 'get_row'.
+    #: The first column is the 'id' primary key.
+    columns = ()
+
+    #: Columns to update for existing entries
+    update_columns = ()
+
+    #: Columns to update for existing entries only if the new value is
+    #: greater than the current one
+    advance_columns = ()
+
+    #: Association table linking the entries to 'associated_model'
+    association_table = None
+    association_key_column = None
+    association_value_column = None
+
+    #: Model of the associated entries. Placeholders are created for any
+    #: associated entries that haven't been synchronized yet.
+    associated_model = None
+
+    #: How many entries the default 'fetch' implementation iterates at most
+    fetch_scan_limit = FETCH_SCAN_LIMIT
+
+    def iterate(self, museum_session, offset, modify_date_gte):
+        """
+        Return an asynchronous iterator of MuseumPlus results
+
+        :param museum_session: MuseumPlus session
+        :param int offset: Offset to start iterating from
+        :param modify_date_gte: Only iterate entries modified on or after this
+                                date, if provided
+        """
+        raise NotImplementedError
+
+    async def fetch(self, museum_session, entry_ids):
+        """
+        Return an asynchronous iterator of MuseumPlus results for the given
+        entry IDs.
+
+        MuseumPlus entries can't be retrieved by ID, so the default
+        implementation iterates the entries modified on or after the earliest
+        stored modification date of the given entries using 'iterate', and
+        stops once every entry has been found. At most 'fetch_scan_limit'
+        entries are iterated.
+
+        :param museum_session: MuseumPlus session
+        :param entry_ids: List of entry IDs
+
+        :raises SyncFetchError: If any of the entries hasn't been
+                                synchronized yet or has no modification date,
+                                or if the entries can't be found within
+                                'fetch_scan_limit' entries
+        """
+        loop = asyncio.get_event_loop()
+        remaining_ids = set(int(entry_id) for entry_id in entry_ids)
+
+        def get_start_date():
+            with scoped_session() as db:
+                return get_fetch_start_date(
+                    db, self, remaining_ids, scan_limit=self.fetch_scan_limit
+                )
+
+        modify_date_gte = await loop.run_in_executor(None, get_start_date)
+        iterated = 0
+
+        async for result in self.iterate(
+                museum_session, offset=0, modify_date_gte=modify_date_gte):
+            iterated += 1
+
+            entry_id = int(result["id"])
+            if entry_id in remaining_ids:
+                remaining_ids.remove(entry_id)
+                yield result
+
+            if not remaining_ids:
+                break
+
+            if iterated >= self.fetch_scan_limit:
+                raise SyncFetchError(
+                    f"{len(remaining_ids)} entries were not found within "
+                    f"{iterated} entries modified since {modify_date_gte}"
+                )
+
+    def get_row(self, result):
+        """
+        Return a row tuple with the values for 'columns' from a MuseumPlus
+        result
+        """
+        raise NotImplementedError
+
+    def get_associated_ids(self, result):
+        """
+        Return the IDs of the associated entries for a MuseumPlus result
+        """
+        return ()
+
+    def after_update(self, db, upserted, added, removed):
+        """
+        Update any dependent data after a chunk has been written
+
+        :param db: SQLAlchemy session
+        :param upserted: List of (id, inserted) tuples for inserted and
+                         updated entries. Unchanged entries are not included.
+        :param added: List of added (id, associated_id) pairs
+        :param removed: List of removed (id, associated_id) pairs
+        """
+
+
+async def measure_fetch(iterator, fetch_times):
+    """
+    Measure the time spent waiting for each result from MuseumPlus.
+
+    The time is saved in 'fetch_times' using the identity of the result
+    object ('id(result)') as the key, allowing it to be attributed to the
+    chunk the result is written in. The identity is only unique while the
+    result is alive, so the entry must be popped when the result is written:
+    a later result can reuse the identity once the earlier one has been
+    freed.
+    """
+    while True:
+        start = time.perf_counter()
+        try:
+            result = await iterator.__anext__()
+        except StopAsyncIteration:
+            break
+
+        fetch_times[id(result)] = time.perf_counter() - start
+        yield result
+
+
+def get_fetch_start_date(db, adapter, entry_ids, scan_limit):
+    """
+    Get the earliest stored modification date of the given entries, and
+    ensure the entries can be found by iterating the entries modified since
+
+    :param db: SQLAlchemy session
+    :param adapter: SyncAdapter instance
+    :param entry_ids: Set of entry IDs
+    :param int scan_limit: How many entries can be iterated at most
+
+    :raises SyncFetchError: If any of the entries doesn't exist or has no
+                            modification date, or if more than 'scan_limit'
+                            stored entries have been modified since the
+                            earliest date
+
+    :returns: Earliest modification date
+    """
+    model = adapter.model
+    entry_id2date = dict(
+        db.query(model.id, model.modified_date)
+        .filter(model.id.in_(list(entry_ids)))
+    )
+
+    # Without a modification date the entire catalogue would have to be
+    # iterated
+    undated_ids = sorted(
+        entry_id for entry_id in entry_ids
+        if entry_id2date.get(entry_id) is None
+    )
+    if undated_ids:
+        raise SyncFetchError(
+            f"{len(undated_ids)} entries haven't been synchronized or have "
+            f"no modification date: "
+            f"{', '.join(str(entry_id) for entry_id in undated_ids)}"
+        )
+
+    start_date = min(entry_id2date.values())
+
+    # Entries without a modification date are iterated as well
+    count = (
+        db.query(model.id)
+        .filter(
+            or_(
+                model.modified_date >= start_date,
+                model.modified_date == None
+            )
+        )
+        .limit(scan_limit + 1)
+        .count()
+    )
+    if count > scan_limit:
+        raise SyncFetchError(
+            f"More than {scan_limit} entries have been modified since "
+            f"{start_date}"
+        )
+
+    return start_date
+
+
+def update_entries(db, adapter, results, phase_times=None):
+    """
+    Create or update the entries in a chunk of MuseumPlus results and
+    their associations in bulk
+
+    :param db: SQLAlchemy session
+    :param adapter: SyncAdapter instance
+    :param results: List of results from MuseumPlus
+    :param dict phase_times: Optional dict to add the time spent in each
+                             phase to
+
+    :returns: (inserts, updates, unchanged) tuple
+    """
+    if phase_times is None:
+        phase_times = {}
+
+    # If the same entry appears more than once, the latest result is used
+    entries = {int(result["id"]): result for result in results}
+
+    rows = []
+    key2values = defaultdict(set)
+    associated_ids = set()
+
+    for entry_id, result in entries.items():
+        rows.append(adapter.get_row(result))
+
+        values = adapter.get_associated_ids(result)
+        key2values[entry_id].update(values)
+        associated_ids.update(values)
+
+    with measure_phase(phase_times, "upsert"):
+        upserted = bulk_upsert(
+            db, adapter.model.__table__,
+            columns=adapter.columns,
+            rows=rows,
+            update_columns=adapter.update_columns,
+            advance_columns=adapter.advance_columns
+        )
+    inserts = len([entry_id for entry_id, inserted in upserted if inserted])
+    updates = len(upserted) - inserts
+    unchanged = len(rows) - len(upserted)
+
+    added, removed = [], []
+
+    if adapter.association_table is not None:
+        with measure_phase(phase_times, "associations"):
+            # Create placeholders for associated entries that haven't been
+            # synced yet, and update the associations for the entire chunk
+            # at once
+            bulk_create_or_get(
+                db, adapter.associated_model, associated_ids, ids_only=True
+            )
+            added, removed = bulk_replace_associations(
+                db, adapter.association_table,
+                key_column=adapter.association_key_column,
+                value_column=adapter.association_value_column,
+                key2values=key2values
+            )
+
+    with measure_phase(phase_times, "after_update"):
+        adapter.after_update(db, upserted, added, removed)
+
+    return inserts, updates, unchanged
+
+
+async def run_sync(
+        adapter, offset=0, limit=None, save_progress=False,
+        chunk_size=CHUNK_SIZE, shards=None,
+        shard_window_size=SHARD_WINDOW_SIZE, concurrency=None,
+        museum_session=None):
+    """
+    Synchronize entries from MuseumPlus using the given adapter
+
+    :param adapter: SyncAdapter instance
+    :param int offset: Offset to start synchronizing from
+    :param int limit: How many entries to sync before stopping.
+        Default is None, meaning all available entries are synchronized.
+    :param bool save_progress: Whether to save synchronization progress
+                               and continue from the last run. Offset and limit
+                               are ignored if enabled.
+    :param int chunk_size: How many entries to write at a time initially.
+                           The chunk size is adjusted after each chunk to
+                           keep the time spent writing each chunk close to
+                           the configured target.
+    :param int shards: Split the entries into this many shards and iterate
+                       them concurrently. Progress of each shard is always
+                       saved. Offset, limit and save_progress are ignored if
+                       enabled.
+    :param int shard_window_size: How many entries each shard iterates
+                                  before moving to its next window
+    :param int concurrency: How many shards to iterate concurrently at most.
+                            Default is the amount of shards.
+    :param museum_session: MuseumPlus session to use. If not provided,
+                           a new session is created and closed once the
+                           synchronization is finished.
+
+    :returns: SyncMetrics instance
+    """
+    metrics = SyncMetrics(adapter.name)
+
+    try:
+        await _run_sync(
+            adapter, metrics, offset=offset, limit=limit,
+            save_progress=save_progress, chunk_size=chunk_size,
+            shards=shards, shard_window_size=shard_window_size,
+            concurrency=concurrency, museum_session=museum_session
+        )
+    except BaseException:
+        # Save the timings for interrupted runs as well, as those are
+        # likely the slowest ones
+        save_sync_run(metrics.get_summary(status="failed"))
+        raise
+
+    save_sync_run(metrics.get_summary(status="finished"))
+    _print_summary(metrics)
+
+    return metrics
+
+
+async def _run_sync(
+        adapter, metrics, offset, limit, save_progress, chunk_size, shards,
+        shard_window_size, concurrency, museum_session):
+    chunk_size = ChunkSizeController(chunk_size)
+    fetch_times = {}
+    write_chunk = _get_chunk_writer(
+        adapter, metrics, chunk_size, fetch_times=fetch_times
+    )
+
+    close_museum_session = museum_session is None
+    if close_museum_session:
+        museum_session = await get_museum_session()
+
+    if shards:
+        await run_sharded_sync(
+            adapter.name,
+            get_iterator=lambda offset, modify_date_gte: measure_fetch(
+                adapter.iterate(
+                    museum_session, offset=offset,
+                    modify_date_gte=modify_date_gte
+                ),
+                fetch_times
+            ),
+            write_chunk=write_chunk, chunk_size=chunk_size, shards=shards,
+            window_size=shard_window_size,
+            concurrency=concurrency or shards
+        )
+    else:
+        modify_date_gte = None
+
+        if save_progress:
+            limit = None
+
+            sync_status = get_sync_status(adapter.name)
+            offset = sync_status.offset
+            # Start synchronization from entries that changed since the last
+            # sync
+            modify_date_gte = sync_status.prev_start_sync_date
+            print(f"Continuing synchronization from {offset}")
+
+        iterator = adapter.iterate(
+            museum_session, offset=offset, modify_date_gte=modify_date_gte
+        )
+
+        def write_chunk_and_save_progress(results, iterated):
+            index = offset + iterated
+            write_chunk(results, index)
+
+            # Progress is only saved once the chunk has been committed
+            if save_progress:
+                update_offset(adapter.name, offset=index)
+
+        # Retrieve the next chunks from MuseumPlus while the previous chunk
+        # is being written to the database
+        await run_sync_pipeline(
+            measure_fetch(iterator, fetch_times),
+            write_chunk_and_save_progress, chunk_size=chunk_size,
+            limit=limit
+        )
+
+        if save_progress:
+            finish_sync_progress(adapter.name)
+
+    if close_museum_session:
+        await museum_session.close()
+
+
+async def run_resync(
+        adapter, entry_ids, chunk_size=CHUNK_SIZE, museum_session=None):
+    """
+    Synchronize the given entries from MuseumPlus using the given adapter.
+
+    The entries are retrieved using 'SyncAdapter.fetch' and written in the
+    same way as in 'run_sync'. Synchronization progress is not affected.
+
+    :param adapter: SyncAdapter instance
+    :param entry_ids: IDs of the entries to synchronize
+    :param int chunk_size: How many entries to write at a time initially
+    :param museum_session: MuseumPlus session to use. If not provided,
+                           a new session is created and closed once the
+                           synchronization is finished.
+
+    :raises SyncFetchError: If the entries can't be retrieved using
+                            'SyncAdapter.fetch'
+
+    :returns: (metrics, missing_ids) tuple, where 'missing_ids' is a sorted
+              list of IDs that weren't found in MuseumPlus
+    """
+    entry_ids = sorted(set(int(entry_id) for entry_id in entry_ids))
+    missing_ids = set(entry_ids)
+
+    metrics = SyncMetrics(adapter.name)
+    chunk_size = ChunkSizeController(chunk_size)
+    fetch_times = {}
+    write_chunk = _get_chunk_writer(
+        adapter, metrics, chunk_size, fetch_times=fetch_times
+    )
+
+    close_museum_session = museum_session is None
+    if close_museum_session:
+        museum_session = await get_museum_session()
+
+    async def iterate_found():
+        async for result in adapter.fetch(museum_session, entry_ids):
+            missing_ids.discard(int(result["id"]))
+            yield result
+
+    print(f"Synchronizing {len(entry_ids)} entries")
+
+    try:
+        await run_sync_pipeline(
+            measure_fetch(iterate_found(), fetch_times), write_chunk,
+            chunk_size=chunk_size
+        )
+    finally:
+        if close_museum_session:
+            await museum_session.close()
+
+    missing_ids = sorted(missing_ids)
+    if missing_ids:
+        print(
+            "Entries not found in MuseumPlus: "
+            f"{', '.join(str(entry_id) for entry_id in missing_ids)}"
+        )
+
+    _print_summary(metrics)
+
+    return metrics, missing_ids
+
+
+def _get_chunk_writer(adapter, metrics, chunk_size, fetch_times):
+    """
+    Return a function that writes a chunk of results and reports the progress
+
+    :param adapter: SyncAdapter instance
+    :param metrics: SyncMetrics instance updated after each chunk
+    :param chunk_size: ChunkSizeController instance updated after each chunk
+    :param dict fetch_times: Time spent retrieving each result, as
+                             collected by 'measure_fetch'. The entries of
+                             the written results are removed.
+    """
+    def write_chunk(results, index):
+        phase_times = {
+            "fetch": sum(
+                fetch_times.pop(id(result), 0.0) for result in results
+            )
+        }
+
+        start = time.perf_counter()
+        with scoped_session() as db:
+            with count_statements(db) as counts:
+                inserts, updates, unchanged = update_entries(
+                    db, adapter, results, phase_times=phase_times
+                )
+        write_time = time.perf_counter() - start
+
+        # Remaining time is spent opening the session and committing
+        phase_times["commit"] = max(
+            write_time - sum(
+                phase_time for phase, phase_time in phase_times.items()
+                if phase != "fetch"
+            ),
+            0.0
+        )
+
+        if results:
+            metrics.add_chunk(
+                inserts, updates, unchanged, write_time,
+                phase_times=phase_times, statements=counts["statements"]
+            )
+            chunk_size.update(len(results), write_time)
+
+            log_chunk(
+                adapter.name, chunk=metrics.chunks, entries=len(results),
+                inserts=inserts, updates=updates, unchanged=unchanged,
+                write_time=write_time, phase_times=phase_times,
+                statements=counts["statements"]
+            )
+
+        print(
+            f"Updated, {inserts} inserts, {updates} updates, {unchanged} "
+            f"unchanged in {write_time:.2f} seconds, next chunk size "
+            f"{chunk_size.size}. Updating from offset: {index}"
+        )
+
+        # Submit heartbeat after each successful iteration instead of once
+        # at the end. This is because this script is designed to be stopped
+        # before it has finished iterating everything.
+        submit_heartbeat(adapter.heartbeat_source)
+
+    return write_chunk
+
+
+def _print_summary(metrics):
+    print(
+        f"Finished, {metrics.inserts} inserts, {metrics.updates} updates and "
+        f"{metrics.unchanged} unchanged in {metrics.chunks} chunks. Took "
+        f"{metrics.elapsed:.2f} seconds, of which "
+        f"{metrics.write_time:.2f} seconds writing to database."
+    )
+    print(
+        "Time spent in each phase: " + ", ".join(
+            f"{phase} {phase_time:.2f}s"
+            for phase, phase_time in metrics.phase_times.items()
+        )
+    )
@@ -0,0 +1,228 @@
+"""
+Timing instrumentation for synchronization runs.
+
+The time spent in each phase of writing a chunk is logged as a structured
+log line for each chunk, and a summary of each run is saved in Redis
+alongside the heartbeats. The summaries can be printed using
+'sync-stats'.
+"""
+import datetime
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from passari_workflow.redis.connection import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+#: Phases of a synchronization run:
+#:
+#: - fetch: waiting for results from MuseumPlus
+#: - upsert: inserting and updating the entries
+#: - associations: creating placeholders and replacing associations
+#: - after_update: updating dependent data such as the dirty object queue
+#: - commit: the rest of the write, mostly committing the transaction
+PHASES = (
+    "fetch", "upsert", "associations", "after_update", "commit"
+)
+
+SYNC_RUNS_KEY = "sync_runs"
+
+# How many run summaries to keep in Redis
+SYNC_RUN_HISTORY_SIZE = 100
+
+
+@contextmanager
+def measure_phase(phase_times, phase):
+    """
+    Add the time spent inside the block to 'phase_times[phase]'
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phase_times[phase] = (
+            phase_times.get(phase, 0.0) + time.perf_counter() - start
+        )
+
+
+@contextmanager
+def count_statements(db):
+    """
+    Count the statements executed using the session's connection.
+
+    COPY statements are executed using the raw DBAPI cursor and are not
+    included.
+
+    :returns: Dict with the count in the 'statements' key, updated once
+              the block is exited
+    """
+    counts = {"statements": 0}
+
+    def before_cursor_execute(*args, **kwargs):
+        counts["statements"] += 1
+
+    connection = db.connection()
+    event.listen(connection, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield counts
+    finally:
+        event.remove(
+            connection, "before_cursor_execute", before_cursor_execute
+        )
+
+
+class SyncMetrics:
+    """
+    Running totals for a synchronization run.
+
+    Chunks can be written by multiple threads when sharding is used,
+    so the totals are updated under a lock.
+    """
+    def __init__(self, name=None):
+        self.name = name
+
+        self.chunks = 0
+        self.inserts = 0
+        self.updates = 0
+        self.unchanged = 0
+        self.statements = 0
+        self.write_time = 0.0
+        self.phase_times = {phase: 0.0 for phase in PHASES}
+
+        self.start_date = datetime.datetime.now(datetime.timezone.utc)
+        self.start_time = time.perf_counter()
+
+        self._lock = threading.Lock()
+
+    def add_chunk(
+            self, inserts, updates, unchanged, write_time, phase_times=None,
+            statements=0):
+        with self._lock:
+            self.chunks += 1
+            self.inserts += inserts
+            self.updates += updates
+            self.unchanged += unchanged
+            self.statements += statements
+            self.write_time += write_time
+
+            for phase, phase_time in (phase_times or {}).items():
+                self.phase_times[phase] += phase_time
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.start_time
+
+    @property
+    def entries(self):
+        return self.inserts + self.updates + self.unchanged
+
+    def get_summary(self, status):
+        """
+        Get a summary of the run as a dict that can be serialized as JSON
+
+        :param str status: Status of the run, eg. 'finished' or 'failed'
+        """
+        elapsed = self.elapsed
+
+        return {
+            "name": self.name,
+            "status": status,
+            "start_date": self.start_date.isoformat(),
+            "elapsed": round(elapsed, 3),
+            "chunks": self.chunks,
+            "entries": self.entries,
+            "inserts": self.inserts,
+            "updates": self.updates,
+            "unchanged": self.unchanged,
+            "statements": self.statements,
+            "rows_per_second": round(self.entries / elapsed, 1)
+            if elapsed else 0.0,
+            "phases": {
+                phase: round(phase_time, 3)
+                for phase, phase_time in self.phase_times.items()
+            }
+        }
+
+
+def configure_logging():
+    """
+    Print the INFO-level log lines of synchronization runs to standard
+    error. This is called by the synchronization scripts, as logging is not
+    configured otherwise and the log lines would be discarded.
+
+    Logging that has already been configured is left as-is.
+    """
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(name)s: %(message)s"
+    )
+
+
+def log_chunk(name, chunk, entries, inserts, updates, unchanged, write_time,
+              phase_times, statements):
+    """
+    Log the timings of a single chunk as a structured log line
+    """
+    logger.info(
+        json.dumps({
+            "event": "sync_chunk",
+            "name": name,
+            "chunk": chunk,
+            "entries": entries,
+            "inserts": inserts,
+            "updates": updates,
+            "unchanged": unchanged,
+            "statements": statements,
+            "write_time": round(write_time, 3),
+            "rows_per_second": round(entries / write_time, 1)
+            if write_time else 0.0,
+            "phases": {
+                phase: round(phase_time, 3)
+                for phase, phase_time in phase_times.items()
+            }
+        }, sort_keys=True)
+    )
+
+
+def save_sync_run(summary):
+    """
+    Save the summary of a synchronization run in Redis. Only the latest
+    summaries are kept.
+
+    :param dict summary: Summary returned by 'SyncMetrics.get_summary'
+    """
+    logger.info(json.dumps(dict(summary, event="sync_run"), sort_keys=True))
+
+    redis = get_redis_connection()
+
+    with redis.pipeline() as pipe:
+        pipe.lpush(SYNC_RUNS_KEY, json.dumps(summary))
+        pipe.ltrim(SYNC_RUNS_KEY, 0, SYNC_RUN_HISTORY_SIZE - 1)
+        pipe.execute()
+
+
+def get_sync_runs(count=10, name=None):
+    """
+    Get the summaries of the latest synchronization runs, newest first
+
+    :param int count: How many summaries to return at most
+    :param str name: Only return summaries for this synchronization process,
+                     eg. 'sync_objects'
+    """
+    redis = get_redis_connection()
+
+    summaries = [
+        json.loads(value)
+        for value in redis.lrange(SYNC_RUNS_KEY, 0, -1)
+    ]
+
+    if name:
+        summaries = [
+            summary for summary in summaries if summary["name"] == name
+        ]
+
+    return summaries[:count]
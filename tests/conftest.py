@@ -36,6 +36,10 @@ def redis(monkeypatch):
         "passari_workflow.heartbeat.get_redis_connection",
         lambda: conn
     )
+    monkeypatch.setattr(
+        "passari_workflow.sync.metrics.get_redis_connection",
+        lambda: conn
+    )
 
     yield conn
 
@@ -101,8 +105,9 @@ def engine(database, monkeypatch):
     engine = connect_db()
     engine.echo = True
 
-    # pg_trgm extension must exist
+    # pg_trgm and pgcrypto extensions must exist
     engine.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    engine.execute("CREATE EXTENSION IF NOT EXISTS pgcrypto")
 
     Base.metadata.create_all(engine)
     yield engine
@@ -135,6 +140,15 @@ def museum_session_key(monkeypatch):
     )
 
 
+@pytest.fixture(scope="function", autouse=True)
+def fixed_chunk_size(monkeypatch):
+    """
+    Use fixed chunk sizes in the synchronization scripts to keep the
+    chunks the same between test runs
+    """
+    monkeypatch.setitem(CONFIG, "sync", {"target_chunk_time": 0})
+
+
 @pytest.fixture(scope="function", autouse=True)
 def museum_packages_dir(tmpdir, monkeypatch):
     path = Path(tmpdir) / "MuseumPackages"
@@ -0,0 +1,56 @@
+import pytest
+from passari_workflow.config import CONFIG
+from passari_workflow.db.connection import connect_db, get_engine_options
+
+
+def test_connect_db_cached(engine):
+    """
+    Test that the same engine is returned on subsequent calls
+    """
+    assert connect_db() is engine
+    assert connect_db() is connect_db()
+
+
+def test_connect_db_pool_options(engine, monkeypatch):
+    """
+    Test that connection pool options are read from the configuration
+    """
+    monkeypatch.setitem(CONFIG["db"], "pool_size", 3)
+    monkeypatch.setitem(CONFIG["db"], "max_overflow", 2)
+
+    new_engine = connect_db()
+
+    # Changed options require a new engine
+    assert new_engine is not engine
+    assert new_engine.pool.size() == 3
+    assert new_engine.pool._max_overflow == 2
+
+    # Same engine is returned once the options stay the same
+    assert connect_db() is new_engine
+
+    new_engine.execute("SELECT 1")
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        (True, True), (False, False), ("true", True), ("false", False),
+        ("False", False), ("0", False)
+    ]
+)
+def test_get_engine_options_pool_pre_ping(monkeypatch, value, expected):
+    """
+    Test that 'pool_pre_ping' is parsed from both TOML booleans and strings
+    """
+    monkeypatch.setitem(CONFIG["db"], "pool_pre_ping", value)
+
+    assert get_engine_options()["pool_pre_ping"] is expected
+
+
+def test_get_engine_options_invalid_bool(monkeypatch):
+    monkeypatch.setitem(CONFIG["db"], "pool_pre_ping", "maybe")
+
+    with pytest.raises(ValueError) as exc:
+        get_engine_options()
+
+    assert "Invalid boolean value: 'maybe'" in str(exc.value)
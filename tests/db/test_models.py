@@ -2,8 +2,10 @@ import datetime
 import gzip
 
 from passari_workflow.db import scoped_session
-from passari_workflow.db.models import (FreezeSource, MuseumAttachment,
-                                               MuseumObject, MuseumPackage)
+from passari_workflow.db.models import (ELIGIBLE_IMMEDIATELY, FreezeSource,
+                                               MuseumAttachment, MuseumObject,
+                                               MuseumPackage,
+                                               update_next_eligible_at)
 
 
 def assert_preservation_pending_count(query, count):
@@ -25,6 +27,10 @@ def assert_preservation_pending_count(query, count):
         query.with_transformation(MuseumObject.exclude_preservation_pending)
         .count() == total_count - count
     )
+    # Cross-check the indexed query against the Python implementation
+    assert sum(
+        1 for museum_object in query if museum_object.preservation_pending
+    ) == count
 
 
 class TestMuseumObject:
@@ -465,6 +471,8 @@ class TestMuseumPackage:
             "passari_workflow.db.models.PRESERVATION_DELAY",
             datetime.timedelta(seconds=4*86400)
         )
+        update_next_eligible_at(session)
+        session.commit()
 
         # Delay is 4 days, so the museum object is pending preservation now
         assert museum_object.preservation_pending
@@ -500,6 +508,8 @@ class TestMuseumPackage:
             "passari_workflow.db.models.UPDATE_DELAY",
             datetime.timedelta(seconds=4*86400)
         )
+        update_next_eligible_at(session)
+        session.commit()
 
         # Value is 4 days now; re-preservation is now possible
         assert museum_object.preservation_pending
@@ -540,3 +550,45 @@ class TestMuseumPackage:
         # is not possible until a change is detected
         assert not museum_object.preservation_pending
         assert_preservation_pending_count(session.query(MuseumObject), 0)
+
+    def test_next_eligible_at(
+            self, session, museum_object_factory, museum_package_factory):
+        """
+        Test that 'next_eligible_at' is kept up-to-date when the object or
+        its latest package changes
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        created_date = now - datetime.timedelta(days=5)
+
+        museum_object = museum_object_factory(
+            id=10, created_date=created_date, modified_date=created_date,
+            metadata_hash="hash1", attachment_metadata_hash="aHash1"
+        )
+        session.refresh(museum_object)
+
+        # Object becomes eligible once the preservation delay has passed
+        assert museum_object.next_eligible_at == \
+            created_date + datetime.timedelta(days=30)
+
+        # Frozen object can't become eligible
+        museum_object.frozen = True
+        session.commit()
+        assert museum_object.next_eligible_at is None
+
+        # Object with a cancelled package is eligible immediately
+        museum_package = museum_package_factory(
+            sip_filename="test.tar", cancelled=True,
+            museum_object=museum_object
+        )
+        museum_object.frozen = False
+        museum_object.latest_package = museum_package
+        session.commit()
+        assert museum_object.next_eligible_at == ELIGIBLE_IMMEDIATELY
+
+        # Updates made without the ORM require an explicit update
+        session.query(MuseumPackage).update(
+            {MuseumPackage.cancelled: False}, synchronize_session=False
+        )
+        update_next_eligible_at(session, [10])
+        session.commit()
+        assert museum_object.next_eligible_at is None
@@ -0,0 +1,165 @@
+import datetime
+
+from passari_workflow.db.models import (MuseumAttachment, MuseumObject,
+                                        object_attachment_association_table)
+from passari_workflow.db.utils import (bulk_create_or_get,
+                                       bulk_replace_associations, bulk_upsert)
+
+
+def test_bulk_create_or_get(session, museum_attachment_factory):
+    """
+    Test that missing entries are created and existing entries are returned
+    """
+    museum_attachment_factory(id=10, filename="test.jpg")
+    museum_attachment_factory(id=20, filename="test2.jpg")
+
+    attachments = bulk_create_or_get(
+        session, MuseumAttachment, [10, 20, 30, 40, 40]
+    )
+    session.commit()
+
+    assert sorted(attachment.id for attachment in attachments) == \
+        [10, 20, 30, 40]
+    attachments_by_id = {
+        attachment.id: attachment for attachment in attachments
+    }
+    assert attachments_by_id[10].filename == "test.jpg"
+    assert attachments_by_id[30].filename is None
+
+    assert session.query(MuseumAttachment).count() == 4
+
+
+def test_bulk_create_or_get_ids_only(session, museum_attachment_factory):
+    """
+    Test that only primary keys are returned when 'ids_only' is enabled
+    """
+    museum_attachment_factory(id=10, filename="test.jpg")
+
+    ids = bulk_create_or_get(
+        session, MuseumAttachment, [10, 20], ids_only=True
+    )
+    session.commit()
+
+    assert sorted(ids) == [10, 20]
+    assert session.query(MuseumAttachment).count() == 2
+
+    # Nothing is created on the second run
+    ids = bulk_create_or_get(
+        session, MuseumAttachment, [10, 20], ids_only=True
+    )
+    assert sorted(ids) == [10, 20]
+    assert session.query(MuseumAttachment).count() == 2
+
+
+def test_bulk_create_or_get_empty(session):
+    assert bulk_create_or_get(session, MuseumAttachment, []) == []
+
+
+def test_bulk_upsert(session, museum_object_factory):
+    """
+    Test that new rows are inserted and existing rows are updated
+    """
+    old_date = datetime.datetime(2018, 1, 1, tzinfo=datetime.timezone.utc)
+    new_date = datetime.datetime(2019, 1, 1, tzinfo=datetime.timezone.utc)
+
+    museum_object_factory(id=10, title="Old title", modified_date=new_date)
+    museum_object_factory(id=20, title="Old title", modified_date=old_date)
+    museum_object_factory(id=50, title="Same title", modified_date=new_date)
+    session.commit()
+
+    results = bulk_upsert(
+        session, MuseumObject.__table__,
+        columns=["id", "title", "modified_date"],
+        rows=[
+            (10, "New title", old_date),
+            (20, None, new_date),
+            # Values that need to be escaped
+            (30, 'Title with "quotes",\nnewlines and commas', None),
+            (40, "", None),
+            # Unchanged row is not updated
+            (50, "Same title", old_date)
+        ],
+        update_columns=["title"],
+        advance_columns=["modified_date"]
+    )
+    session.commit()
+
+    assert sorted(results) == [
+        (10, False), (20, False), (30, True), (40, True)
+    ]
+
+    museum_object_a = session.query(MuseumObject).get(10)
+    museum_object_b = session.query(MuseumObject).get(20)
+    museum_object_c = session.query(MuseumObject).get(30)
+    museum_object_d = session.query(MuseumObject).get(40)
+    museum_object_e = session.query(MuseumObject).get(50)
+
+    # Modification date is only updated if it's newer
+    assert museum_object_a.title == "New title"
+    assert museum_object_a.modified_date == new_date
+    assert museum_object_b.title is None
+    assert museum_object_b.modified_date == new_date
+
+    # Empty strings and NULL values are preserved
+    assert museum_object_c.title == \
+        'Title with "quotes",\nnewlines and commas'
+    assert museum_object_c.modified_date is None
+    assert museum_object_d.title == ""
+
+    assert museum_object_e.title == "Same title"
+    assert museum_object_e.modified_date == new_date
+
+
+def test_bulk_upsert_empty(session):
+    assert bulk_upsert(
+        session, MuseumAttachment.__table__, columns=["id"], rows=[]
+    ) == []
+
+
+def test_bulk_replace_associations(
+        session, museum_object_factory, museum_attachment_factory):
+    """
+    Test that associations are added and removed only for the given keys
+    """
+    attachment_a = museum_attachment_factory(id=100)
+    attachment_b = museum_attachment_factory(id=200)
+    attachment_c = museum_attachment_factory(id=300)
+
+    museum_object_factory(id=10, attachments=[attachment_a, attachment_b])
+    museum_object_factory(id=20, attachments=[attachment_a])
+    museum_object_factory(id=30, attachments=[attachment_c])
+    session.commit()
+
+    added, removed = bulk_replace_associations(
+        session, object_attachment_association_table,
+        key_column="museum_object_id",
+        value_column="museum_attachment_id",
+        key2values={
+            10: [200, 300, 300],
+            20: []
+        }
+    )
+    session.commit()
+
+    assert added == [(10, 300)]
+    assert sorted(removed) == [(10, 100), (20, 100)]
+
+    session.expire_all()
+    assert sorted(
+        attachment.id for attachment
+        in session.query(MuseumObject).get(10).attachments
+    ) == [200, 300]
+    assert session.query(MuseumObject).get(20).attachments == []
+    # Objects not included are not changed
+    assert [
+        attachment.id for attachment
+        in session.query(MuseumObject).get(30).attachments
+    ] == [300]
+
+    # Nothing is changed on the second run
+    assert bulk_replace_associations(
+        session, object_attachment_association_table,
+        key_column="museum_object_id",
+        value_column="museum_attachment_id",
+        key2values={10: [200, 300]}
+    ) == ([], [])
@@ -2,6 +2,10 @@ from collections import namedtuple
 from pathlib import Path
 
 from passari_workflow.db.models import MuseumPackage, MuseumObject
+from passari_workflow.queue.queues import (QueueType, get_enqueued_object_ids,
+                                           get_queue)
+from passari_workflow.scripts.reenqueue_object import reenqueue_object
+from rq import SimpleWorker
 
 import pytest
 
@@ -91,3 +95,40 @@ def test_invalid_status(session, confirm_sip, museum_object, fake_sip_path):
         confirm_sip(object_id=123456, sip_id="testID")
 
     assert "Invalid preservation status: invalid" in str(exc.value)
+
+
+def test_confirm_sip_object_index(
+        session, redis, confirm_sip, museum_object, museum_package,
+        fake_sip_path):
+    """
+    Test that a confirmed object is removed from the workflow and can be
+    re-enqueued
+    """
+    (fake_sip_path.parent / "fake_package-testID.tar.status").write_text(
+        "rejected"
+    )
+    museum_package.downloaded = True
+    museum_package.packaged = True
+    museum_package.uploaded = True
+    session.commit()
+
+    # Build the object index before the job is enqueued
+    assert get_enqueued_object_ids() == set()
+
+    queue = get_queue(QueueType.CONFIRM_SIP)
+    queue.enqueue(
+        confirm_sip, kwargs={"object_id": 123456, "sip_id": "testID"},
+        job_id="confirm_sip_123456"
+    )
+    assert get_enqueued_object_ids() == {123456}
+
+    SimpleWorker([queue], connection=queue.connection).work(burst=True)
+
+    assert queue.fetch_job("confirm_sip_123456").is_finished
+    assert get_enqueued_object_ids() == set()
+
+    reenqueue_object(123456)
+
+    assert "download_object_123456" in get_queue(
+        QueueType.DOWNLOAD_OBJECT
+    ).job_ids
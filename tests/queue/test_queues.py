@@ -1,9 +1,19 @@
-from passari_workflow.queue.queues import (QueueType,
+from passari_workflow.jobs.utils import job_locked_by_object_id
+import redis_lock
+from passari_workflow.queue.queues import (OBJECT_INDEX_KEY,
+                                                  OBJECT_LOCK_STRIPE_COUNT,
+                                                  QueueType, WorkflowQueue,
                                                   delete_jobs_for_object_id,
+                                                  get_enqueued_object_count,
                                                   get_enqueued_object_ids,
                                                   get_object_id2queue_map,
-                                                  get_queue)
+                                                  get_object_lock_stripes,
+                                                  get_queue,
+                                                  is_object_enqueued,
+                                                  lock_objects, lock_queues,
+                                                  rebuild_object_index)
 from rq import SimpleWorker
+from rq.job import JobStatus
 
 
 def successful_job():
@@ -14,6 +24,24 @@ def failing_job():
     raise RuntimeError("no no no no!")
 
 
+@job_locked_by_object_id
+def successful_object_job(object_id):
+    return "yes"
+
+
+@job_locked_by_object_id
+def failing_object_job(object_id):
+    raise RuntimeError("no")
+
+
+@job_locked_by_object_id
+def next_stage_object_job(object_id):
+    get_queue(QueueType.SUBMIT_SIP).enqueue(
+        successful_object_job, kwargs={"object_id": object_id},
+        job_id=f"submit_sip_{object_id}"
+    )
+
+
 def test_get_enqueued_object_ids(redis):
     queue = get_queue(QueueType.CREATE_SIP)
 
@@ -66,3 +94,207 @@ def test_get_object_id2queue_map(redis):
     assert queue_map[123456] == ["download_object"]
     assert queue_map[654321] == ["submit_sip", "failed"]
     assert queue_map[111111] == []
+
+
+def test_get_object_id2queue_map_job_status(redis):
+    """
+    Test that 'get_object_id2queue_map' includes started jobs and ignores
+    finished jobs
+    """
+    queue = get_queue(QueueType.CREATE_SIP)
+
+    queue.enqueue(successful_job, job_id="create_sip_1")
+    SimpleWorker([queue], connection=queue.connection).work(burst=True)
+
+    # Job is being executed by a worker
+    job = queue.enqueue(successful_job, job_id="create_sip_2")
+    job.set_status(JobStatus.STARTED)
+
+    queue_map = get_object_id2queue_map([1, 2])
+    assert queue_map[1] == []
+    assert queue_map[2] == ["create_sip"]
+
+
+def test_enqueue_job_object_index_transaction(redis):
+    """
+    Test that the job and its object index entry are written in the same
+    transaction
+    """
+    queue = get_queue(QueueType.CREATE_SIP)
+    assert get_enqueued_object_ids() == set()
+
+    with redis.pipeline() as pipe:
+        job = queue.create_job(
+            successful_object_job, kwargs={"object_id": 1},
+            job_id="create_sip_1"
+        )
+        queue.enqueue_job(job, pipeline=pipe)
+
+        # Nothing is written before the transaction is executed
+        assert queue.job_ids == []
+        assert get_enqueued_object_ids() == set()
+
+        pipe.execute()
+
+    assert queue.job_ids == ["create_sip_1"]
+    assert get_enqueued_object_ids() == {1}
+
+
+def test_enqueue_job_synchronous_queue(redis):
+    """
+    Test that an object is removed from the index when its job is run
+    immediately by a synchronous queue
+    """
+    queue = WorkflowQueue("create_sip", connection=redis, is_async=False)
+    assert get_enqueued_object_ids() == set()
+
+    job = queue.enqueue(
+        successful_object_job, kwargs={"object_id": 1}, job_id="create_sip_1"
+    )
+
+    assert job.is_finished
+    assert get_enqueued_object_ids() == set()
+
+
+def test_enqueue_object_jobs(redis):
+    """
+    Test that 'enqueue_object_jobs' enqueues a job for each object in
+    multiple batches
+    """
+    queue = get_queue(QueueType.CREATE_SIP)
+
+    jobs = queue.enqueue_object_jobs(
+        successful_object_job, [3, 1, 2], batch_size=2
+    )
+
+    assert [job.id for job in jobs] == [
+        "create_sip_3", "create_sip_1", "create_sip_2"
+    ]
+    assert queue.job_ids == ["create_sip_3", "create_sip_1", "create_sip_2"]
+    assert queue.fetch_job("create_sip_1").kwargs == {"object_id": 1}
+    assert get_enqueued_object_ids() == {1, 2, 3}
+
+    SimpleWorker([queue], connection=queue.connection).work(burst=True)
+
+    assert get_enqueued_object_count() == 0
+
+
+def test_object_index(redis):
+    """
+    Test that the object index is updated when jobs are enqueued, finished,
+    failed or moved to the next queue
+    """
+    queue = get_queue(QueueType.CREATE_SIP)
+    submit_queue = get_queue(QueueType.SUBMIT_SIP)
+
+    # Build the empty index
+    assert get_enqueued_object_ids() == set()
+
+    queue.enqueue(
+        successful_object_job, kwargs={"object_id": 1}, job_id="create_sip_1"
+    )
+    queue.enqueue(
+        failing_object_job, kwargs={"object_id": 2}, job_id="create_sip_2"
+    )
+    queue.enqueue(
+        next_stage_object_job, kwargs={"object_id": 3},
+        job_id="create_sip_3"
+    )
+
+    assert get_enqueued_object_ids() == {1, 2, 3}
+    assert is_object_enqueued(1)
+    assert not is_object_enqueued(4)
+    assert get_enqueued_object_count() == 3
+    assert get_enqueued_object_ids([1, 4]) == {1}
+
+    SimpleWorker([queue], connection=queue.connection).work(burst=True)
+
+    # Finished object was removed, the failed object was kept and the last
+    # object was moved to the next queue
+    assert get_enqueued_object_ids() == {2, 3}
+    assert redis.hget(OBJECT_INDEX_KEY, 3) == b"submit_sip"
+
+    SimpleWorker(
+        [submit_queue], connection=submit_queue.connection
+    ).work(burst=True)
+    assert get_enqueued_object_ids() == {2}
+
+    # Deleting the jobs removes the object
+    delete_jobs_for_object_id(2)
+    assert get_enqueued_object_count() == 0
+
+
+def test_rebuild_object_index(redis):
+    """
+    Test that the object index is rebuilt from the queues and registries
+    """
+    queue_a = get_queue(QueueType.DOWNLOAD_OBJECT)
+    queue_b = get_queue(QueueType.SUBMIT_SIP)
+
+    queue_a.enqueue(successful_job, job_id="download_object_123456")
+    queue_b.enqueue(failing_job, job_id="submit_sip_654321")
+    SimpleWorker([queue_b], connection=queue_b.connection).work(burst=True)
+
+    # Index is outdated
+    redis.hset(OBJECT_INDEX_KEY, 111111, "create_sip")
+    redis.hdel(OBJECT_INDEX_KEY, 123456)
+
+    assert rebuild_object_index() == 2
+    assert redis.hgetall(OBJECT_INDEX_KEY) == {
+        b"123456": b"download_object",
+        b"654321": b"submit_sip"
+    }
+
+
+def is_locked(redis, lock_name):
+    lock = redis_lock.Lock(redis, lock_name)
+    if lock.acquire(blocking=False):
+        lock.release()
+        return False
+
+    return True
+
+
+def test_get_object_lock_stripes():
+    assert get_object_lock_stripes([]) == []
+    assert get_object_lock_stripes(
+        [OBJECT_LOCK_STRIPE_COUNT + 1, 2, 1]
+    ) == [1, 2]
+
+
+def test_lock_objects(redis):
+    """
+    Test that 'lock_objects' only locks the stripes of the given objects
+    """
+    with lock_objects([1, 3]) as locks:
+        assert [lock._name for lock in locks] == [
+            "lock:workflow-lock-1", "lock:workflow-lock-3"
+        ]
+        assert is_locked(redis, "workflow-lock-1")
+        assert is_locked(redis, "workflow-lock-3")
+
+        # Other objects and the global lock are not affected
+        assert not is_locked(redis, "workflow-lock-2")
+        assert not is_locked(redis, "workflow-lock")
+
+        with lock_objects([2]):
+            pass
+
+    assert not is_locked(redis, "workflow-lock-1")
+    assert not is_locked(redis, "workflow-lock-3")
+
+
+def test_lock_queues(redis):
+    """
+    Test that 'lock_queues' locks every stripe
+    """
+    with lock_queues() as lock:
+        assert lock._name == "lock:workflow-lock"
+        assert is_locked(redis, "workflow-lock")
+        assert all(
+            is_locked(redis, f"workflow-lock-{stripe}")
+            for stripe in range(0, OBJECT_LOCK_STRIPE_COUNT)
+        )
+
+    assert not is_locked(redis, "workflow-lock")
+    assert not is_locked(redis, "workflow-lock-0")
@@ -5,9 +5,11 @@ from click.testing import CliRunner
 
 @pytest.fixture(scope="function")
 def cli(session):
-    def func(cmd, args, success=True):
+    def func(cmd, args, success=True, input=None):
         runner = CliRunner()
-        result = runner.invoke(cmd, args, catch_exceptions=False)
+        result = runner.invoke(
+            cmd, args, input=input, catch_exceptions=False
+        )
 
         # Expire any existing DB state in the test functions. This ensures
         # we can retrieve the same values both in the test functions and the
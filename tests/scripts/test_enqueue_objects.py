@@ -94,3 +94,33 @@ def test_enqueue_objects_with_object_ids(
 
     assert "download_object_5" in queue.job_ids
     assert "download_object_8" in queue.job_ids
+
+
+def test_enqueue_objects_exclude_enqueued(
+        redis, session, enqueue_objects, museum_object_factory):
+    """
+    Enqueue objects when most pending objects are already in the workflow
+    """
+    for i in range(0, 20):
+        museum_object_factory(
+            id=i, preserved=False,
+            metadata_hash="", attachment_metadata_hash=""
+        )
+
+    # Objects 0-14 are already being packaged
+    get_queue(QueueType.CREATE_SIP).enqueue_object_jobs(
+        "passari_workflow.jobs.create_sip.create_sip", range(0, 15)
+    )
+
+    result = enqueue_objects(["--object-count", "3"])
+    assert "3 object(s) enqueued" in result.stdout
+
+    queue = get_queue(QueueType.DOWNLOAD_OBJECT)
+    assert len(queue.job_ids) == 3
+    assert all(
+        int(job_id.split("_")[-1]) >= 15 for job_id in queue.job_ids
+    )
+
+    # Only the two remaining objects are enqueued
+    result = enqueue_objects(["--object-count", "5"])
+    assert "2 object(s) enqueued" in result.stdout
@@ -0,0 +1,30 @@
+import pytest
+from passari_workflow.queue.queues import (OBJECT_INDEX_KEY, QueueType,
+                                           get_enqueued_object_ids, get_queue)
+from passari_workflow.scripts.repair_workflow_index import \
+    cli as repair_workflow_index_cli
+
+
+def successful_job():
+    return "yes"
+
+
+@pytest.fixture(scope="function")
+def repair_workflow_index(cli):
+    def func(args, **kwargs):
+        return cli(repair_workflow_index_cli, args, **kwargs)
+
+    return func
+
+
+def test_repair_workflow_index(repair_workflow_index, redis):
+    queue = get_queue(QueueType.DOWNLOAD_OBJECT)
+    queue.enqueue(successful_job, job_id="download_object_123456")
+
+    # Job was deleted outside the workflow
+    redis.hset(OBJECT_INDEX_KEY, 654321, "download_object")
+
+    result = repair_workflow_index([])
+
+    assert "1 object(s) in the workflow" in result.stdout
+    assert get_enqueued_object_ids() == {123456}
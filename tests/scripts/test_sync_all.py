@@ -0,0 +1,125 @@
+import datetime
+import hashlib
+
+import pytest
+from passari_workflow.db.models import MuseumAttachment, MuseumObject
+from passari_workflow.heartbeat import HeartbeatSource, get_heartbeats
+from passari_workflow.scripts.sync_all import cli as sync_all_cli
+
+DATE = datetime.datetime(2018, 1, 1, 12, 0, tzinfo=datetime.timezone.utc)
+
+MOCK_OBJECTS = [
+    {
+        "id": i,
+        "title": f"Object {i}",
+        "modified_date": DATE,
+        "created_date": DATE,
+        "multimedia_ids": [i + 10],
+        "xml_hash": hashlib.sha256(f"Object {i}".encode("utf-8")).hexdigest()
+    }
+    for i in range(1, 4)
+]
+
+MOCK_MULTIMEDIA = [
+    {
+        "id": i + 10,
+        "filename": f"test_{i + 10}.jpg",
+        "modified_date": DATE,
+        "created_date": DATE,
+        "object_ids": [i],
+        "xml_hash": hashlib.sha256(
+            f"Attachment {i + 10}".encode("utf-8")
+        ).hexdigest()
+    }
+    for i in range(1, 4)
+]
+
+
+@pytest.fixture(scope="function", autouse=True)
+def museum_sessions(monkeypatch):
+    """
+    Mock MuseumPlus iteration and record the sessions used for iterating
+    """
+    sessions = []
+
+    def create_mock_iterate(results):
+        async def mock_iterate(session, offset=0, modify_date_gte=None):
+            sessions.append(session)
+            for result in results[offset:]:
+                yield result
+
+        return mock_iterate
+
+    monkeypatch.setattr(
+        "passari_workflow.scripts.sync_objects.iterate_objects",
+        create_mock_iterate(MOCK_OBJECTS)
+    )
+    monkeypatch.setattr(
+        "passari_workflow.scripts.sync_attachments.iterate_multimedia",
+        create_mock_iterate(MOCK_MULTIMEDIA)
+    )
+
+    return sessions
+
+
+@pytest.fixture(scope="function")
+def sync_all(cli):
+    def func(args, **kwargs):
+        return cli(sync_all_cli, args, **kwargs)
+
+    return func
+
+
+def test_sync_all(sync_all, session, museum_sessions):
+    """
+    Run every synchronization phase and ensure the objects are ready
+    for preservation afterwards
+    """
+    sync_all([])
+
+    assert session.query(MuseumObject).count() == 3
+    assert session.query(MuseumAttachment).count() == 3
+
+    # Hashes were calculated for the objects changed by the previous phases
+    museum_object = session.query(MuseumObject).get(1)
+    assert museum_object.metadata_hash == MOCK_OBJECTS[0]["xml_hash"]
+    assert museum_object.attachment_metadata_hash == hashlib.sha256(
+        MOCK_MULTIMEDIA[0]["xml_hash"].encode("utf-8")
+    ).hexdigest()
+
+    # Both phases used the same MuseumPlus session
+    assert len(museum_sessions) == 2
+    assert museum_sessions[0] is museum_sessions[1]
+
+    heartbeats = get_heartbeats()
+    assert heartbeats[HeartbeatSource.SYNC_OBJECTS]
+    assert heartbeats[HeartbeatSource.SYNC_ATTACHMENTS]
+    assert heartbeats[HeartbeatSource.SYNC_HASHES]
+
+
+def test_sync_all_loop(sync_all, session, museum_sessions, monkeypatch):
+    """
+    Run the synchronization in a loop and ensure it's repeated after the
+    interval
+    """
+    delays = []
+
+    def mock_sleep(delay):
+        delays.append(delay)
+
+        if len(delays) == 2:
+            raise KeyboardInterrupt()
+
+    monkeypatch.setattr(
+        "passari_workflow.scripts.sync_all.time.sleep", mock_sleep
+    )
+
+    result = sync_all(["--loop", "--interval", "60"], success=False)
+
+    assert "Synchronization finished, next run in" in result.stdout
+
+    # Synchronization was run twice, with a new session for each run
+    assert len(delays) == 2
+    assert all(0 < delay <= 60 for delay in delays)
+    assert len(museum_sessions) == 4
+    assert museum_sessions[0] is not museum_sessions[2]
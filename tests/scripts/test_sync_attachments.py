@@ -3,10 +3,16 @@ import hashlib
 from pathlib import Path
 
 import pytest
+from passari_workflow.db import DBSession
 from passari_workflow.db.models import (MuseumAttachment, MuseumObject,
-                                               SyncStatus)
+                                               SyncStatus,
+                                               dirty_museum_object_table,
+                                               object_attachment_association_table)
 from passari_workflow.scripts.sync_attachments import \
     cli as sync_attachments_cli
+from passari_workflow.scripts.sync_attachments import \
+    update_object_modified_dates
+from sqlalchemy.exc import OperationalError
 
 MOCK_MULTIMEDIA = []
 
@@ -139,8 +145,10 @@ def test_sync_attachments(sync_attachments, session):
     session.commit()
 
     result = sync_attachments([])
+    # Only the entry with a changed modification date is updated
     assert "0 inserts" in result.stdout
-    assert "10 updates" in result.stdout
+    assert "1 updates" in result.stdout
+    assert "9 unchanged" in result.stdout
 
     db_attachment = session.query(MuseumAttachment).get(15)
     assert db_attachment.modified_date.timestamp() == datetime.datetime(
@@ -176,6 +184,105 @@ def test_sync_attachments_object_modified_date(
         db_mus_object.attachments[0].modified_date
 
 
+def test_sync_attachments_object_modified_date_newer(
+        sync_attachments, museum_object_factory, session):
+    """
+    Sync attachments with an older modification date than the related
+    object. The object's modification date should be kept.
+    """
+    museum_object_factory(
+        id=5,
+        modified_date=datetime.datetime(
+            2020, 1, 1, 12, 0, tzinfo=datetime.timezone.utc
+        )
+    )
+    session.commit()
+
+    sync_attachments([])
+
+    session.expire_all()
+    db_mus_object = session.query(MuseumObject).get(5)
+    assert db_mus_object.modified_date == datetime.datetime(
+        2020, 1, 1, 12, 0, tzinfo=datetime.timezone.utc
+    )
+
+    # Object 4 has no modification date of its own and inherits the date
+    # from attachment 13
+    db_mus_object = session.query(MuseumObject).get(4)
+    assert db_mus_object.modified_date == datetime.datetime(
+        2018, 1, 14, 12, 0, tzinfo=datetime.timezone.utc
+    )
+
+
+def test_sync_attachments_mark_objects_dirty(sync_attachments, session):
+    """
+    Sync an attachment and ensure both the previously and currently linked
+    objects are marked for 'sync_hashes'
+    """
+    def get_dirty_object_ids():
+        return sorted(
+            result.museum_object_id for result in
+            session.execute(dirty_museum_object_table.select())
+        )
+
+    sync_attachments([])
+
+    assert get_dirty_object_ids() == list(range(1, 11))
+
+    # Link attachment 19 to a different object without using the ORM
+    assoc = object_attachment_association_table
+    session.execute(dirty_museum_object_table.delete())
+    session.execute(assoc.delete().where(assoc.c.museum_attachment_id == 19))
+    session.execute(
+        assoc.insert().values(museum_object_id=1, museum_attachment_id=19)
+    )
+    session.commit()
+
+    # Sync attachments 19 and 20. Object 1 is marked because the attachment
+    # is no longer linked to it, and objects 9 and 10 because the attachment
+    # is linked to them again.
+    sync_attachments(["--offset", "8"])
+
+    assert get_dirty_object_ids() == [1, 9, 10]
+
+
+def test_sync_attachments_attachment_ids_update_hashes(
+        sync_attachments, session):
+    """
+    Sync an attachment given using '--attachment-ids' and ensure the hashes
+    of both the previously and currently linked objects are updated
+    immediately. Other changed objects are left for 'sync_hashes'.
+    """
+    sync_attachments([])
+
+    # Link attachment 19 to a different object without using the ORM
+    assoc = object_attachment_association_table
+    session.execute(dirty_museum_object_table.delete())
+    session.execute(assoc.delete().where(assoc.c.museum_attachment_id == 19))
+    session.execute(
+        assoc.insert().values(museum_object_id=1, museum_attachment_id=19)
+    )
+    session.execute(
+        dirty_museum_object_table.insert().values(museum_object_id=5)
+    )
+    session.commit()
+
+    result = sync_attachments(
+        ["--attachment-ids", "19", "--update-hashes"]
+    )
+
+    assert "3 changed objects processed, 3 updated" in result.stdout
+    for object_id in (1, 9, 10):
+        assert session.query(MuseumObject).get(object_id) \
+            .attachment_metadata_hash
+    assert not session.query(MuseumObject).get(5).attachment_metadata_hash
+
+    assert [
+        result.museum_object_id for result in
+        session.execute(dirty_museum_object_table.select())
+    ] == [5]
+
+
 def test_sync_attachments_offset(sync_attachments, session):
     """
     Sync only 4 attachments by using an offset
@@ -289,3 +396,97 @@ def test_sync_attachments_second_run_filter(
     assert sync_status.prev_start_sync_date == datetime.datetime(
         2019, 2, 2, tzinfo=datetime.timezone.utc
     )
+
+
+def test_sync_attachments_shards_shared_objects(
+        sync_attachments, session, monkeypatch):
+    """
+    Sync attachments using two concurrent shards, with attachments in both
+    shards linked to the same objects
+    """
+    date = datetime.datetime(2018, 1, 1, 12, 0, tzinfo=datetime.timezone.utc)
+    multimedia = [
+        {
+            "id": i,
+            "filename": f"test_{i}.jpg",
+            "modified_date": date + datetime.timedelta(days=i),
+            "created_date": date,
+            # Link the objects in a different order in each attachment
+            "object_ids": [1, 2, 3] if i % 2 == 0 else [3, 2, 1],
+            "xml_hash": hashlib.sha256(
+                f"Object {i}".encode("utf-8")
+            ).hexdigest()
+        }
+        for i in range(1, 21)
+    ]
+
+    async def mock_iterate_multimedia(session, offset=0, modify_date_gte=None):
+        for result in multimedia[offset:]:
+            yield result
+
+    monkeypatch.setattr(
+        "passari_workflow.scripts.sync_attachments.iterate_multimedia",
+        mock_iterate_multimedia
+    )
+
+    result = sync_attachments([
+        "--shards", "2", "--shard-window-size", "2", "--concurrency", "2"
+    ])
+    assert "Shard 2/2" in result.stdout
+    assert session.query(MuseumAttachment).count() == 20
+
+    # Each object has the modification date of the newest attachment
+    for object_id in (1, 2, 3):
+        museum_object = session.query(MuseumObject).get(object_id)
+        assert museum_object.modified_date == date + datetime.timedelta(
+            days=20
+        )
+        assert len(museum_object.attachments) == 20
+
+
+def test_update_object_modified_dates_locks_objects(
+        engine, session, museum_object_factory):
+    """
+    Test that every object linked to the attachments is locked, including
+    the objects that are not updated
+    """
+    date = datetime.datetime(2018, 1, 1, 12, 0, tzinfo=datetime.timezone.utc)
+
+    # Object 1 is already newer than the attachment and won't be updated
+    museum_object_factory(id=1, modified_date=date)
+    museum_object_factory(
+        id=2, modified_date=date - datetime.timedelta(days=2)
+    )
+    session.add(MuseumAttachment(
+        id=10, filename="test.jpg",
+        modified_date=date - datetime.timedelta(days=1)
+    ))
+    session.commit()
+    session.execute(
+        object_attachment_association_table.insert().values([
+            {"museum_object_id": 1, "museum_attachment_id": 10},
+            {"museum_object_id": 2, "museum_attachment_id": 10}
+        ])
+    )
+    session.commit()
+
+    conn = engine.connect()
+    trans = conn.begin()
+    db = DBSession(bind=conn)
+
+    try:
+        assert update_object_modified_dates(db, [10]) == [2]
+
+        # Both objects are locked until the transaction is finished
+        for object_id in (1, 2):
+            with pytest.raises(OperationalError):
+                session.execute(
+                    "SELECT id FROM museum_objects WHERE id = :id "
+                    "FOR UPDATE NOWAIT",
+                    {"id": object_id}
+                )
+            session.rollback()
+    finally:
+        db.close()
+        trans.rollback()
+        conn.close()
@@ -1,8 +1,11 @@
 import pytest
 
-from passari_workflow.scripts.sync_hashes import cli as sync_hashes_cli
+from passari_workflow.scripts.sync_hashes import (
+    cli as sync_hashes_cli, get_metadata_hash_for_attachments)
 
-from passari_workflow.db.models import MuseumObject
+from passari_workflow.db.models import (MuseumAttachment, MuseumObject,
+                                        dirty_museum_object_table,
+                                        mark_attachment_objects_dirty)
 
 
 @pytest.fixture(scope="function")
@@ -60,3 +63,118 @@ def test_sync_hashes(
     assert museum_object_a.attachment_metadata_hash == expected_hash
     assert museum_object_b.attachment_metadata_hash == ""
     assert museum_object_c.attachment_metadata_hash is None
+
+
+def test_sync_hashes_in_database(
+        sync_hashes, session, museum_object_factory,
+        museum_attachment_factory):
+    """
+    Sync objects using hashes calculated in the database and ensure the
+    results are identical to the hashes calculated in Python
+    """
+    museum_object_factory(
+        id=10,
+        attachments=[
+            museum_attachment_factory(
+                metadata_hash="a7c4f6c82ab5ed73a359c5d875a9870d899a0642922b6f852539d048676dac74"
+            ),
+            museum_attachment_factory(
+                metadata_hash="1568e677140ab834ebdbd98ffa092a273af66084eb04e13b9d07be493847b94f"
+            )
+        ]
+    )
+    museum_object_factory(id=20)
+    museum_object_factory(
+        id=30,
+        attachments=[
+            museum_attachment_factory(
+                metadata_hash="1568e677140ab834ebdbd98ffa092a273af66084eb04e13b9d07be493847b94f"
+            ),
+            museum_attachment_factory(metadata_hash=None)
+        ]
+    )
+    # Hashes that sort differently depending on the collation
+    attachments = [
+        museum_attachment_factory(metadata_hash=metadata_hash)
+        for metadata_hash in ("B", "a", "_", "b", "A")
+    ]
+    museum_object_factory(id=40, attachments=attachments)
+    # Object with an outdated hash
+    museum_object_factory(id=50, attachment_metadata_hash="outdated")
+
+    result = sync_hashes(["--in-database"])
+    assert "4 updated" in result.stdout
+
+    assert session.query(MuseumObject).get(10).attachment_metadata_hash == \
+        "be2c3265f2c8f4b05e287ac9fae8a25dad227bda2ebb60ac8dcc929d6b891c27"
+    assert session.query(MuseumObject).get(20).attachment_metadata_hash == ""
+    assert session.query(MuseumObject).get(30).attachment_metadata_hash \
+        is None
+    assert session.query(MuseumObject).get(40).attachment_metadata_hash == \
+        get_metadata_hash_for_attachments(attachments)
+    assert session.query(MuseumObject).get(50).attachment_metadata_hash == ""
+
+    # Nothing is updated on the second run
+    result = sync_hashes(["--in-database"])
+    assert "0 updated" in result.stdout
+
+
+def test_sync_hashes_changed_only(
+        sync_hashes, session, museum_object_factory,
+        museum_attachment_factory):
+    """
+    Sync hashes and ensure only objects marked as changed are updated unless
+    a full synchronization is performed
+    """
+    museum_object_factory(
+        id=10,
+        attachments=[museum_attachment_factory(id=100, metadata_hash="a")]
+    )
+    museum_object_factory(
+        id=20,
+        attachments=[museum_attachment_factory(id=200, metadata_hash="b")]
+    )
+    session.commit()
+
+    # Objects created using the ORM are marked automatically
+    result = sync_hashes([])
+    assert "2 iterated, 2 updated" in result.stdout
+    assert session.execute(dirty_museum_object_table.count()).scalar() == 0
+
+    hash_a = session.query(MuseumObject).get(10).attachment_metadata_hash
+    hash_b = session.query(MuseumObject).get(20).attachment_metadata_hash
+
+    # Change the attachment hashes without marking the objects.
+    # Nothing is updated.
+    session.execute(
+        MuseumAttachment.__table__.update().values(metadata_hash="c")
+    )
+    session.commit()
+
+    result = sync_hashes([])
+    assert "0 changed objects processed, 0 updated" in result.stdout
+
+    session.expire_all()
+    assert session.query(MuseumObject).get(10).attachment_metadata_hash \
+        == hash_a
+
+    # Mark the first object as changed
+    mark_attachment_objects_dirty(session, [100])
+    session.commit()
+
+    result = sync_hashes([])
+    assert "1 changed objects processed, 1 updated" in result.stdout
+
+    session.expire_all()
+    assert session.query(MuseumObject).get(10).attachment_metadata_hash \
+        != hash_a
+    assert session.query(MuseumObject).get(20).attachment_metadata_hash \
+        == hash_b
+
+    # Full synchronization updates the second object as well
+    result = sync_hashes(["--full"])
+    assert "2 iterated, 1 updated" in result.stdout
+
+    session.expire_all()
+    assert session.query(MuseumObject).get(20).attachment_metadata_hash \
+        != hash_b
@@ -3,7 +3,9 @@ import hashlib
 
 import pytest
 from passari_workflow.db.models import (MuseumAttachment, MuseumObject,
-                                               SyncStatus)
+                                               SyncStatus,
+                                               dirty_museum_object_table,
+                                               mark_objects_dirty)
 from passari_workflow.scripts.sync_objects import \
     cli as sync_objects_cli
 
@@ -139,8 +141,10 @@ def test_sync_objects(sync_objects, session):
     session.commit()
 
     result = sync_objects([])
+    # Only the entry with a changed modification date is updated
     assert "0 inserts" in result.stdout
-    assert "10 updates" in result.stdout
+    assert "1 updates" in result.stdout
+    assert "9 unchanged" in result.stdout
 
     db_museum_object = session.query(MuseumObject).get(5)
     assert db_museum_object.modified_date.timestamp() == datetime.datetime(
@@ -151,6 +155,102 @@ def test_sync_objects(sync_objects, session):
     assert db_museum_attachment.filename == "testFilename.tar"
 
 
+@pytest.fixture(scope="function")
+def synced_object_factory(museum_object_factory):
+    """
+    Create objects that have been synchronized before the latest changes
+    """
+    def func(object_id):
+        return museum_object_factory(
+            id=object_id, modified_date=datetime.datetime(
+                2018, 1, 1, 12, 0, tzinfo=datetime.timezone.utc
+            )
+        )
+
+    return func
+
+
+def test_sync_objects_object_ids(
+        sync_objects, session, synced_object_factory):
+    """
+    Sync objects given using '--object-ids' and '--object-ids-file'
+    """
+    for object_id in (3, 5, 7, 9):
+        synced_object_factory(object_id)
+
+    result = sync_objects(
+        ["--object-ids", "3,5", "--object-ids-file", "-"], input="7\n9\n"
+    )
+
+    assert "4 updates" in result.stdout
+    for object_id in (3, 5, 7, 9):
+        assert session.query(MuseumObject).get(object_id).title \
+            == f"Object {object_id}"
+
+    # Synchronization progress is not affected
+    assert not session.query(SyncStatus).get("sync_objects")
+
+
+def test_sync_objects_object_ids_update_hashes(
+        sync_objects, session, synced_object_factory):
+    """
+    Sync objects given using '--object-ids' and update the hashes
+    immediately. Only the given objects are updated.
+    """
+    synced_object_factory(3)
+    synced_object_factory(5)
+    mark_objects_dirty(session, [5])
+    session.commit()
+
+    result = sync_objects(["--object-ids", "3", "--update-hashes"])
+
+    assert "1 changed objects processed" in result.stdout
+
+    # Attachments haven't been synchronized yet, so the hash can't be
+    # calculated
+    assert session.query(MuseumObject).get(3).attachment_metadata_hash \
+        is None
+
+    # Other changed objects are left for 'sync_hashes'
+    assert [
+        result.museum_object_id for result in
+        session.execute(dirty_museum_object_table.select())
+    ] == [5]
+
+
+def test_sync_objects_object_ids_missing(
+        sync_objects, session, synced_object_factory):
+    """
+    Sync object IDs that don't exist in MuseumPlus and ensure the command
+    fails
+    """
+    synced_object_factory(3)
+    synced_object_factory(500)
+
+    result = sync_objects(["--object-ids", "3,500"], success=False)
+
+    assert "Entries not found in MuseumPlus: 500" in result.stdout
+    assert "1 objects were not found in MuseumPlus" in result.output
+    assert session.query(MuseumObject).get(3).title == "Object 3"
+
+
+def test_sync_objects_object_ids_not_synced(sync_objects, session):
+    """
+    Sync object IDs that haven't been synchronized yet and ensure the
+    command fails without iterating MuseumPlus
+    """
+    result = sync_objects(["--object-ids", "3"], success=False)
+
+    assert "1 entries haven't been synchronized" in result.output
+    assert session.query(MuseumObject).count() == 0
+
+
+def test_sync_objects_object_ids_invalid(sync_objects):
+    result = sync_objects(["--object-ids", "3,a"], success=False)
+
+    assert "Object IDs must be integers" in result.output
+
+
 def test_sync_objects_newer_modification_date(sync_objects, session):
     """
     Sync an object with a newer modification date and ensure it's
@@ -300,3 +400,72 @@ def test_sync_objects_second_run_filter(
     assert sync_status.prev_start_sync_date == datetime.datetime(
         2019, 2, 2, tzinfo=datetime.timezone.utc
     )
+
+
+def test_sync_objects_shards(sync_objects, session, freeze_time):
+    """
+    Sync objects using multiple shards and ensure every object is synced
+    """
+    freeze_time("2019-02-02")
+
+    result = sync_objects([
+        "--shards", "3", "--shard-window-size", "2", "--concurrency", "2"
+    ])
+
+    assert "Shard 3/3" in result.stdout
+    assert session.query(MuseumObject).count() == 10
+
+    # Shard progress is removed once the run is finished
+    sync_statuses = session.query(SyncStatus).all()
+    assert len(sync_statuses) == 1
+    assert sync_statuses[0].name == "sync_objects"
+    assert sync_statuses[0].offset == 0
+    assert not sync_statuses[0].start_sync_date
+    assert sync_statuses[0].prev_start_sync_date == datetime.datetime(
+        2019, 2, 2, tzinfo=datetime.timezone.utc
+    )
+
+
+def test_sync_objects_shards_save_progress(
+        sync_objects, session, mock_iterate_objects_crash):
+    """
+    Sync objects using multiple shards, with the synchronization being
+    interrupted every 3 objects. Ensure each shard continues from where it
+    stopped.
+    """
+    sync_objects([
+        "--shards", "2", "--shard-window-size", "4", "--concurrency", "1"
+    ], success=False)
+
+    # First shard processed 3 objects before the script stopped
+    sync_status = (
+        session.query(SyncStatus)
+        .filter_by(name="sync_objects_shard_1_of_2")
+        .one()
+    )
+    assert sync_status.offset == 3
+    assert session.query(MuseumObject).count() == 3
+
+    # First shard continues from offset 3 and finishes its first window,
+    # after which the second shard gets its turn and stops at offset 7
+    sync_objects([
+        "--shards", "2", "--shard-window-size", "4", "--concurrency", "1"
+    ], success=False)
+
+    assert session.query(MuseumObject).count() == 7
+
+    session.expire_all()
+    sync_statuses = {
+        sync_status.name: sync_status.offset
+        for sync_status in session.query(SyncStatus)
+    }
+    assert sync_statuses["sync_objects_shard_1_of_2"] == 8
+    assert sync_statuses["sync_objects_shard_2_of_2"] == 7
+
+    # Both shards finish their remaining windows
+    sync_objects([
+        "--shards", "2", "--shard-window-size", "4", "--concurrency", "1"
+    ])
+
+    assert session.query(MuseumObject).count() == 10
+    assert session.query(SyncStatus).count() == 1
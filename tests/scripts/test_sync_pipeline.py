@@ -0,0 +1,154 @@
+import asyncio
+import threading
+
+import pytest
+
+from passari_workflow.scripts.utils import (ChunkSizeController,
+                                            run_sync_pipeline)
+
+
+def run_pipeline(*args, **kwargs):
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(run_sync_pipeline(*args, **kwargs))
+
+
+def test_run_sync_pipeline():
+    """
+    Test that results are written in chunks while the next chunk is being
+    retrieved
+    """
+    second_chunk_started = threading.Event()
+
+    async def iterate():
+        for i in range(0, 5):
+            if i == 2:
+                second_chunk_started.set()
+
+            yield i
+
+    written = []
+
+    def write_chunk(results, iterated):
+        if not written:
+            # The first chunk is written while the second one is retrieved
+            assert second_chunk_started.wait(timeout=5)
+
+        written.append((results, iterated))
+
+    run_pipeline(iterate(), write_chunk, chunk_size=2)
+
+    assert written == [([0, 1], 2), ([2, 3], 4), ([4], 5), ([], 5)]
+
+
+def test_run_sync_pipeline_limit():
+    """
+    Test that iteration is stopped once the limit is reached
+    """
+    async def iterate():
+        for i in range(0, 10):
+            yield i
+
+    written = []
+
+    run_pipeline(
+        iterate(), lambda results, iterated: written.append(results),
+        chunk_size=2, limit=3
+    )
+
+    assert written == [[0, 1], [2], []]
+
+
+def test_run_sync_pipeline_interrupted():
+    """
+    Test that chunks retrieved before an interruption are written before
+    the exception is raised
+    """
+    async def iterate():
+        for i in range(0, 3):
+            yield i
+
+        raise KeyboardInterrupt()
+
+    written = []
+
+    with pytest.raises(KeyboardInterrupt):
+        run_pipeline(
+            iterate(), lambda results, iterated: written.append(results),
+            chunk_size=2
+        )
+
+    # The incomplete chunk is not written
+    assert written == [[0, 1]]
+
+
+def test_run_sync_pipeline_write_failure():
+    """
+    Test that a failed write stops the pipeline
+    """
+    async def iterate():
+        for i in range(0, 10):
+            yield i
+
+    def write_chunk(results, iterated):
+        raise ValueError("Write failed")
+
+    with pytest.raises(ValueError):
+        run_pipeline(iterate(), write_chunk, chunk_size=2)
+
+
+def test_run_sync_pipeline_chunk_size_controller():
+    """
+    Test that the chunk size is read from the controller for each chunk
+    """
+    async def iterate():
+        for i in range(0, 7):
+            yield i
+
+    chunk_size = ChunkSizeController(2, min_size=1, max_size=10)
+    written = []
+
+    def write_chunk(results, iterated):
+        written.append(results)
+        chunk_size.size += 1
+
+    # Only one chunk is retrieved ahead of the write
+    run_pipeline(iterate(), write_chunk, chunk_size=chunk_size, queue_size=1)
+
+    assert [len(results) for results in written[:2]] == [2, 2]
+    assert sum(written, []) == list(range(0, 7))
+
+
+def test_chunk_size_controller():
+    """
+    Test that the chunk size is scaled towards the target time within
+    the bounds
+    """
+    chunk_size = ChunkSizeController(
+        100, min_size=50, max_size=300, target_time=2
+    )
+
+    # Chunk took half the target time
+    assert chunk_size.update(100, 1) == 200
+    # Size is limited to the maximum
+    assert chunk_size.update(200, 0.1) == 300
+
+    # Chunk took much longer than the target. Size is halved at most.
+    assert chunk_size.update(300, 60) == 150
+    assert chunk_size.update(150, 60) == 75
+    # Size is limited to the minimum
+    assert chunk_size.update(75, 60) == 50
+
+    # Incomplete chunks that were fast enough don't change the size
+    assert chunk_size.update(10, 0.01) == 50
+
+
+def test_chunk_size_controller_disabled():
+    """
+    Test that the chunk size is not changed if the target time is zero
+    """
+    chunk_size = ChunkSizeController(
+        3, min_size=50, max_size=300, target_time=0
+    )
+
+    assert chunk_size.size == 3
+    assert chunk_size.update(3, 60) == 3
@@ -0,0 +1,42 @@
+import pytest
+from passari_workflow.scripts.sync_stats import cli as sync_stats_cli
+from passari_workflow.sync.metrics import SyncMetrics, save_sync_run
+
+
+@pytest.fixture(scope="function")
+def sync_stats(cli):
+    def func(args, **kwargs):
+        return cli(sync_stats_cli, args, **kwargs)
+
+    return func
+
+
+def test_sync_stats(sync_stats):
+    metrics = SyncMetrics("sync_objects")
+    metrics.add_chunk(
+        inserts=5, updates=0, unchanged=0, write_time=1.0,
+        phase_times={"fetch": 2.5, "upsert": 0.75}, statements=6
+    )
+    save_sync_run(metrics.get_summary("finished"))
+    save_sync_run(SyncMetrics("sync_attachments").get_summary("failed"))
+
+    result = sync_stats([])
+    lines = result.stdout.strip().split("\n")
+
+    assert len(lines) == 3
+    assert "fetch" in lines[0]
+    assert "after_update" in lines[0]
+    assert "sync_attachments" in lines[1]
+    assert "failed" in lines[1]
+    assert "sync_objects" in lines[2]
+    assert "2.50" in lines[2]
+    assert "0.75" in lines[2]
+
+    result = sync_stats(["--name", "sync_objects"])
+    assert "sync_attachments" not in result.stdout
+
+
+def test_sync_stats_empty(sync_stats):
+    result = sync_stats([])
+
+    assert "No synchronization runs found" in result.stdout
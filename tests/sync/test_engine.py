@@ -0,0 +1,295 @@
+import asyncio
+import datetime
+import json
+import logging
+
+import pytest
+from passari_workflow.db.models import MuseumAttachment
+from passari_workflow.exceptions import SyncFetchError
+from passari_workflow.heartbeat import HeartbeatSource, get_heartbeats
+from passari_workflow.sync.engine import SyncAdapter, run_resync, run_sync
+from passari_workflow.sync.metrics import PHASES, get_sync_runs
+
+
+class FilenameSyncAdapter(SyncAdapter):
+    """
+    Minimal adapter that only synchronizes attachment filenames
+    """
+    name = "sync_filenames"
+    heartbeat_source = HeartbeatSource.SYNC_ATTACHMENTS
+
+    model = MuseumAttachment
+    columns = ["id", "filename"]
+    update_columns = ["filename"]
+
+    def __init__(self, results, crash_after=None):
+        self.results = results
+        self.crash_after = crash_after
+        self.updated_ids = []
+        self.iterate_calls = []
+
+    def iterate(self, museum_session, offset, modify_date_gte):
+        self.iterate_calls.append((offset, modify_date_gte))
+
+        async def iterate():
+            results = [
+                result for result in self.results
+                if not modify_date_gte
+                or not result["modified_date"]
+                or result["modified_date"] >= modify_date_gte
+            ]
+            for i, result in enumerate(results[offset:]):
+                if i == self.crash_after:
+                    raise KeyboardInterrupt()
+
+                yield result
+
+        return iterate()
+
+    def get_row(self, result):
+        return (result["id"], result["filename"])
+
+    def after_update(self, db, upserted, added, removed):
+        self.updated_ids += sorted(entry_id for entry_id, _ in upserted)
+
+
+def test_run_sync_custom_adapter(session, museum_attachment_factory, capsys):
+    """
+    Test synchronizing entries using an adapter without associations
+    """
+    museum_attachment_factory(id=2, filename="old.jpg")
+    session.commit()
+
+    adapter = FilenameSyncAdapter([
+        {"id": i, "filename": f"test{i}.jpg", "modified_date": None}
+        for i in range(1, 6)
+    ])
+
+    loop = asyncio.get_event_loop()
+    metrics = loop.run_until_complete(
+        run_sync(adapter, offset=1, chunk_size=2)
+    )
+
+    assert metrics.chunks == 2
+    assert metrics.inserts == 3
+    assert metrics.updates == 1
+    assert adapter.updated_ids == [2, 3, 4, 5]
+
+    session.expire_all()
+    assert sorted(
+        (attachment.id, attachment.filename)
+        for attachment in session.query(MuseumAttachment)
+    ) == [
+        (2, "test2.jpg"), (3, "test3.jpg"), (4, "test4.jpg"),
+        (5, "test5.jpg")
+    ]
+
+    assert "Updated, 1 inserts, 1 updates" in capsys.readouterr().out
+    assert get_heartbeats()[HeartbeatSource.SYNC_ATTACHMENTS]
+
+
+def run(coro):
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(coro)
+
+
+def test_run_sync_resume_offset(session):
+    """
+    Test that an interrupted run is continued from the saved offset
+    """
+    results = [
+        {"id": i, "filename": f"test{i}.jpg", "modified_date": None}
+        for i in range(1, 6)
+    ]
+
+    adapter = FilenameSyncAdapter(results, crash_after=3)
+    with pytest.raises(KeyboardInterrupt):
+        run(run_sync(adapter, save_progress=True, chunk_size=3))
+
+    adapter = FilenameSyncAdapter(results)
+    run(run_sync(adapter, save_progress=True, chunk_size=3))
+
+    assert adapter.iterate_calls == [(3, None)]
+    assert adapter.updated_ids == [4, 5]
+
+
+def test_run_resync(session, museum_attachment_factory):
+    """
+    Test synchronizing the given entries using the default 'fetch'
+    implementation
+    """
+    date = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    results = [
+        {
+            "id": i, "filename": f"test{i}.jpg",
+            "modified_date": date + datetime.timedelta(days=i)
+        }
+        for i in range(1, 9)
+    ]
+    for result in results:
+        museum_attachment_factory(
+            id=result["id"], filename="old.jpg",
+            modified_date=result["modified_date"]
+        )
+    session.commit()
+
+    adapter = FilenameSyncAdapter(results)
+    metrics, missing_ids = run(run_resync(adapter, [6, 4, 4], chunk_size=1))
+
+    assert missing_ids == []
+    assert metrics.updates == 2
+    assert adapter.updated_ids == [4, 6]
+
+    # Only the entries modified since the earliest entry were iterated
+    assert adapter.iterate_calls == [(0, date + datetime.timedelta(days=4))]
+
+    session.expire_all()
+    assert session.query(MuseumAttachment).get(4).filename == "test4.jpg"
+    assert session.query(MuseumAttachment).get(5).filename == "old.jpg"
+
+
+def test_run_resync_undated_entries(session, museum_attachment_factory):
+    """
+    Test that synchronizing entries that haven't been synchronized yet or
+    have no modification date fails without iterating MuseumPlus
+    """
+    museum_attachment_factory(id=1, filename="old.jpg", modified_date=None)
+    session.commit()
+
+    results = [
+        {"id": i, "filename": f"test{i}.jpg", "modified_date": None}
+        for i in range(1, 4)
+    ]
+
+    adapter = FilenameSyncAdapter(results)
+    with pytest.raises(SyncFetchError) as exc:
+        run(run_resync(adapter, [1, 2]))
+
+    assert "2 entries haven't been synchronized" in str(exc.value)
+    assert adapter.iterate_calls == []
+    assert adapter.updated_ids == []
+
+
+def test_run_resync_scan_limit(session, museum_attachment_factory):
+    """
+    Test that synchronizing entries fails without iterating MuseumPlus if
+    too many entries have been modified since
+    """
+    date = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    results = [
+        {
+            "id": i, "filename": f"test{i}.jpg",
+            "modified_date": date + datetime.timedelta(days=i)
+        }
+        for i in range(1, 9)
+    ]
+    for result in results:
+        museum_attachment_factory(
+            id=result["id"], filename="old.jpg",
+            modified_date=result["modified_date"]
+        )
+    session.commit()
+
+    adapter = FilenameSyncAdapter(results)
+    adapter.fetch_scan_limit = 3
+
+    # Entries 6, 7 and 8 have been modified since entry 6
+    run(run_resync(adapter, [6]))
+    assert adapter.updated_ids == [6]
+
+    # Entries 5 to 8 have been modified since entry 5
+    with pytest.raises(SyncFetchError) as exc:
+        run(run_resync(adapter, [5]))
+
+    assert "More than 3 entries" in str(exc.value)
+    # MuseumPlus was only iterated for the first run
+    assert len(adapter.iterate_calls) == 1
+
+
+def test_run_resync_scan_limit_iterated(session, museum_attachment_factory):
+    """
+    Test that iterating MuseumPlus is stopped once the scan limit is reached
+    """
+    date = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    museum_attachment_factory(id=1, filename="old.jpg", modified_date=date)
+    session.commit()
+
+    # Entries that haven't been synchronized yet come first
+    results = [
+        {"id": i, "filename": f"test{i}.jpg", "modified_date": None}
+        for i in range(10, 20)
+    ] + [{"id": 1, "filename": "test1.jpg", "modified_date": date}]
+
+    adapter = FilenameSyncAdapter(results)
+    adapter.fetch_scan_limit = 4
+
+    with pytest.raises(SyncFetchError) as exc:
+        run(run_resync(adapter, [1]))
+
+    assert "1 entries were not found within 4 entries" in str(exc.value)
+    assert adapter.updated_ids == []
+
+
+@pytest.fixture(scope="function")
+def metrics_logger(monkeypatch):
+    """
+    Ensure the metrics logger is enabled, as configuring logging elsewhere
+    (eg. running migrations) may have disabled it
+    """
+    logger = logging.getLogger("passari_workflow.sync.metrics")
+    monkeypatch.setattr(logger, "disabled", False)
+
+    return logger
+
+
+def test_run_sync_timings(session, caplog, metrics_logger):
+    """
+    Test that the time spent in each phase is logged for each chunk and
+    saved for the run
+    """
+    adapter = FilenameSyncAdapter([
+        {"id": i, "filename": f"test{i}.jpg", "modified_date": None}
+        for i in range(1, 6)
+    ])
+
+    with caplog.at_level(logging.INFO, logger="passari_workflow.sync"):
+        metrics = run(run_sync(adapter, chunk_size=2))
+
+    chunk_logs = [
+        json.loads(record.getMessage()) for record in caplog.records
+        if "sync_chunk" in record.getMessage()
+    ]
+    assert [log["chunk"] for log in chunk_logs] == [1, 2, 3]
+    assert [log["entries"] for log in chunk_logs] == [2, 2, 1]
+    assert all(log["statements"] > 0 for log in chunk_logs)
+    assert all(log["phases"]["upsert"] > 0 for log in chunk_logs)
+
+    assert metrics.statements == sum(log["statements"] for log in chunk_logs)
+    assert metrics.phase_times["fetch"] >= 0
+    # No associations are defined
+    assert metrics.phase_times["associations"] == 0
+
+    summary = get_sync_runs()[0]
+    assert summary["name"] == "sync_filenames"
+    assert summary["status"] == "finished"
+    assert summary["entries"] == 5
+    assert summary["chunks"] == 3
+    assert summary["statements"] == metrics.statements
+    assert set(summary["phases"].keys()) == set(PHASES)
+
+
+def test_run_sync_timings_interrupted(session):
+    """
+    Test that the summary is saved for an interrupted run
+    """
+    adapter = FilenameSyncAdapter([
+        {"id": i, "filename": f"test{i}.jpg", "modified_date": None}
+        for i in range(1, 6)
+    ], crash_after=3)
+
+    with pytest.raises(KeyboardInterrupt):
+        run(run_sync(adapter, chunk_size=2))
+
+    summary = get_sync_runs()[0]
+    assert summary["status"] == "failed"
+    assert summary["entries"] == 2
@@ -0,0 +1,87 @@
+import json
+import logging
+
+from passari_workflow.sync.metrics import (SYNC_RUN_HISTORY_SIZE,
+                                           SyncMetrics, configure_logging,
+                                           get_sync_runs, log_chunk,
+                                           save_sync_run)
+
+
+def test_sync_metrics_add_chunk():
+    metrics = SyncMetrics("sync_objects")
+    metrics.add_chunk(
+        inserts=2, updates=1, unchanged=3, write_time=0.5,
+        phase_times={"fetch": 1.0, "upsert": 0.25}, statements=4
+    )
+    metrics.add_chunk(
+        inserts=1, updates=0, unchanged=0, write_time=0.5,
+        phase_times={"upsert": 0.25}, statements=4
+    )
+
+    summary = metrics.get_summary(status="finished")
+
+    assert summary["name"] == "sync_objects"
+    assert summary["chunks"] == 2
+    assert summary["entries"] == 7
+    assert summary["inserts"] == 3
+    assert summary["unchanged"] == 3
+    assert summary["statements"] == 8
+    assert summary["phases"]["fetch"] == 1.0
+    assert summary["phases"]["upsert"] == 0.5
+    assert summary["rows_per_second"] > 0
+
+
+def test_get_sync_runs(redis):
+    for i in range(0, 3):
+        save_sync_run(
+            dict(SyncMetrics("sync_objects").get_summary("finished"), chunks=i)
+        )
+    save_sync_run(SyncMetrics("sync_attachments").get_summary("failed"))
+
+    summaries = get_sync_runs()
+    # Newest runs are returned first
+    assert [summary["name"] for summary in summaries] == [
+        "sync_attachments", "sync_objects", "sync_objects", "sync_objects"
+    ]
+
+    summaries = get_sync_runs(count=2, name="sync_objects")
+    assert [summary["chunks"] for summary in summaries] == [2, 1]
+
+
+def test_save_sync_run_history_size(redis):
+    for i in range(0, SYNC_RUN_HISTORY_SIZE + 5):
+        save_sync_run(
+            dict(SyncMetrics("sync_objects").get_summary("finished"), chunks=i)
+        )
+
+    summaries = get_sync_runs(count=SYNC_RUN_HISTORY_SIZE + 5)
+    assert len(summaries) == SYNC_RUN_HISTORY_SIZE
+    assert summaries[0]["chunks"] == SYNC_RUN_HISTORY_SIZE + 4
+
+
+def test_configure_logging(monkeypatch, capsys):
+    """
+    Test that the log lines of each chunk are printed once logging is
+    configured
+    """
+    # Start without any logging configuration
+    monkeypatch.setattr(logging.root, "handlers", [])
+    monkeypatch.setattr(logging.root, "level", logging.WARNING)
+    monkeypatch.setattr(
+        logging.getLogger("passari_workflow.sync.metrics"), "disabled", False
+    )
+
+    configure_logging()
+
+    log_chunk(
+        name="sync_objects", chunk=1, entries=2, inserts=2, updates=0,
+        unchanged=0, write_time=0.5, phase_times={"upsert": 0.25},
+        statements=4
+    )
+
+    line = capsys.readouterr().err.strip()
+    assert "passari_workflow.sync.metrics" in line
+
+    data = json.loads(line[line.index("{"):])
+    assert data["event"] == "sync_chunk"
+    assert data["entries"] == 2
@@ -0,0 +1,75 @@
+import pytest
+from passari_workflow.config import CONFIG
+from passari_workflow.redis.connection import (get_connection_pool,
+                                               get_redis_connection)
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+
+def test_get_redis_connection_shared_pool():
+    """
+    Test that the same connection pool is shared by every client for the
+    same database
+    """
+    redis_a = get_redis_connection()
+    redis_b = get_redis_connection()
+
+    assert redis_a is not redis_b
+    assert redis_a.connection_pool is redis_b.connection_pool
+
+    # Each database has its own pool
+    redis_c = get_redis_connection(db=1)
+    assert redis_c.connection_pool is not redis_a.connection_pool
+    assert redis_c.connection_pool.connection_kwargs["db"] == 1
+
+
+def test_get_connection_pool_options(monkeypatch):
+    """
+    Test that the connection pool options are read from the configuration
+    """
+    monkeypatch.setitem(CONFIG["redis"], "max_connections", 7)
+    monkeypatch.setitem(CONFIG["redis"], "socket_keepalive", "false")
+    monkeypatch.setitem(CONFIG["redis"], "health_check_interval", 5)
+    monkeypatch.setitem(CONFIG["redis"], "pool_timeout", 3)
+
+    pool = get_connection_pool()
+
+    assert pool.max_connections == 7
+    assert pool.timeout == 3
+    assert pool.connection_kwargs["socket_keepalive"] is False
+    assert pool.connection_kwargs["health_check_interval"] == 5
+
+    # Same pool is returned once the options stay the same
+    assert get_connection_pool() is pool
+
+
+def test_get_connection_pool_exhausted(monkeypatch):
+    """
+    Test that the connection pool waits for a free connection once every
+    connection is in use
+    """
+    monkeypatch.setitem(CONFIG["redis"], "max_connections", 1)
+    monkeypatch.setitem(CONFIG["redis"], "pool_timeout", 0.1)
+
+    pool = get_connection_pool()
+
+    # Take the only connection slot
+    pool.pool.get_nowait()
+
+    with pytest.raises(RedisConnectionError) as exc:
+        pool.get_connection("PING")
+
+    assert "No connection available" in str(exc.value)
+
+
+def test_get_connection_pool_fork(monkeypatch):
+    """
+    Test that a new connection pool is created in a forked process
+    """
+    pool = get_connection_pool()
+
+    monkeypatch.setattr(
+        "passari_workflow.redis.connection.os.getpid", lambda: -1
+    )
+
+    assert get_connection_pool() is not pool
+    assert get_connection_pool() is get_connection_pool()